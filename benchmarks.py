@@ -0,0 +1,341 @@
+"""
+    Benchmarks of the model building pipeline, run
+    python benchmarks.py <name> -h
+    for the options of each benchmark.
+    -src allows to benchmark a different checkout of bmw_solver_qprogmods,
+    which is useful for comparing against older revisions.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+FOLDER = "vehicle_config"
+BUILD_FILE = "buildability_constraints.txt"
+TEST_FILE = "test_requirements.txt"
+
+
+def _timeit(fun, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = fun()
+        times.append(perf_counter() - start)
+    return min(times), result
+
+
+def _renumber(token, f_offset):
+    if token.startswith("~F"):
+        return f"~F{int(token[2:]) + f_offset}"
+    if token.startswith("F"):
+        return f"F{int(token[1:]) + f_offset}"
+    return token
+
+
+def _renumber_line(line, f_offset):
+    # operators are not always separated by spaces, e.g. "(F1|F2)"
+    for op in "()|&":
+        line = line.replace(op, f" {op} ")
+    return " ".join(_renumber(token, f_offset) for token in line.split())
+
+
+def enlarge_instance(folder, scale, out_folder):
+    """
+    Writes instance with scale disjoint copies of the types and features.
+    Copy k has types T{k*types_no + t} and features F{k*features_no + f}.
+    """
+    with open(os.path.join(folder, BUILD_FILE)) as file:
+        lines = [line.rstrip() for line in file]
+    types_no = int(lines[1].split(":")[1])
+    features_no = int(lines[2].split(":")[1])
+    rules_start = lines.index("Rules per typ:")
+    groups_start = next(i for i, line in enumerate(lines) if line.startswith("group features"))
+
+    result = [lines[0], f"Cartypes: {types_no*scale}",
+              f"Features: {features_no*scale}", lines[3]]
+    for block, start, end in [("tvars", 4, rules_start),
+                              ("rules", rules_start + 1, groups_start),
+                              ("groups", groups_start + 1, len(lines))]:
+        if block == "rules":
+            result.append(lines[rules_start])
+        elif block == "groups":
+            result.append(lines[groups_start])
+        for k in range(scale):
+            for line in lines[start:end]:
+                if block == "groups":
+                    result.append(_renumber_line(line, k*features_no))
+                    continue
+                t_case, rest = line.split(":", 1)
+                t = int(t_case.strip()[1:]) + k*types_no
+                result.append(f"T{t} : {_renumber_line(rest, k*features_no)}")
+
+    with open(os.path.join(folder, TEST_FILE)) as file:
+        test_lines = [line.rstrip() for line in file]
+    tests = test_lines[:2]
+    for k in range(scale):
+        for line in test_lines[2:]:
+            q, rest = line.split(":")
+            tests.append(f"{q.strip()} : {_renumber_line(rest, k*features_no)}")
+
+    os.makedirs(out_folder, exist_ok=True)
+    with open(os.path.join(out_folder, BUILD_FILE), "w") as file:
+        file.write("\n".join(result) + "\n")
+    with open(os.path.join(out_folder, TEST_FILE), "w") as file:
+        file.write("\n".join(tests) + "\n")
+    return out_folder
+
+
+def bench_parse(args):
+    from bmw_solver_qprogmods import BMWProblem
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales:
+            folder = FOLDER
+            if scale > 1:
+                folder = enlarge_instance(FOLDER, scale, os.path.join(tmp, f"x{scale}"))
+            build = os.path.join(folder, BUILD_FILE)
+            test = os.path.join(folder, TEST_FILE)
+            t, problem = _timeit(lambda: BMWProblem(build, test), args.repeat)
+            print(f"scale {scale:3d}: types {len(problem.tvars):5d} features {problem.features_no:6d} "
+                  f"rules {len(problem.if_constraints):6d} tests {len(problem.tests):6d} parse {t:8.3f}s")
+
+
+def _weighted_problem(folder=FOLDER):
+    from bmw_solver_qprogmods import BMWProblem
+
+    problem = BMWProblem(os.path.join(folder, BUILD_FILE), os.path.join(folder, TEST_FILE))
+    for test in problem.tests:
+        test.weight = 1
+    return problem
+
+
+def bench_cqm(args):
+    from bmw_solver_qprogmods import BMWIntegerProgramMAXSAT
+
+    problem = _weighted_problem()
+    problem.compile()
+    for nv in args.nv:
+        bmw_ip = BMWIntegerProgramMAXSAT(problem, nv, consider_count=True)
+        t_old, cqm = _timeit(lambda: bmw_ip.export_dimod(), args.repeat)
+        t_bulk, _ = _timeit(lambda: bmw_ip.export_dimod(bulk=True), args.repeat)
+        print(f"nv {nv:3d}: variables {len(cqm.variables):7d} constraints {len(cqm.constraints):7d} "
+              f"export_dimod {t_old:8.3f}s bulk {t_bulk:8.3f}s speedup {t_old/t_bulk:6.2f}x")
+
+
+def bench_build(args):
+    from bmw_solver_qprogmods import BMWIntegerProgramMAXSAT
+
+    problem = _weighted_problem()
+    problem.compile()
+    for nv in args.nv:
+        bmw_ip = BMWIntegerProgramMAXSAT(problem, nv, consider_count=True, integer_labels=True)
+        t_bqm, _ = _timeit(lambda: bmw_ip.export_pyqubo(strength=1000, native=True), args.repeat)
+        t_cqm, _ = _timeit(lambda: bmw_ip.export_dimod(bulk=True), args.repeat)
+        t_lp, _ = _timeit(lambda: bmw_ip.export_pulp(), args.repeat)
+        print(f"nv {nv:3d}: bqm {t_bqm:8.3f}s cqm {t_cqm:8.3f}s pulp {t_lp:8.3f}s "
+              f"per vehicle {t_bqm/nv:6.3f}s {t_cqm/nv:6.3f}s {t_lp/nv:6.3f}s")
+
+
+def bench_feat_per_type(args):
+    import pulp
+    from bmw_solver_qprogmods import BMWIntegerProgramMAXSAT
+    from bmw_solver_qprogmods.general_ip_constraints import FEAT_PER_TYPE_FORMULATIONS
+
+    problem = _weighted_problem()
+    problem.compile()
+    for formulation in FEAT_PER_TYPE_FORMULATIONS:
+        bmw_ip = BMWIntegerProgramMAXSAT(problem, args.nv, consider_count=True, integer_labels=True,
+                                         feat_per_type=formulation)
+        t_cqm, cqm = _timeit(lambda: bmw_ip.export_dimod(bulk=True), args.repeat)
+        t_lp, lp = _timeit(lambda: bmw_ip.export_pulp(), args.repeat)
+        nonzeros = sum(len(c.lhs.linear) for c in cqm.constraints.values())
+        line = (f"{formulation:8s}: constraints {len(cqm.constraints):7d} nonzeros {nonzeros:8d} "
+                f"cqm {t_cqm:8.3f}s pulp {t_lp:8.3f}s")
+        if args.solver is not None:
+            lp.solve(pulp.getSolver(args.solver, msg=False, timeLimit=args.time_limit))
+            line += f" solve {lp.solutionTime:8.3f}s objective {lp.objective.value()}"
+        print(line)
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def _peak_rss_mb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def _export_rss(model, nv):
+    from bmw_solver_qprogmods import BMWIntegerProgramMAXSAT
+
+    problem = _weighted_problem()
+    problem.compile()
+    bmw_ip = BMWIntegerProgramMAXSAT(problem, nv, consider_count=True, integer_labels=True)
+    base = _peak_rss_mb()
+    if model == "bqm":
+        result = bmw_ip.export_pyqubo(strength=1000, native=True)
+    elif model == "cqm":
+        result = bmw_ip.export_dimod(bulk=True)
+    else:
+        result = bmw_ip.export_pulp()
+    return base, _peak_rss_mb(), _rss_mb()
+
+
+def bench_rss(args):
+    # fresh process for each model, peak RSS can't be reset
+    context = multiprocessing.get_context("spawn")
+    for model in args.models:
+        with context.Pool(1) as pool:
+            base, peak, final = pool.apply(_export_rss, (model, args.nv))
+        print(f"{model:5s} nv {args.nv:3d}: before export {base:8.1f}MB peak {peak:8.1f}MB "
+              f"after export {final:8.1f}MB peak increase {peak - base:8.1f}MB")
+
+
+def _auxiliary_factors(bqm, strength):
+    """
+    Returns dict auxiliary variable of a reduced cubic term -> its factors.
+    BQMBuilder labels them "a * b", pyqubo by index, e.g. "0*1", then the
+    factors are the neighbours coupled by -2*strength in the penalty of the
+    reduction.
+    """
+    from bmw_solver_qprogmods.export_stats import variable_kind
+
+    result = dict()
+    for v in bqm.variables:
+        if variable_kind(v) != "aux":
+            continue
+        if " * " in v:
+            result[v] = v.split(" * ")
+            continue
+        factors = [u for u, bias in bqm.adj[v].items() if np.isclose(bias, -2*strength)]
+        if len(factors) != 2:
+            raise ValueError(f"Can't find the factors of the auxiliary variable {v}")
+        result[v] = factors
+    return result
+
+
+def _random_samples(labels, index, samples, rng, factors):
+    """
+    Returns array of random samples of labels, index maps labels to columns.
+    Auxiliary variables of the reduced cubic terms, keys of factors, are set
+    to the product of their factors.
+    """
+    result = rng.integers(2, size=(samples, len(labels)), dtype=np.int8)
+    done = set()
+
+    def fill(v):
+        if v in done:
+            return
+        done.add(v)
+        for u in factors[v]:
+            if u in factors:
+                fill(u)
+        result[:, index[v]] = np.prod(result[:, [index[u] for u in factors[v]]], axis=1)
+
+    for v in factors:
+        fill(v)
+    return result
+
+
+def _energies(bqm, samples, index):
+    columns = [index[v] for v in bqm.variables]
+    return bqm.energies((samples[:, columns], list(bqm.variables)))
+
+
+def bench_bqm_equivalence(args):
+    from bmw_solver_qprogmods import BMWIntegerProgramMAXSAT
+
+    problem = _weighted_problem()
+    problem.compile()
+    rng = np.random.default_rng(args.seed)
+    for slack_free in [False, True]:
+        bmw_ip = BMWIntegerProgramMAXSAT(problem, args.nv, consider_count=True)
+        options = dict(strength=args.strength, slack_free=slack_free)
+        t_pyqubo, pyqubo_parts = _timeit(lambda: bmw_ip.export_pyqubo(native=False, **options), 1)
+        t_native, native_parts = _timeit(lambda: bmw_ip.export_pyqubo(native=True, **options), 1)
+        for part, pyqubo_bqm in pyqubo_parts.dicts.items():
+            native_bqm = native_parts.dicts[part]
+            labels = sorted(set(pyqubo_bqm.variables) | set(native_bqm.variables), key=str)
+            index = {v: k for k, v in enumerate(labels)}
+            factors = {**_auxiliary_factors(pyqubo_bqm, args.strength),
+                       **_auxiliary_factors(native_bqm, args.strength)}
+            samples = _random_samples(labels, index, args.samples, rng, factors)
+            difference = np.abs(_energies(pyqubo_bqm, samples, index) - _energies(native_bqm, samples, index))
+            only_one = set(pyqubo_bqm.variables) ^ set(native_bqm.variables)
+            auxiliary = sum(1 for v in only_one if v in factors)
+            print(f"slack_free {slack_free!s:5s} {part:15s}: variables {len(labels):7d} "
+                  f"in one model only {len(only_one) - auxiliary:5d} (auxiliary {auxiliary:5d}) "
+                  f"max energy difference {difference.max():10.3e}")
+        print(f"slack_free {slack_free!s:5s}: pyqubo {t_pyqubo:8.3f}s native {t_native:8.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-src", type=str, default=None,
+                        help="Folder containing bmw_solver_qprogmods to benchmark. Default is this checkout.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parse_parser = subparsers.add_parser("parse", help="Parsing of the input files.")
+    parse_parser.add_argument("-scales", type=int, nargs="+", default=[1, 10],
+                              help="Number of copies of types and features. Default is 1 10.")
+    parse_parser.add_argument("-repeat", type=int, default=3,
+                              help="Number of repetitions, the best time is reported. Default is 3.")
+    parse_parser.set_defaults(run=bench_parse)
+
+    cqm_parser = subparsers.add_parser("cqm", help="Export of the MAXSAT problem to dimod.")
+    cqm_parser.add_argument("-nv", type=int, nargs="+", default=[1, 5, 20],
+                            help="Numbers of vehicles. Default is 1 5 20.")
+    cqm_parser.add_argument("-repeat", type=int, default=1,
+                            help="Number of repetitions, the best time is reported. Default is 1.")
+    cqm_parser.set_defaults(run=bench_cqm)
+
+    build_parser = subparsers.add_parser("build", help="Export of the MAXSAT problem to all models.")
+    build_parser.add_argument("-nv", type=int, nargs="+", default=[1, 5, 20],
+                              help="Numbers of vehicles. Default is 1 5 20.")
+    build_parser.add_argument("-repeat", type=int, default=1,
+                              help="Number of repetitions, the best time is reported. Default is 1.")
+    build_parser.set_defaults(run=bench_build)
+
+    fpt_parser = subparsers.add_parser("feat_per_type", help="Formulations of forbidden features.")
+    fpt_parser.add_argument("-nv", type=int, default=1,
+                            help="Number of vehicles. Default is 1.")
+    fpt_parser.add_argument("-solver", type=str, default=None,
+                            help="pulp solver used to solve the models, e.g. PULP_CBC_CMD or GUROBI_CMD. "
+                                 "Default is no solving.")
+    fpt_parser.add_argument("-time_limit", type=int, default=None,
+                            help="Time limit of the solver in seconds. Default is no limit.")
+    fpt_parser.add_argument("-repeat", type=int, default=1,
+                            help="Number of repetitions, the best time is reported. Default is 1.")
+    fpt_parser.set_defaults(run=bench_feat_per_type)
+
+    rss_parser = subparsers.add_parser("rss", help="Peak memory of the exports of the MAXSAT problem.")
+    rss_parser.add_argument("-nv", type=int, default=20,
+                            help="Number of vehicles. Default is 20.")
+    rss_parser.add_argument("-models", type=str, nargs="+", default=["bqm", "cqm", "pulp"],
+                            choices=["bqm", "cqm", "pulp"], help="Exports to measure. Default is all.")
+    rss_parser.set_defaults(run=bench_rss)
+
+    eq_parser = subparsers.add_parser("bqm_equivalence",
+                                      help="Energies of the native and pyqubo BQMs on random samples.")
+    eq_parser.add_argument("-nv", type=int, default=1,
+                           help="Number of vehicles. Default is 1.")
+    eq_parser.add_argument("-samples", type=int, default=100,
+                           help="Number of random samples. Default is 100.")
+    eq_parser.add_argument("-strength", type=float, default=1000,
+                           help="Strength of the reduction of cubic terms. Default is 1000.")
+    eq_parser.add_argument("-seed", type=int, default=0,
+                           help="Seed of the random samples. Default is 0.")
+    eq_parser.set_defaults(run=bench_bqm_equivalence)
+
+    args = parser.parse_args()
+    if args.src is not None:
+        sys.path.insert(0, os.path.abspath(args.src))
+    args.run(args)
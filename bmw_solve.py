@@ -1,22 +1,33 @@
+import logging
 import os
 import pickle
+import tempfile
 from random import uniform
 
 import dimod
 from dwave.system.samplers.leap_hybrid_sampler import LeapHybridSampler
 import neal
-import pulp
 from bmw_solver_qprogmods import (BMWIntegerProgramMAXSAT,
                                   BMWIntegerProgramSAT, BMWProblem)
+from bmw_solver_qprogmods.mip_writer import solve_mip
 from dwave.system import LeapHybridCQMSampler
 import numpy as np
 
 
-def anneal(bqm, ns, nr, anneal_type):
+def anneal(bqm, ns, nr, anneal_type, initial_state=None, seed=None):
+    """
+    initial_state is a sample starting one of the reads of simulated
+    annealing, variables of bqm missing in it start at 0
+    """
     if anneal_type == 's':
         s = neal.SimulatedAnnealingSampler()
+        options = dict() if seed is None else dict(seed=seed)
+        if initial_state is not None:
+            # the other reads start at random
+            options.update(initial_states={v: initial_state.get(v, 0) for v in bqm.variables},
+                           initial_states_generator="random")
         sampleset = s.sample(bqm, beta_range=(5, 100), num_sweeps=ns, num_reads=nr,
-                             beta_schedule_type='geometric')
+                             beta_schedule_type='geometric', **options)
     elif anneal_type == 'h':
         s = LeapHybridSampler()
         sampleset = s.sample_qubo(bqm)
@@ -34,23 +45,66 @@ def constrained_solver(cqm, time):
     return sampler.sample_cqm(cqm,time_limit = time)
 
 
-def get_bqm(bmw_ip, pdict):
-    obj = bmw_ip.export_pyqubo(strength=1000)
-    return obj.to_bqm(pdict)
-
-
-def get_cqm(bmw_ip):
-    return bmw_ip.export_dimod()
+def log_export_stats(bmw_ip):
+    """
+    Logs ExportStats of the last export of bmw_ip, if collected (none on
+    model cache hits). Called right after the export, for IncrementalMAXSAT
+    these are the stats of the export of the calling trial.
+    """
+    if bmw_ip.stats is not None:
+        logging.info(bmw_ip.stats)
 
 
-def get_lp(bmw_ip):
-    return bmw_ip.export_pulp()
+def get_bqm(bmw_ip, pdict, model_cache=None, native=False, slack_free=False):
+    """
+    native and slack_free are the options of export_pyqubo, by default the
+    BQM is compiled by pyqubo with slack variables
+    """
+    if model_cache is not None:
+        obj = model_cache.export_pyqubo(bmw_ip, 1000, native=native, slack_free=slack_free)
+    else:
+        obj = bmw_ip.export_pyqubo(strength=1000, native=native, slack_free=slack_free)
+    return obj.to_bqm(pdict)
 
 
-def get_bmw_problem(folder, build_file, test_file):
+def get_cqm(bmw_ip, model_cache=None):
+    if model_cache is not None:
+        return model_cache.export_dimod(bmw_ip, bulk=True)
+    return bmw_ip.export_dimod(bulk=True)
+
+
+def solve_lp(bmw_ip, model, model_cache=None, warm_start=None, seed=None, cancel=None):
+    """
+    Writes the model of export_mip to MPS file and solves it with CBC ("pulp") or
+    Gurobi ("gurobi"), returns (sampleset, obj, solution time, cpu time).
+    The MPS file is copied from model_cache if given, stats of the export
+    are logged before solving. warm_start is a sample
+    given to the solver as MIP start, seed its random seed. Returns None if
+    the solver was stopped by cancel or found no integer solution, see solve_mip.
+    """
+    solver = "gurobi" if model == "gurobi" else "cbc"
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "model.mps")
+        if model_cache is not None:
+            variables = model_cache.export_mip(bmw_ip, filename)
+        else:
+            variables = bmw_ip.export_mip(filename)
+        log_export_stats(bmw_ip)
+        return solve_mip(filename, variables, solver, start=warm_start, seed=seed, cancel=cancel)
+
+
+def decode_sampleset(sampleset, names):
+    """
+    Returns sampleset with the integer labels of names replaced by strings
+    """
+    return sampleset.relabel_variables(names.names(sampleset.variables), inplace=False)
+
+
+def get_bmw_problem(folder, build_file, test_file, use_cache=True, canonical_tests=False):
     build_filename = os.path.join(folder, build_file)
     test_filename = os.path.join(folder, test_file)
-    return BMWProblem(build_filename, test_filename)
+    return BMWProblem(build_filename, test_filename, use_cache=use_cache,
+                      canonical_tests=canonical_tests)
 
 
 def get_sampleset(file_name, model):
@@ -85,12 +139,6 @@ def fill_weight_tests(bmwproblem, a=1, b=2, vec=None):
                 test.weight = val
 
 
-def generate_pulp_sampleset(lp):
-    sampleset = {str(v): v.varValue for v in lp.variables()}
-    obj = lp.objective.value() if lp.objective != None else 0
-    return sampleset, obj
-
-
 def store_pulp_sampleset(file, sampleset, obj, st, sct):
     solution = (sampleset, obj, st, sct)
     with open(file, 'wb') as handle:
@@ -101,48 +149,83 @@ def load_sampleset(file):
     return pickle.load(open(file, "rb"))
 
 
-def pulp_experiment(file, problem, nv, mode, bmw_problem, model):
+def cancelled(cancel):
+    """
+    Whether the trial was cancelled, its results are not stored then
+    """
+    return cancel is not None and cancel.is_set()
+
+
+def pulp_experiment(file, problem, nv, mode, bmw_problem, model, ip_options=None, model_cache=None,
+                    incremental=None, warm_start=None, seed=None, cancel=None):
     if mode == "run":
-        if problem == "maxsat":
-            bmw_ip = BMWIntegerProgramMAXSAT(bmw_problem, nv, consider_count=True)
+        if incremental is not None:
+            bmw_ip = incremental.bmw_ip
+        elif problem == "maxsat":
+            bmw_ip = BMWIntegerProgramMAXSAT(bmw_problem, nv, consider_count=True, integer_labels=True,
+                                             **(ip_options or dict()))
         elif problem == "sat":
-            bmw_ip = BMWIntegerProgramSAT(bmw_problem, nv)
-        lp = get_lp(bmw_ip)
-        if model == "pulp":
-            lp.solve()
-        elif model == "gurobi":
-            solver = pulp.getSolver('GUROBI_CMD')
-            lp.solve(solver)
-        sampleset, obj = generate_pulp_sampleset(lp)
-        store_pulp_sampleset(file, sampleset, obj, lp.solutionTime, lp.solutionCpuTime)
+            bmw_ip = BMWIntegerProgramSAT(bmw_problem, nv, integer_labels=True)
+        exporter = bmw_ip if incremental is None else incremental
+        solution = solve_lp(exporter, model, model_cache, warm_start, seed, cancel)
+        if solution is None or cancelled(cancel):
+            return [], []
+        sampleset, obj, st, sct = solution
+        store_pulp_sampleset(file, sampleset, obj, st, sct)
     elif mode == "load":
         sampleset, obj, st, sct = get_sampleset(file, "pulp")
     return [sampleset], [obj]
 
 
-def cqm_experiment(file, problem, nv, mode, bmw_problem, time):
+def cqm_experiment(file, problem, nv, mode, bmw_problem, time, ip_options=None, model_cache=None,
+                   incremental=None, cancel=None):
     if mode == "run":
-        if problem == "maxsat":
-            bmw_ip = BMWIntegerProgramMAXSAT(bmw_problem, nv, consider_count=True)
+        if incremental is not None:
+            bmw_ip = incremental.bmw_ip
+        elif problem == "maxsat":
+            bmw_ip = BMWIntegerProgramMAXSAT(bmw_problem, nv, consider_count=True, integer_labels=True,
+                                             **(ip_options or dict()))
         elif problem == "sat":
-            bmw_ip = BMWIntegerProgramSAT(bmw_problem, nv)
-        cqm = get_cqm(bmw_ip)
-        sampleset = constrained_solver(cqm, time)
+            bmw_ip = BMWIntegerProgramSAT(bmw_problem, nv, integer_labels=True)
+        exporter = bmw_ip if incremental is None else incremental
+        cqm = get_cqm(exporter, model_cache)
+        log_export_stats(exporter)
+        sampleset = decode_sampleset(constrained_solver(cqm, time), bmw_ip.names)
+        if cancelled(cancel):
+            return [], []
         store_results(file, sampleset)
     return get_sampleset(file, "cqm")
 
 
-def bqm_experiment(file, problem, nv, mode, bmw_problem, pdict, ns, nr, anneal_type):
+def bqm_experiment(file, problem, nv, mode, bmw_problem, pdict, ns, nr, anneal_type, ip_options=None,
+                   model_cache=None, incremental=None, warm_start=None, seed=None, cancel=None,
+                   native=False, slack_free=False):
     """ns == number of sweeps
-       nr == number of reads"""
+       nr == number of reads
+       ip_options == keyword arguments of BMWIntegerProgramMAXSAT
+       model_cache == ModelCache of the exported models, or None
+       incremental == IncrementalMAXSAT of bmw_problem used instead of a new
+                      program, or None
+       warm_start == sample starting one of the reads, or None
+       seed == seed of simulated annealing, or None
+       cancel == threading.Event of the trial, results are not stored if set
+                 when annealing ends
+       native, slack_free == options of export_pyqubo, see get_bqm"""
 
     if mode == "run":
-        if problem == "maxsat":
-            bmw_ip = BMWIntegerProgramMAXSAT(bmw_problem, nv, consider_count=True)
+        if incremental is not None:
+            bmw_ip = incremental.bmw_ip
+        elif problem == "maxsat":
+            bmw_ip = BMWIntegerProgramMAXSAT(bmw_problem, nv, consider_count=True,
+                                             **(ip_options or dict()))
         elif problem == "sat":
             bmw_ip = BMWIntegerProgramSAT(bmw_problem, nv)
-        bqm = get_bqm(bmw_ip, pdict)
+        exporter = bmw_ip if incremental is None else incremental
+        bqm = get_bqm(exporter, pdict, model_cache, native, slack_free)
+        log_export_stats(exporter)
 
-        sampleset = anneal(bqm, ns, nr, anneal_type)
+        sampleset = anneal(bqm, ns, nr, anneal_type, warm_start, seed)
+        if cancelled(cancel):
+            return [], []
         store_results(file, sampleset)
     return get_sampleset(file, f"bqm+{anneal_type}")
@@ -16,20 +16,27 @@ Ozlem Salehi Koken, osalehi@iitis.pl
 __version__ = "0.1"
 
 from bmw_solver_qprogmods.bmw_parser import BMWProblem
+from bmw_solver_qprogmods.compiled_problem import CompiledBMWProblem
 from bmw_solver_qprogmods.ip_problems import (BMWIntegerProgramMAXSAT,
                                               BMWIntegerProgramSAT)
 from bmw_solver_qprogmods.ip_utils import (get_car_feature_name,
                                            get_car_test_name,
                                            get_car_type_name, get_maxsat_test,
-                                           get_schedule_var)
+                                           get_schedule_var, VariableNames,
+                                           VariableRegistry)
+from bmw_solver_qprogmods.shared_problem import SharedBMWProblem
 
 __all__ = [
     "BMWProblem",
+    "CompiledBMWProblem",
     "BMWIntegerProgramMAXSAT",
     "BMWIntegerProgramSAT",
     "get_car_feature_name",
     "get_car_test_name",
     "get_car_type_name",
     "get_maxsat_test",
-    "get_schedule_var"
+    "get_schedule_var",
+    "VariableNames",
+    "VariableRegistry",
+    "SharedBMWProblem"
 ]
\ No newline at end of file
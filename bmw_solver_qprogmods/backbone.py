@@ -0,0 +1,133 @@
+"""
+    Facts implied by the buildability rules of each car type.
+    The backbone of a type are the features with the same value in every
+    buildable configuration of the type, found with the complete search of
+    Propagator.solve. Implications are the literals unit propagation derives
+    from switching a single feature on.
+"""
+
+from bmw_solver_qprogmods.propagation import Propagator, type_clauses
+
+
+class TypeBackbone:
+    """
+    Backbone and implications of a single car type. implied[f] maps
+    features g to the value b_g takes whenever b_f == 1, omitting
+    implications which are already a rule or a group of the problem.
+    """
+
+    def __init__(self, t) -> None:
+        self.t = t
+        self.feasible = True
+        self.forced_on = []
+        self.forced_off = []  # only features allowed for the type
+        self.off_features = set()  # features not allowed for the type
+        self.implied = dict()
+
+    def equivalent(self):
+        """
+        Returns pairs (f, g), f < g, of features switched on together
+        """
+        return sorted((f, g) for f, implied in self.implied.items()
+                      for g, v in implied.items()
+                      if v == 1 and f < g and self.implied.get(g, {}).get(f) == 1)
+
+
+class Backbone:
+    """
+    Per type backbones, types maps type -> TypeBackbone
+    """
+
+    def __init__(self) -> None:
+        self.types = dict()
+
+    def global_implications(self, cartypes):
+        """
+        Returns triples (f, g, v) such that b_f == 1 implies b_g == v for
+        every type in cartypes. Trivially true for types forbidding f.
+        """
+        result = None
+        for t in cartypes:
+            bb = self.types[t]
+            if not bb.feasible:
+                continue
+            forced = {g: 1 for g in bb.forced_on}
+            forced.update({g: 0 for g in bb.forced_off})
+            current = {(f, g, v) for f, implied in bb.implied.items()
+                       for g, v in implied.items()}
+            if result is None:
+                result = current
+                continue
+            # f may be off or fixed for t, then implications of f hold as well
+            result = {(f, g, v) for f, g, v in result
+                      if (f, g, v) in current or forced.get(f) == 0
+                      or forced.get(g) == v or f in bb.off_features}
+        return sorted(result or [])
+
+
+def _known_implications(clauses, groups):
+    """
+    Returns set of (f, g, v) stated directly by binary clauses and groups
+    """
+    known = set()
+    for clause in clauses:
+        if len(clause) != 2:
+            continue
+        for lit, other in [clause, clause[::-1]]:
+            if lit[1] == 0:  # ~f | g=v is f => g=v
+                known.add((lit[0], other[0], other[1]))
+    for group in groups:
+        known.update((f, g, 0) for f in group for g in group if f != g)
+    return known
+
+
+def type_backbone(problem, t):
+    """
+    Computes TypeBackbone of type t
+    """
+    result = TypeBackbone(t)
+    clauses, groups, assignment = type_clauses(problem, t)
+    propagator = Propagator(clauses, groups)
+    allowed = [f for f in problem.features if f not in assignment]
+    result.off_features = {f for f in problem.features if f in assignment}
+
+    model = propagator.solve(assignment)
+    if model is None:
+        result.feasible = False
+        return result
+
+    # candidates shrink with every model found until only the backbone is left
+    fixed = propagator.propagate(assignment)
+    candidates = {f: model.get(f, 0) for f in allowed if f not in fixed}
+    while len(candidates) > 0:
+        f, v = candidates.popitem()
+        other = propagator.solve({**fixed, f: 1 - v}, [f])
+        if other is None:
+            fixed = propagator.propagate({**fixed, f: v}, [f])
+            candidates = {g: w for g, w in candidates.items() if g not in fixed}
+        else:
+            candidates = {g: w for g, w in candidates.items() if other.get(g, 0) == w}
+    result.forced_on = [f for f in allowed if fixed.get(f) == 1]
+    result.forced_off = [f for f in allowed if fixed.get(f) == 0]
+
+    known = _known_implications(clauses, groups)
+    constrained = set(propagator.clause_occurs).union(propagator.group_occurs)
+    for f in allowed:
+        if f in fixed or f not in constrained:
+            continue
+        probe = propagator.propagate({**fixed, f: 1}, [f])
+        implied = {g: v for g, v in probe.items()
+                   if g not in fixed and g != f and (f, g, v) not in known}
+        if len(implied) > 0:
+            result.implied[f] = implied
+    return result
+
+
+def compute_backbone(problem):
+    """
+    Returns Backbone of all types of problem
+    """
+    result = Backbone()
+    for tvar in problem.tvars:
+        result.types[tvar.t] = type_backbone(problem, tvar.t)
+    return result
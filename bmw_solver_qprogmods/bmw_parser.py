@@ -1,5 +1,8 @@
 import re
-from copy import deepcopy
+from copy import copy, deepcopy
+
+from bmw_solver_qprogmods import problem_cache
+from bmw_solver_qprogmods.test_reduction import canonical_line
 
 
 class IfConstraintBMWAbs:
@@ -111,6 +114,24 @@ class IfConstraintBMW(IfConstraintBMWAbs):
 
         self.t = t
         self._basic_splitter(constraint)
+        self._simplify(tvars)
+
+    @classmethod
+    def from_split(cls, constr, t, tvars):
+        """
+        Creates the constraint for type t from already split constr,
+        tvars is the set of features allowed for t
+        """
+        result = cls()
+        result.t = t
+        result.left_op = constr.left_op
+        result.right_op = constr.right_op
+        result.left_vars = list(constr.left_vars)
+        result.right_vars = list(constr.right_vars)
+        result._simplify(tvars)
+        return result
+
+    def _simplify(self, tvars):
         self._constraint_simplification(tvars)
         self._remove_lhs_rhs_repeat()
 
@@ -206,7 +227,10 @@ class IfConstraintBMW(IfConstraintBMWAbs):
 
 
 class IfConstraintBMWBunch(IfConstraintBMWAbs):
-    def __init__(self, constraint: str=None, cartypes=None, tvars_list=None) -> None:
+    def __init__(self, constraint: str=None, cartypes=None, tvars_index=None) -> None:
+        """
+        tvars_index maps each car type to the frozenset of its allowed features
+        """
         self.loaded = True
         self.left_op = "N"
         self.right_op = "N"
@@ -224,14 +248,13 @@ class IfConstraintBMWBunch(IfConstraintBMWAbs):
 
         self._basic_splitter(constraint)
         for t in self.orig_types:
-            tvar = next(tvar for tvar in tvars_list if tvar.t == t).vars
-            constr = IfConstraintBMW(constraint, t, tvar)
+            constr = IfConstraintBMW.from_split(self, t, tvars_index[t])
             if constr.t != -1:
                 self.constr_simplified.append(constr)
         if len(self.constr_simplified) == 0:
             self.loaded = False
             return
-        self._maximize_cartypes_set(tvars_list)
+        self._maximize_cartypes_set(tvars_index)
 
         if len(self.left_vars) <= 1:
             self.left_op = str(len(self.left_vars))
@@ -248,24 +271,23 @@ class IfConstraintBMWBunch(IfConstraintBMWAbs):
         result += str(self.max_types)
         return result
 
-    def _maximize_cartypes_set(self, tvars):
-        cartypes = set(tvar.t for tvar in tvars)
-        missing_cartypes = cartypes.difference(self.orig_types)
-        self.max_types = deepcopy(self.orig_types)
-        missing_tvars = list(filter(lambda tvar: tvar.t in missing_cartypes, tvars))
-        if self.get_type()[1] in "1&":
+    def _maximize_cartypes_set(self, tvars_index):
+        missing_cartypes = set(tvars_index).difference(self.orig_types)
+        self.max_types = set(self.orig_types)
+        constr_type = self.get_type()
+        if constr_type[1] in "1&":
             for neg, var in self.left_vars:
                 if neg == 0:
-                    for tvar in missing_tvars:
-                        if var not in tvar.vars:
-                            self.max_types.add(tvar.t)
+                    for t in missing_cartypes:
+                        if var not in tvars_index[t]:
+                            self.max_types.add(t)
 
-        if self.get_type()[3] in "1|":
+        if constr_type[3] in "1|":
             for neg, var in self.right_vars:
                 if neg == 1:
-                    for tvar in missing_tvars:
-                        if var not in tvar.vars:
-                            self.max_types.add(tvar.t)
+                    for t in missing_cartypes:
+                        if var not in tvars_index[t]:
+                            self.max_types.add(t)
         self.max_types = sorted(self.max_types)
 
     def is_mergable(self, tvars):
@@ -369,7 +391,15 @@ class TestReq:
 
 
 class BMWProblem:
-    def __init__(self, build_filename: str = None, test_filename: str = None) -> None:
+    def __init__(self, build_filename: str = None, test_filename: str = None, use_cache=False,
+                 canonical_tests=False) -> None:
+        """
+        If use_cache is True, the parsed problem is stored in a binary cache
+        next to build_filename keyed by the content of both files, and loaded
+        from there on subsequent calls.
+        If canonical_tests is True, tests are merged if they are equal up to
+        order and repetition of literals, not only if their lines are equal.
+        """
         self.cartypes = []
         self.cartypes_no = 0
         self.features = []
@@ -378,6 +408,11 @@ class BMWProblem:
         self.exclusion_vars = []
         self.if_constraints = []
         self.tests = []
+        self._compiled = None
+        self._backbone = None
+        self._compatibility = dict()
+        self._cache_entry = None  # (filename, key) of the cache entry
+        self.source_hash = None
 
         if build_filename == None and test_filename == None:
             return
@@ -385,68 +420,200 @@ class BMWProblem:
         if build_filename == None or test_filename == None:
             raise ValueError("Only both or none filenames can be None")
 
-        with open(build_filename) as file:
-            lines = file.readlines()
-            lines = [line.rstrip() for line in lines]
-        self.cartypes_no = int(lines[1].split(":")[1])
-        self.cartypes = list(range(self.cartypes_no))
-        self.features_no = int(lines[2].split(":")[1])
-        self.features = list(range(self.features_no))
-
-        ind_mode = 4
-
-        tvars = []
-        for line in lines[ind_mode:]:
-            if line == "Rules per typ:":
-                break
-            tvars.append(TVars(line))
-            ind_mode += 1
-        self.tvars = tvars
-
-        ind_mode += 1
-        if_lines = []
-        for line in lines[ind_mode:]:
-            if (
-                line
-                == "group features (only one of them can be active at the same time, each line a group):"
-            ):
-                break
-            if_lines.append(line)
-            ind_mode += 1
-        stats = self._if_constraints_statistics(if_lines)
-        for line, cartypes in stats.items():
-            constraint = IfConstraintBMWBunch(line, cartypes, self.tvars)
+        if not use_cache:
+            self._parse(build_filename, test_filename, canonical_tests)
+            return
+
+        key = problem_cache.problem_hash(build_filename, test_filename,
+                                         options=f"canonical_tests={canonical_tests}")
+        filename = problem_cache.cache_filename(build_filename, key)
+        attributes = problem_cache.load_cached_problem(filename, key)
+        if attributes is not None:
+            self.__dict__.update(attributes)
+            self._cache_entry = (filename, key)
+            return
+        self._parse(build_filename, test_filename, canonical_tests)
+        self.source_hash = key
+        # compiled buildability part is cached as well, backbone and
+        # compatibility are added by _update_cache once computed
+        self.compile()
+        problem_cache.store_cached_problem(filename, key, self.__dict__)
+        self._cache_entry = (filename, key)
+
+    def _update_cache(self, **attributes):
+        """
+        Adds lazily computed attributes to the cache entry the problem was
+        loaded from or stored to. The entry is reloaded, so that the tests
+        changed since then are not stored.
+        """
+        if self._cache_entry is None:
+            return
+        filename, key = self._cache_entry
+        cached = problem_cache.load_cached_problem(filename, key)
+        if cached is None:
+            return
+        cached.update(attributes)
+        problem_cache.store_cached_problem(filename, key, cached)
+
+    @classmethod
+    def from_stream(cls, build_lines, test_lines, canonical_tests=False):
+        """
+        Builds the problem from iterables of lines of the buildability and
+        test files, e.g. file objects. Lines are consumed one by one.
+        """
+        result = cls()
+        result._load_stream(build_lines, test_lines, canonical_tests)
+        return result
+
+    def _parse(self, build_filename, test_filename, canonical_tests=False):
+        with open(build_filename) as build_file, open(test_filename) as test_file:
+            self._load_stream(build_file, test_file, canonical_tests)
+
+    def _load_stream(self, build_lines, test_lines, canonical_tests):
+        rules = dict()  # constraint -> set of types, in order of appearance
+        for kind, item in iter_build_file(build_lines):
+            if kind == "cartypes":
+                self.cartypes_no = item
+                self.cartypes = list(range(item))
+            elif kind == "features":
+                self.features_no = item
+                self.features = list(range(item))
+            elif kind == "tvars":
+                self.tvars.append(item)
+            elif kind == "rule":
+                t, constr = item
+                rules.setdefault(constr, set()).add(t)
+            elif kind == "group":
+                self.exclusion_vars.append(item)
+
+        tvars_index = {tvar.t: frozenset(tvar.vars) for tvar in self.tvars}
+        for line, cartypes in rules.items():
+            constraint = IfConstraintBMWBunch(line, cartypes, tvars_index)
             if constraint.loaded:
                 self.if_constraints.append(constraint)
 
-        ind_mode += 1
-        for line in lines[ind_mode:]:
-            self.exclusion_vars.append(ExlucionVars(line))
-
-        lines = []
-        with open(test_filename) as file:
-            lines = file.readlines()
-            lines = [line.rstrip() for line in lines]
-
-        unique_tests = dict()
-        for line in lines[2:]:
-            q, rline = line.split(":")
-            rline = rline.strip()
-            if rline in unique_tests.keys():
-                unique_tests[rline] += int(q)
-            else:
-                unique_tests[rline] = int(q)
-        self.tests = [
-            TestReq(id, unique_tests[k], k) for id, k in enumerate(unique_tests.keys())
-        ]
-
-    def _if_constraints_statistics(self, lines):
-        lines = [line.split(" : ") for line in lines]
-        statistics = dict()
-        for cartype, constr in lines:
-            if constr in statistics.keys():
-                statistics[constr].add(int(cartype[1:]))
-            else:
-                statistics[constr] = {int(cartype[1:])}
-
-        return statistics
+        self.tests = merge_tests(iter_tests(test_lines), canonical_tests)
+
+    def compile(self, tests=None):
+        """
+        Returns CompiledBMWProblem for tests, the current tests by default.
+        The buildability part is compiled once, so it must not be modified afterwards.
+        """
+        from bmw_solver_qprogmods.compiled_problem import CompiledBMWProblem
+        if self._compiled is None:
+            self._compiled = CompiledBMWProblem(self, tests=[])
+        return self._compiled.with_tests(self.tests if tests is None else tests)
+
+    def backbone(self):
+        """
+        Returns backbone.Backbone of the buildability rules, computed once
+        """
+        from bmw_solver_qprogmods.backbone import compute_backbone
+        if self._backbone is None:
+            self._backbone = compute_backbone(self)
+            self._update_cache(_backbone=self._backbone)
+        return self._backbone
+
+    def test_compatibility(self, tests=None):
+        """
+        Returns dict test id -> frozenset of types which can satisfy the test,
+        see compatibility.test_type_compatibility. Computed once per test,
+        for the current tests by default.
+        """
+        from bmw_solver_qprogmods.compatibility import test_type_compatibility
+        tests = self.tests if tests is None else tests
+        missing = [test for test in tests if test.id not in self._compatibility]
+        if len(missing) > 0:
+            self._compatibility.update(test_type_compatibility(self, missing))
+            self._update_cache(_compatibility=dict(self._compatibility))
+        return self._compatibility
+
+    def presolve(self):
+        """
+        Returns PresolveResult with the reduced problem, see presolve.presolve
+        """
+        from bmw_solver_qprogmods.presolve import presolve
+        return presolve(self)
+
+    def snapshot(self):
+        """
+        Returns copy of the problem with copies of the tests, the
+        buildability rules and computed caches are shared. Changes of the
+        test counts don't reach the copy.
+        """
+        # compiled once for the problem and its snapshots
+        self.compile(tests=[])
+        result = copy(self)
+        result.tests = [copy(test) for test in self.tests]
+        return result
+
+
+################################################################
+##################### Streaming parser #########################
+################################################################
+
+RULES_HEADER = "Rules per typ:"
+GROUPS_HEADER = "group features (only one of them can be active at the same time, each line a group):"
+
+
+def iter_build_file(lines):
+    """
+    Yields content of the buildability file from an iterable of its lines:
+    ("cartypes", int), ("features", int), ("tvars", TVars),
+    ("rule", (type, constraint string)) and ("group", ExlucionVars)
+    """
+    section = "tvars"
+    for line_no, line in enumerate(lines):
+        line = line.rstrip()
+        if line_no == 1:
+            yield "cartypes", int(line.split(":")[1])
+        elif line_no == 2:
+            yield "features", int(line.split(":")[1])
+        elif line_no < 4:
+            continue
+        elif section == "tvars" and line == RULES_HEADER:
+            section = "rules"
+        elif section == "rules" and line == GROUPS_HEADER:
+            section = "groups"
+        elif section == "tvars":
+            yield "tvars", TVars(line)
+        elif section == "rules":
+            cartype, constr = line.split(" : ")
+            yield "rule", (int(cartype[1:]), constr)
+        else:
+            yield "group", ExlucionVars(line)
+
+
+def iter_tests(lines):
+    """
+    Yields TestReq for each line of the test file from an iterable of its
+    lines, ids are None and repeated tests are not merged
+    """
+    for line_no, line in enumerate(lines):
+        if line_no < 2:
+            continue
+        q, rline = line.rstrip().split(":")
+        yield TestReq(None, int(q), rline.strip())
+
+
+def merge_tests(tests, canonical_tests=False):
+    """
+    Merges repeated tests of an iterable of TestReq summing their counts,
+    ids are given in order of first appearance. If canonical_tests is True,
+    tests equal up to order and repetition of literals are merged as well.
+    """
+    unique_tests = dict()
+    for test in tests:
+        if canonical_tests:
+            line = canonical_line(test)
+            key = line
+        else:
+            key = tuple((mode, tuple(var) if mode == 2 else var) for mode, var in test.test)
+        if key in unique_tests:
+            unique_tests[key].count += test.count
+            continue
+        if canonical_tests:
+            test = TestReq(None, test.count, line)
+        test.id = len(unique_tests)
+        unique_tests[key] = test
+    return list(unique_tests.values())
@@ -0,0 +1,195 @@
+"""
+    Construction of the penalty BQMs of export_pyqubo without pyqubo.
+    Penalties are expanded analytically,
+        (sum_i a_i x_i + c)^2 = sum_i (a_i^2 + 2 c a_i) x_i
+                                + sum_{i<j} 2 a_i a_j x_i x_j + c^2,
+    and the coefficients are collected in arrays, the BQM is created once.
+    Slacks of inequalities are encoded as pyqubo.LogEncInteger, with the
+    same labels. Cubic terms of ConditionalPenalty are reduced with the
+    penalty of pyqubo compile: t*y is replaced by variable "t * y" and
+    penalty strength*(3z + ty - 2tz - 2yz) is added. Unlike pyqubo, which
+    chooses the pairs to reduce by itself, the type variable t is always
+    paired with the other factor, so the auxiliary variables differ from
+    the pyqubo BQMs. Energies agree where the auxiliary variables equal
+    their products, the other states are penalized differently.
+"""
+
+import dimod
+import numpy as np
+
+from bmw_solver_qprogmods.ip_utils import (AtMostOnePenalty, ConditionalPenalty,
+                                           EqConstraint, IneqConstraint,
+                                           ProductPenalty, UnbalancedPenalty)
+
+
+def log_encoded_slack(label, span):
+    """
+    Returns [(variable, coefficient)] of LogEncInteger(label, (0, span))
+    """
+    if span <= 0:
+        return []
+    num_variables = int(np.log2(span)) + 1
+    d = num_variables - 1
+    result = [(f"{label}[{i}]", 2**i) for i in range(d)]
+    result.append((f"{label}[{d}]", span - (2**d - 1)))
+    return result
+
+
+class BQMBuilder:
+    """
+    Accumulates penalties of constraints and ProductPenalty/ConditionalPenalty
+    objects, strength is the penalty of the reduction of cubic terms
+    """
+
+    def __init__(self, strength=0) -> None:
+        self.strength = strength
+        self.index = dict()
+        self.labels = []
+        self.linear_vars, self.linear_biases = [], []
+        self.rows, self.cols, self.quadratic_biases = [], [], []
+        self.offset = 0
+        self._reduced = set()
+
+    def _var(self, label):
+        result = self.index.get(label)
+        if result is None:
+            result = len(self.labels)
+            self.index[label] = result
+            self.labels.append(label)
+        return result
+
+    def add_linear(self, label, bias):
+        self.linear_vars.append(self._var(label))
+        self.linear_biases.append(bias)
+
+    def add_quadratic(self, u, v, bias):
+        if u == v:
+            self.add_linear(u, bias)
+            return
+        self.rows.append(self._var(u))
+        self.cols.append(self._var(v))
+        self.quadratic_biases.append(bias)
+
+    def add_offset(self, bias):
+        self.offset += bias
+
+    @staticmethod
+    def _square(terms, constant):
+        """
+        Returns (linear, quadratic, offset) of (sum of terms + constant)^2,
+        repeated variables of terms are merged
+        """
+        coefficients = dict()
+        for var, value in terms:
+            coefficients[var] = coefficients.get(var, 0) + value
+        items = list(coefficients.items())
+        linear = [(var, a*a + 2*constant*a) for var, a in items]
+        quadratic = [(u, v, 2*a*b) for k, (u, a) in enumerate(items) for v, b in items[k+1:]]
+        return linear, quadratic, constant*constant
+
+    @staticmethod
+    def _penalty_terms(constraint):
+        terms = list(zip(constraint.vars, constraint.values))
+        if isinstance(constraint, IneqConstraint):
+            terms += log_encoded_slack(f"{constraint.label}_slack", constraint._max_slack())
+        return terms
+
+    def add_constraint(self, constraint):
+        linear, quadratic, offset = self._square(self._penalty_terms(constraint), -constraint.offset)
+        for var, bias in linear:
+            self.add_linear(var, bias)
+        for u, v, bias in quadratic:
+            self.add_quadratic(u, v, bias)
+        self.add_offset(offset)
+
+    def add_product(self, penalty):
+        # literal x is 0 + 1*x, literal 1-x is 1 - 1*x
+        assert len(penalty.literals) <= 2, "only quadratic products are supported"
+        terms = [(1 - value, 2*value - 1, var) for var, value in penalty.literals]
+        if len(terms) == 1:
+            (c, k, x), = terms
+            self.add_offset(c)
+            self.add_linear(x, k)
+            return
+        (c1, k1, x1), (c2, k2, x2) = terms
+        self.add_offset(c1*c2)
+        self.add_linear(x1, c2*k1)
+        self.add_linear(x2, c1*k2)
+        self.add_quadratic(x1, x2, k1*k2)
+
+    def add_at_most_one(self, penalty):
+        for k, u in enumerate(penalty.vars):
+            for v in penalty.vars[k+1:]:
+                self.add_quadratic(u, v, 1)
+
+    def add_unbalanced(self, penalty):
+        c = penalty.constraint
+        l1, l2 = penalty.lambdas
+        terms = list(zip(c.vars, c.values))
+        linear, quadratic, offset = self._square(terms, -c.offset)
+        for var, value in terms:
+            self.add_linear(var, l1*value)
+        for var, bias in linear:
+            self.add_linear(var, l2*bias)
+        for u, v, bias in quadratic:
+            self.add_quadratic(u, v, l2*bias)
+        self.add_offset(-l1*c.offset + l2*offset)
+
+    def _reduce(self, t, y):
+        """
+        Returns variable equal to t*y in the ground states, named "t * y"
+        whatever the order of the product chosen by pyqubo
+        """
+        z = f"{t} * {y}"
+        if z not in self._reduced:
+            self._reduced.add(z)
+            self.add_linear(z, 3*self.strength)
+            self.add_quadratic(t, y, self.strength)
+            self.add_quadratic(t, z, -2*self.strength)
+            self.add_quadratic(y, z, -2*self.strength)
+        return z
+
+    def add_conditional(self, penalty):
+        t = penalty.var
+        terms = self._penalty_terms(penalty.constraint)
+        linear, quadratic, offset = self._square(terms, -penalty.constraint.offset)
+        # (1-t)*S = S - t*S
+        for var, bias in linear:
+            self.add_linear(var, bias)
+            self.add_quadratic(t, var, -bias)
+        for u, v, bias in quadratic:
+            self.add_quadratic(u, v, bias)
+            if t in (u, v):
+                self.add_quadratic(u, v, -bias)
+            else:
+                self.add_quadratic(self._reduce(t, u), v, -bias)
+        self.add_offset(offset)
+        self.add_linear(t, -offset)
+
+    def add(self, item):
+        if isinstance(item, (EqConstraint, IneqConstraint)):
+            self.add_constraint(item)
+        elif isinstance(item, ProductPenalty):
+            self.add_product(item)
+        elif isinstance(item, ConditionalPenalty):
+            self.add_conditional(item)
+        elif isinstance(item, AtMostOnePenalty):
+            self.add_at_most_one(item)
+        elif isinstance(item, UnbalancedPenalty):
+            self.add_unbalanced(item)
+        else:
+            raise ValueError(f"Can't build BQM of {type(item)}")
+
+    def add_all(self, iterator):
+        for item in iterator:
+            self.add(item)
+        return self
+
+    def to_bqm(self):
+        linear = np.bincount(np.asarray(self.linear_vars, dtype=np.int64),
+                             weights=np.asarray(self.linear_biases, dtype=np.float64),
+                             minlength=len(self.labels))
+        quadratic = (np.asarray(self.rows, dtype=np.int64), np.asarray(self.cols, dtype=np.int64),
+                     np.asarray(self.quadratic_biases, dtype=np.float64))
+        return dimod.BinaryQuadraticModel.from_numpy_vectors(
+            linear, quadratic, self.offset, dimod.Vartype.BINARY, variable_order=self.labels)
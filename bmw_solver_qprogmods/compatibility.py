@@ -0,0 +1,69 @@
+"""
+    Test-type compatibility: test is compatible with a car type if some
+    buildable configuration of the type satisfies the test.
+"""
+
+from itertools import product
+
+from bmw_solver_qprogmods.propagation import Propagator, type_clauses
+
+
+def _test_assumptions(test, assignment):
+    """
+    Returns (assignment extended by the literals of test, or-groups of the
+    test restricted to features not fixed to 0), None if test contradicts
+    the assignment
+    """
+    assignment = dict(assignment)
+    or_groups = []
+    for mode, var in test.test:
+        if mode in [0, 1]:
+            value = 1 - mode
+            if assignment.get(var, value) != value:
+                return None
+            assignment[var] = value
+        else:
+            group = [f for f in var if assignment.get(f) != 0]
+            if len(group) == 0:
+                return None
+            or_groups.append(group)
+    return assignment, or_groups
+
+
+def type_compatibility(problem, t, tests):
+    """
+    Returns ids of tests compatible with type t
+    """
+    clauses, groups, assignment = type_clauses(problem, t)
+    propagator = Propagator(clauses, groups)
+    result = set()
+    assignment = propagator.propagate(assignment)
+    if assignment is None:
+        return result
+    for test in tests:
+        assumptions = _test_assumptions(test, assignment)
+        if assumptions is None:
+            continue
+        test_assignment, or_groups = assumptions
+        # or-groups are satisfied by one of their features
+        for choice in product(*or_groups):
+            choice_assignment = dict(test_assignment)
+            if any(choice_assignment.get(f) == 0 for f in choice):
+                continue
+            choice_assignment.update({f: 1 for f in choice})
+            changed = [f for f in choice_assignment if f not in assignment]
+            if propagator.solve(choice_assignment, changed) is not None:
+                result.add(test.id)
+                break
+    return result
+
+
+def test_type_compatibility(problem, tests):
+    """
+    Returns dict test id -> frozenset of types compatible with the test
+    """
+    result = {test.id: set() for test in tests}
+    for tvar in problem.tvars:
+        for test_id in type_compatibility(problem, tvar.t, tests):
+            result[test_id].add(tvar.t)
+    return {test_id: frozenset(types) for test_id, types in result.items()}
@@ -0,0 +1,202 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from bmw_solver_qprogmods.ip_utils import VariableNames
+
+
+def _incidence(rows, n_cols, col_index):
+    """
+    Builds 0/1 CSR matrix, rows[k] is the list of ids set in row k
+    """
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indices = []
+    for k, row in enumerate(rows):
+        cols = sorted({col_index[el] for el in row})
+        indices += cols
+        indptr[k + 1] = len(indices)
+    indices = np.array(indices, dtype=np.int64)
+    data = np.ones(len(indices), dtype=np.int8)
+    return csr_matrix((data, indices, indptr), shape=(len(rows), n_cols))
+
+
+def _literals(rows, n_cols, col_index):
+    """
+    Splits rows of (neg, var) literals into positive and negative incidence
+    """
+    pos = [[var for neg, var in row if neg == 0] for row in rows]
+    neg = [[var for neg, var in row if neg == 1] for row in rows]
+    return _incidence(pos, n_cols, col_index), _incidence(neg, n_cols, col_index)
+
+
+def _row(matrix, k):
+    return matrix.indices[matrix.indptr[k]:matrix.indptr[k + 1]]
+
+
+class CompiledBMWProblem:
+    """
+    Array-backed snapshot of BMWProblem.
+
+    Types and features are addressed by rows/columns, original ids are kept
+    in types and features arrays. Literal matrices are 0/1 CSR matrices,
+    one for positive and one for negated literals.
+    """
+
+    def __init__(self, bmwproblem=None, tests=None) -> None:
+        if bmwproblem is None:
+            return
+
+        self.types = np.array([tvar.t for tvar in bmwproblem.tvars], dtype=np.int64)
+        self.features = np.array(bmwproblem.features, dtype=np.int64)
+        self.type_index = {t: k for k, t in enumerate(self.types.tolist())}
+        self.feature_index = {f: k for k, f in enumerate(self.features.tolist())}
+        types_no, features_no = len(self.types), len(self.features)
+
+        self.allowed = _incidence([tvar.vars for tvar in bmwproblem.tvars],
+                                  features_no, self.feature_index).toarray().astype(bool)
+        self.exclusion = _incidence([ev.vars for ev in bmwproblem.exclusion_vars],
+                                    features_no, self.feature_index)
+
+        # rules as given in the file, valid for rule_types
+        rules = bmwproblem.if_constraints
+        self.rule_types = _incidence([c.orig_types for c in rules],
+                                     types_no, self.type_index)
+        self.rule_max_types = _incidence([c.max_types for c in rules],
+                                         types_no, self.type_index)
+        self.rule_left_pos, self.rule_left_neg = _literals(
+            [c.left_vars for c in rules], features_no, self.feature_index)
+        self.rule_right_pos, self.rule_right_neg = _literals(
+            [c.right_vars for c in rules], features_no, self.feature_index)
+        self.rule_left_op = np.array([c.left_op for c in rules], dtype="<U1")
+        self.rule_right_op = np.array([c.right_op for c in rules], dtype="<U1")
+
+        # rules simplified per type, local_rule points to the rule above
+        local = [(r, c) for r, rule in enumerate(rules) for c in rule.constr_simplified]
+        self.local_rule = np.array([r for r, _ in local], dtype=np.int64)
+        self.local_type = np.array([self.type_index[c.t] for _, c in local], dtype=np.int64)
+        self.local_left_pos, self.local_left_neg = _literals(
+            [c.left_vars for _, c in local], features_no, self.feature_index)
+        self.local_right_pos, self.local_right_neg = _literals(
+            [c.right_vars for _, c in local], features_no, self.feature_index)
+        self.local_left_op = np.array([c.left_op for _, c in local], dtype="<U1")
+        self.local_right_op = np.array([c.right_op for _, c in local], dtype="<U1")
+
+        self._compile_tests(bmwproblem.tests if tests is None else tests)
+
+    def _compile_tests(self, tests):
+        features_no = len(self.features)
+        self.test_ids = np.array([test.id for test in tests], dtype=object)
+        self.test_counts = np.array([test.count for test in tests], dtype=np.int64)
+        self.test_weights = np.array(
+            [np.nan if test.weight is None else test.weight for test in tests], dtype=float)
+        self.test_pos = _incidence([[var for mode, var in test.test if mode == 0] for test in tests],
+                                   features_no, self.feature_index)
+        self.test_neg = _incidence([[var for mode, var in test.test if mode == 1] for test in tests],
+                                   features_no, self.feature_index)
+        or_groups = [(k, var) for k, test in enumerate(tests)
+                     for mode, var in test.test if mode == 2]
+        self.test_or = _incidence([var for _, var in or_groups],
+                                  features_no, self.feature_index)
+        self.test_or_owner = np.array([k for k, _ in or_groups], dtype=np.int64)
+
+    def with_tests(self, tests):
+        """
+        Returns copy sharing buildability arrays with tests recompiled
+        """
+        result = CompiledBMWProblem()
+        result.__dict__.update(self.__dict__)
+        result._compile_tests(tests)
+        return result
+
+    @property
+    def tests_no(self):
+        return len(self.test_ids)
+
+    def forbidden_features(self, t):
+        return self.features[~self.allowed[self.type_index[t]]]
+
+    def test_literals(self, k):
+        """
+        Returns test k in TestReq.test format
+        """
+        result = [(0, f) for f in self.features[_row(self.test_pos, k)].tolist()]
+        result += [(1, f) for f in self.features[_row(self.test_neg, k)].tolist()]
+        for g in np.flatnonzero(self.test_or_owner == k):
+            result.append((2, self.features[_row(self.test_or, g)].tolist()))
+        return result
+
+    ################################################################
+    ################## Evaluation of samples #######################
+    ################################################################
+
+    def sample_to_arrays(self, sample, nv, names=None):
+        """
+        Returns (t, b) 0/1 arrays of shapes (nv, types) and (nv, features),
+        missing variables are read as 0. names gives the labels of sample,
+        VariableNames by default.
+        """
+        names = VariableNames() if names is None else names
+        t = np.array([[sample.get(names.type_var(i, ct), 0) for ct in self.types.tolist()]
+                      for i in range(nv)], dtype=np.int64).reshape(nv, len(self.types))
+        b = np.array([[sample.get(names.feature_var(i, f), 0) for f in self.features.tolist()]
+                      for i in range(nv)], dtype=np.int64).reshape(nv, len(self.features))
+        return np.rint(t).astype(np.int64), np.rint(b).astype(np.int64)
+
+    @staticmethod
+    def _eval_literals(b, pos, neg, ops, empty_value):
+        """
+        Evaluates conjunction ("&", "1") or disjunction ("|") of literals
+        for each car (rows of b) and each literal row
+        """
+        pos_true = np.asarray((pos @ b.T).T)
+        neg_true = neg.getnnz(axis=1)[None, :] - np.asarray((neg @ b.T).T)
+        true_no = pos_true + neg_true
+        lit_no = (pos.getnnz(axis=1) + neg.getnnz(axis=1))[None, :]
+        result = np.where(ops[None, :] == "|", true_no > 0, true_no == lit_no)
+        return np.where(lit_no == 0, empty_value, result)
+
+    def single_type_violations(self, t):
+        return np.flatnonzero(t.sum(axis=1) != 1)
+
+    def allowed_feature_violations(self, t, b):
+        """
+        Returns (car, type, feature) triples with feature not allowed for type
+        """
+        cars, types = np.nonzero(t)
+        violate = []
+        for i, k in zip(cars.tolist(), types.tolist()):
+            for f in self.features[(b[i] == 1) & ~self.allowed[k]].tolist():
+                violate.append((i, self.types[k], f))
+        return violate
+
+    def group_violations(self, b):
+        """
+        Returns (car, group) pairs with more than one active feature
+        """
+        return np.argwhere(np.asarray((self.exclusion @ b.T).T) > 1)
+
+    def rule_violations(self, t, b):
+        """
+        Returns (car, type, rule) triples violated by the sample
+        """
+        left = self._eval_literals(b, self.rule_left_pos, self.rule_left_neg,
+                                   self.rule_left_op, True)
+        right = self._eval_literals(b, self.rule_right_pos, self.rule_right_neg,
+                                    self.rule_right_op, False)
+        broken = left & ~right
+        violate = []
+        for i, r in np.argwhere(broken).tolist():
+            for k in _row(self.rule_types, r).tolist():
+                if t[i, k] == 1:
+                    violate.append((i, self.types[k], r))
+        return violate
+
+    def test_satisfaction(self, b):
+        """
+        Returns bool array (nv, tests), True if car satisfies the test
+        """
+        pos_ok = np.asarray((self.test_pos @ b.T).T) == self.test_pos.getnnz(axis=1)[None, :]
+        neg_ok = np.asarray((self.test_neg @ b.T).T) == 0
+        or_failed = (np.asarray((self.test_or @ b.T).T) == 0).astype(np.int64)
+        failed_no = np.zeros((b.shape[0], self.tests_no), dtype=np.int64)
+        np.add.at(failed_no.T, self.test_or_owner, or_failed.T)
+        return pos_ok & neg_ok & (failed_no == 0)
@@ -0,0 +1,161 @@
+"""
+    Size and cost of exported models. ExportStats is filled by the export
+    methods of BMWIntegerProgram created with collect_stats=True: the
+    constraints pass through track, which counts them by family (prefix of
+    the label) and attributes the wall time between consecutive constraints
+    to the family of the former, so the time of a family includes building
+    and adding its constraints, and compiling the BQM part it ends. With
+    trace_memory=True the peak of tracemalloc is recorded per family as well,
+    tracemalloc slows the export down. pyqubo exports build the BQMs of car
+    0 and copy them, their constraints are counted for car 0 only. Penalties
+    without slack (ProductPenalty etc.) carry the label of the constraint
+    they replace.
+"""
+
+import tracemalloc
+from collections import Counter
+from time import perf_counter
+
+import dimod
+
+# label prefixes, the longest matching one is the family
+CONSTRAINT_FAMILIES = sorted(["single_type", "feat_per_type", "group_features", "if_constraint", "backbone",
+                              "implication", "test_constraint", "test_dominance", "test_type", "test_sat_cond",
+                              "group_test_scheduling", "test_scheduling_test", "test_scheduling_car",
+                              "test_scheduling_day", "test_scheduling_timein", "test_scheduling_timeout",
+                              "test_scheduling_crash", "test_scheduling_group_order"],
+                             key=len, reverse=True)
+
+
+# kinds of the variables of the programs, other labels are auxiliary
+VARIABLE_KINDS = ["t", "b", "p", "s"]
+
+
+def constraint_family(label):
+    for family in CONSTRAINT_FAMILIES:
+        if label.startswith(f"{family}_"):
+            return family
+    return "other"
+
+
+def variable_kind(label, names=None):
+    """
+    Kind of variable: "t", "b", "p", "s", "slack" or "aux" (products of
+    reduced cubic terms, "x * y" of BQMBuilder or labeled by index by
+    pyqubo, e.g. "0*1"), label of names if integer
+    """
+    if isinstance(label, int) and names is not None and hasattr(names, "keys"):
+        return names.keys[label][0]
+    label = str(label)
+    if "slack" in label:
+        return "slack"
+    if "*" in label:
+        return "aux"
+    kind = label.split("_", 1)[0]
+    return kind if kind in VARIABLE_KINDS else "aux"
+
+
+class ExportStats:
+    """
+    Stats record of a single export of mode "pyqubo", "dimod", "pulp" or
+    "mip"
+    """
+
+    def __init__(self, mode, trace_memory=False) -> None:
+        self.mode = mode
+        self.trace_memory = trace_memory
+        self.variables = Counter()
+        self.constraints = Counter()
+        self.nonzeros = 0
+        self.interactions = 0
+        self.density = None
+        self.family_time = Counter()
+        self.family_peak_mb = dict()
+        self.time = None
+        self._family = None
+        self._start = self._last = perf_counter()
+        if trace_memory:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+    def _close(self, family=None):
+        """
+        Attributes the time since the last constraint to the current family
+        and switches to family
+        """
+        now = perf_counter()
+        if self._family is not None:
+            self.family_time[self._family] += now - self._last
+            if self.trace_memory and family != self._family:
+                peak = tracemalloc.get_traced_memory()[1] / 2**20
+                self.family_peak_mb[self._family] = max(peak, self.family_peak_mb.get(self._family, 0))
+                tracemalloc.reset_peak()
+        self._family = family
+        self._last = now
+
+    def track(self, constraints):
+        """
+        Yields constraints, counting them by family
+        """
+        for c in constraints:
+            label = getattr(c, "label", None)
+            family = "other" if label is None else constraint_family(label)
+            self._close(family)
+            self.constraints[family] += 1
+            self.nonzeros += len(getattr(c, "vars", ()))
+            yield c
+
+    def _count_variables(self, variables, names):
+        self.variables = Counter(variable_kind(v, names) for v in variables)
+
+    def finish(self, model, names=None):
+        """
+        Closes the record with model, result of the export
+        """
+        self._close()
+        self.time = perf_counter() - self._start
+        if self.trace_memory and self._started_tracing:
+            tracemalloc.stop()
+
+        if isinstance(model, dimod.ConstrainedQuadraticModel):
+            self._count_variables(model.variables, names)
+        elif isinstance(model, dimod.BinaryQuadraticModel):
+            self._count_bqm(model, names)
+        elif hasattr(model, "dicts"):
+            # BQMWithoutPenalty, parts share variables
+            self._count_bqm(sum(model.dicts.values()), names)
+        elif hasattr(model, "variables"):
+            # pulp model
+            self._count_variables([v.name for v in model.variables()], names)
+        else:
+            # variable names of export_mip
+            self._count_variables(model, names)
+        return self
+
+    def _count_bqm(self, bqm, names):
+        self._count_variables(bqm.variables, names)
+        n = bqm.num_variables
+        self.interactions = bqm.num_interactions
+        self.nonzeros = n + self.interactions
+        self.density = 0 if n < 2 else self.interactions / (n*(n-1)/2)
+
+    def as_dict(self):
+        return {"mode": self.mode, "time": self.time, "variables": dict(self.variables),
+                "constraints": dict(self.constraints), "nonzeros": self.nonzeros,
+                "interactions": self.interactions, "density": self.density,
+                "family_time": dict(self.family_time), "family_peak_mb": dict(self.family_peak_mb)}
+
+    def __str__(self):
+        variables = " ".join(f"{k}:{v}" for k, v in sorted(self.variables.items()))
+        lines = [f"{self.mode} export {self.time:.3f}s variables {sum(self.variables.values())} ({variables}) "
+                 f"constraints {sum(self.constraints.values())} nonzeros {self.nonzeros}"]
+        if self.density is not None:
+            lines[0] += f" interactions {self.interactions} density {self.density:.2e}"
+        for family, count in self.constraints.most_common():
+            line = f"  {family}: constraints {count} time {self.family_time[family]:.3f}s"
+            if family in self.family_peak_mb:
+                line += f" peak {self.family_peak_mb[family]:.1f}MB"
+            lines.append(line)
+        return "\n".join(lines)
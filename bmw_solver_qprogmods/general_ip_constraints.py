@@ -8,8 +8,9 @@ class SingleType():
     Asserts each car is of exactly one type
     """
 
-    def __init__(self, car_no, types_list) -> None:
+    def __init__(self, car_no, types_list, names=None) -> None:
         self.car_no = car_no
+        self.names = VariableNames() if names is None else names
         self.index = 0
         self.types_list = types_list
 
@@ -19,42 +20,81 @@ class SingleType():
     def __next__(self):
         if self.index == self.car_no:
             raise StopIteration
-        vars = [get_car_type_name(self.index, t) for t in self.types_list]
+        vars = [self.names.type_var(self.index, t) for t in self.types_list]
         values = [1 for _ in self.types_list]
         self.index += 1
         return EqConstraint(vars, values, 1, f"single_type_{self.index}")
 
 
+FEAT_PER_TYPE_FORMULATIONS = ["pairwise", "compact", "bigm"]
+
+
 class FeatPerType():
     """
-    Asserts car won't have forbiddent features
+    Asserts car won't have forbiddent features, formulation is
+    "pairwise": t + b <= 1 for each type t and feature f forbidden for t,
+    "compact": b <= sum of t allowing f, for each feature f,
+    "bigm": sum of b forbidden for t <= |forbidden|*(1 - t), for each type t
     """
 
-    def __init__(self, car_no, types_list, features, tvars, mode) -> None:
+    def __init__(self, car_no, types_list, features, tvars, mode, names=None,
+                 formulation="pairwise") -> None:
         self.car_no = car_no
+        self.names = VariableNames() if names is None else names
         self.forbidden_features = dict()
         assert mode == "pyqubo" or mode == "dimod"
         self.mode = mode
+        assert formulation in FEAT_PER_TYPE_FORMULATIONS
+        self.formulation = formulation
+        self.features = list(features)
         features_set = set(features)
         for tvar in filter(lambda tvar: tvar.t in types_list, tvars):
             self.forbidden_features[tvar.t] = features_set.difference(
                 tvar.vars)
 
+    @classmethod
+    def from_compiled(cls, car_no, compiled, mode, names=None, formulation="pairwise"):
+        result = cls(car_no, [], [], [], mode, names, formulation)
+        result.features = compiled.features.tolist()
+        for t in compiled.types.tolist():
+            result.forbidden_features[t] = compiled.forbidden_features(t).tolist()
+        return result
+
+    def _compact(self, i):
+        forbidden = {t: set(features) for t, features in self.forbidden_features.items()}
+        for f in self.features:
+            allowing = [t for t in forbidden if f not in forbidden[t]]
+            if len(allowing) == len(forbidden):
+                continue
+            vars = [self.names.feature_var(i, f)] + [self.names.type_var(i, t) for t in allowing]
+            values = [1] + [-1 for _ in allowing]
+            yield IneqConstraint(vars, values, 0, f"feat_per_type_{i}_feature_{f}")
+
+    def _bigm(self, i):
+        for (cartype, features) in self.forbidden_features.items():
+            if len(features) == 0:
+                continue
+            vars = [self.names.feature_var(i, f) for f in features] + [self.names.type_var(i, cartype)]
+            values = [1 for _ in features] + [len(features)]
+            yield IneqConstraint(vars, values, len(features), f"feat_per_type_{i}_type_{cartype}")
+
     def __iter__(self):
-        constraints = []
         for i in range(self.car_no):
+            if self.formulation == "compact":
+                yield from self._compact(i)
+                continue
+            if self.formulation == "bigm":
+                yield from self._bigm(i)
+                continue
             for (cartype, features) in self.forbidden_features.items():
                 for f in features:
-                    t = get_car_type_name(i, cartype)
-                    b = get_car_feature_name(i, f)
+                    t = self.names.type_var(i, cartype)
+                    b = self.names.feature_var(i, f)
+                    label = f"feat_per_type_{i}_{cartype}_{f}"
                     if self.mode == "pyqubo":
-                        constraints.append(
-                            pyqubo.Binary(t)*pyqubo.Binary(b))
+                        yield ProductPenalty([(t, 1), (b, 1)], label)
                     elif self.mode == "dimod":
-                        label = f"feat_per_type_{i}_{cartype}_{f}"
-                        ineq = IneqConstraint([t, b], [1, 1], 1, label)
-                        constraints.append(ineq)
-        return constraints.__iter__()
+                        yield IneqConstraint([t, b], [1, 1], 1, label)
 
 
 class GroupFeatures:
@@ -62,19 +102,25 @@ class GroupFeatures:
     Asserts group features
     """
 
-    def __init__(self, car_no, excl_vars) -> None:
+    def __init__(self, car_no, excl_vars, names=None) -> None:
         self.car_no = car_no
-        self.excl_vars = excl_vars
+        self.names = VariableNames() if names is None else names
+        self.groups = [constr.vars for constr in excl_vars]
+
+    @classmethod
+    def from_compiled(cls, car_no, compiled, names=None):
+        result = cls(car_no, [], names)
+        excl = compiled.exclusion
+        result.groups = [compiled.features[excl.indices[excl.indptr[g]:excl.indptr[g+1]]].tolist()
+                         for g in range(excl.shape[0])]
+        return result
 
     def __iter__(self):
-        constraints = []
         for i in range(self.car_no):
-            for (constr_id, constr) in enumerate(self.excl_vars):
-                vars = [get_car_feature_name(i, feat) for feat in constr.vars]
-                values = [1 for _ in constr.vars]
-                constraints.append(IneqConstraint(
-                    vars, values, 1, label=f"group_features_{i}_{constr_id}"))
-        return constraints.__iter__()
+            for (constr_id, group) in enumerate(self.groups):
+                vars = [self.names.feature_var(i, feat) for feat in group]
+                values = [1 for _ in group]
+                yield IneqConstraint(vars, values, 1, label=f"group_features_{i}_{constr_id}")
 
 
 class RulesPerType:
@@ -82,23 +128,24 @@ class RulesPerType:
     Assert Rules per type
     """
 
-    def __init__(self, car_no, types_list, if_constraints, mode) -> None:
+    def __init__(self, car_no, types_list, if_constraints, mode, names=None) -> None:
         self.car_no = car_no
+        self.names = VariableNames() if names is None else names
         self.mode = mode
         self.constraints = if_constraints
         self.types_list = types_list
 
     def _constr_to_ineq(self, constr, car, constr_id):
 
-        vars = [get_car_feature_name(car, f[1]) for f in constr.left_vars]
-        vars += [get_car_feature_name(car, f[1]) for f in constr.right_vars]
+        vars = [self.names.feature_var(car, f[1]) for f in constr.left_vars]
+        vars += [self.names.feature_var(car, f[1]) for f in constr.right_vars]
         N = len(constr.right_vars)
         M = len(constr.left_vars)
 
         t = constr.t if isinstance(constr, IfConstraintBMW) else None
 
         if t != None:
-            vars += [get_car_type_name(car, t)]
+            vars += [self.names.type_var(car, t)]
 
         constr_type = constr.get_type()
         values = []
@@ -187,10 +234,10 @@ class RulesPerType:
         elif constr_type in ["0100"]:
             assert t != None
             if self.mode == "pyqubo":
-                var1 = pyqubo.Binary(get_car_type_name(car, t))
+                var1 = self.names.type_var(car, t)
                 feature = constr.left_vars[0][1]
-                var2 = pyqubo.Binary(get_car_feature_name(car, feature))
-                return [var1*var2]
+                var2 = self.names.feature_var(car, feature)
+                return [ProductPenalty([(var1, 1), (var2, 1)], f"if_constraint_{car}_{constr_id}_{t}")]
             if self.mode == "dimod":
                 values = [1, 1]
                 offset = 1
@@ -209,11 +256,10 @@ class RulesPerType:
             outcomes = []
             for ineq in inequalities:
                 assert self.mode == "pyqubo"
-                ineq = ineq.export_pyqubo()
                 the_type = set(self.types_list).difference(constr.max_types)
                 the_type = list(the_type)[0]
-                b = pyqubo.Binary(get_car_type_name(car_id, the_type))
-                outcomes.append((1-b) * ineq)
+                b = self.names.type_var(car_id, the_type)
+                outcomes.append(ConditionalPenalty(ineq, b))
             return outcomes
         else:
             return inequalities
@@ -230,7 +276,6 @@ class RulesPerType:
 
     def __iter__(self):
         assert self.mode != None
-        constraints = []
 
         for i in range(self.car_no):
             for cstr_id, cstr in enumerate(self.constraints):
@@ -239,9 +284,45 @@ class RulesPerType:
                     self.types_list) - 1 and self.mode == "pyqubo"
                 glob_condition |= len(cstr.max_types) == len(self.types_list)
                 if glob_condition:
-                    constraints += self._global_constr_to_ineq(
-                        i, cstr, cstr_id)
+                    yield from self._global_constr_to_ineq(i, cstr, cstr_id)
                 else:
-                    constraints += self._local_constr_to_ineq(i, cstr, cstr_id)
+                    yield from self._local_constr_to_ineq(i, cstr, cstr_id)
 
-        return constraints.__iter__()
+
+class BackboneCuts:
+    """
+    Fixes features forced by the type of a car and adds implications
+    holding for every type, see backbone.Backbone
+    """
+
+    def __init__(self, car_no, types_list, backbone, mode, names=None) -> None:
+        self.car_no = car_no
+        self.names = VariableNames() if names is None else names
+        assert mode == "pyqubo" or mode == "dimod"
+        self.mode = mode
+        self.forced = dict()
+        for t in types_list:
+            bb = backbone.types[t]
+            self.forced[t] = [(f, 1) for f in bb.forced_on] + [(f, 0) for f in bb.forced_off]
+        self.implications = backbone.global_implications(types_list)
+
+    def __iter__(self):
+        for i in range(self.car_no):
+            for (cartype, features) in self.forced.items():
+                for f, value in features:
+                    t = self.names.type_var(i, cartype)
+                    b = self.names.feature_var(i, f)
+                    label = f"backbone_{i}_{cartype}_{f}"
+                    if self.mode == "pyqubo":
+                        yield ProductPenalty([(t, 1), (b, 1 - value)], label)
+                    elif self.mode == "dimod":
+                        # t => b for forced on, t => ~b for forced off
+                        yield IneqConstraint([t, b], [1, 1 - 2*value], 1 - value, label)
+            for f, g, value in self.implications:
+                b_f = self.names.feature_var(i, f)
+                b_g = self.names.feature_var(i, g)
+                label = f"implication_{i}_{f}_{g}"
+                if self.mode == "pyqubo":
+                    yield ProductPenalty([(b_f, 1), (b_g, 1 - value)], label)
+                elif self.mode == "dimod":
+                    yield IneqConstraint([b_f, b_g], [1, 1 - 2*value], 1 - value, label)
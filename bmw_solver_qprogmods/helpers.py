@@ -2,10 +2,28 @@ from collections import defaultdict
 import itertools as it
 import logging
 
+from bmw_solver_qprogmods.compiled_problem import CompiledBMWProblem
 
-def check_group_features(sample, nv, problem, log):
-    fl = [ev.vars for ev in problem.exclusion_vars]
+
+def _get_arrays(sample, nv, problem, arrays):
+    if arrays is None:
+        arrays = problem.sample_to_arrays(sample, nv)
+    return arrays
+
+
+def check_group_features(sample, nv, problem, log, arrays=None):
     violate = []
+    if isinstance(problem, CompiledBMWProblem):
+        _, b = _get_arrays(sample, nv, problem, arrays)
+        for i, g in problem.group_violations(b).tolist():
+            feat = problem.features[problem.exclusion[g].indices]
+            vlist = feat[b[i, problem.exclusion[g].indices] == 1].tolist()
+            violate.append([f"Car {i} has features {vlist}"])
+        if log:
+            logging.info(f"Group Features: {len(violate) == 0} {violate}")
+        return len(violate) == 0, violate
+
+    fl = [ev.vars for ev in problem.exclusion_vars]
     for feat in fl:
         for i in range(nv):
             s = sum(sample[f"b_{i}_{j}"] for j in feat)
@@ -20,12 +38,16 @@ def check_group_features(sample, nv, problem, log):
     return len(violate) == 0, violate
 
 
-def check_single_type(sample, nv, problem, log):
+def check_single_type(sample, nv, problem, log, arrays=None):
     violate = []
-    for i in range(nv):
-        s = sum(sample[f"t_{i}_{j.t}"] for j in problem.tvars)
-        if s != 1:
-            violate.append(i)
+    if isinstance(problem, CompiledBMWProblem):
+        t, _ = _get_arrays(sample, nv, problem, arrays)
+        violate = problem.single_type_violations(t).tolist()
+    else:
+        for i in range(nv):
+            s = sum(sample[f"t_{i}_{j.t}"] for j in problem.tvars)
+            if s != 1:
+                violate.append(i)
     if log:
         logging.info(f"Single Type: {len(violate)==0} {violate}")
     return len(violate) == 0
@@ -47,8 +69,16 @@ def check_all_0(vars, i, sample):
     return True
 
 
-def check_type_features(sample, nv, problem, log):
+def check_type_features(sample, nv, problem, log, arrays=None):
     violate = []
+    if isinstance(problem, CompiledBMWProblem):
+        t, b = _get_arrays(sample, nv, problem, arrays)
+        for i, ct, r in problem.rule_violations(t, b):
+            violate.append([f"Car {i}", ct, r])
+        if log:
+            logging.info(f"Rules per type: {len(violate) == 0} {violate}")
+        return len(violate) == 0
+
     for i, el in it.product(range(nv), problem.if_constraints):
         type = el.get_type()
         tlist = el.orig_types
@@ -122,8 +152,16 @@ def check_type_features(sample, nv, problem, log):
     return len(violate) == 0
 
 
-def check_allowed_features(sample, nv, problem, log):
+def check_allowed_features(sample, nv, problem, log, arrays=None):
     violate = []
+    if isinstance(problem, CompiledBMWProblem):
+        t, b = _get_arrays(sample, nv, problem, arrays)
+        for i, ct, j in problem.allowed_feature_violations(t, b):
+            violate.append([f"Car {i} is type {ct}, feature {j} not allowed"])
+        if log:
+            logging.info(f"Allowed features: {len(violate) == 0} {violate}")
+        return len(violate) == 0
+
     list_all_feat = set(problem.features)
     for i, tvars in it.product(range(nv), problem.tvars):
             result = list_all_feat.difference(tvars.vars)
@@ -166,7 +204,22 @@ def check_test_reqs(sample, nv, tests):
 
 
 def count_passed_test(sample, nv, tests, log):
+    """
+    tests is either list of TestReq or CompiledBMWProblem
+    """
     passed_tests, pass_all = defaultdict(lambda: []), defaultdict(lambda: [])
+    if isinstance(tests, CompiledBMWProblem):
+        _, b = tests.sample_to_arrays(sample, nv)
+        for k, i in zip(*tests.test_satisfaction(b).T.nonzero()):
+            passed_tests[tests.test_ids[k]].append(int(i))
+        for tid, count in zip(tests.test_ids, tests.test_counts.tolist()):
+            if tid in passed_tests and len(passed_tests[tid]) >= count:
+                pass_all[tid] = passed_tests[tid]
+        if log:
+            logging.info(f"Partially fulfilled tests: {len(passed_tests)}")
+            logging.info(f"Fulfilled tests: {len(pass_all)}")
+        return passed_tests
+
     for i, t in it.product(range(nv), tests):
         test_reqs = t.test
         flag = True
@@ -196,10 +249,13 @@ def sample_full_check(sample, nv, bmw_problem, energy, of, car_properties, log):
             logging.info(f"Car {i} is type {type} has features {features}")
     if log:
         logging.info(f"Energy: {energy+of}")
-    st = check_single_type(sample, nv, bmw_problem,log)
-    df = check_group_features(sample, nv, bmw_problem,log)
-    tf = check_type_features(sample, nv, bmw_problem,log)
-    af = check_allowed_features(sample, nv, bmw_problem,log)
+    arrays = None
+    if isinstance(bmw_problem, CompiledBMWProblem):
+        arrays = bmw_problem.sample_to_arrays(sample, nv)
+    st = check_single_type(sample, nv, bmw_problem, log, arrays)
+    df, _ = check_group_features(sample, nv, bmw_problem, log, arrays)
+    tf = check_type_features(sample, nv, bmw_problem, log, arrays)
+    af = check_allowed_features(sample, nv, bmw_problem, log, arrays)
     return st and df and tf and af
 
 
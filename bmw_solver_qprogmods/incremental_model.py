@@ -0,0 +1,179 @@
+"""
+    Between iterations of the greedy algorithm only the remaining tests and
+    their counts change, the buildability rules stay the same. The
+    buildability block (and backbone cuts) of a BMWIntegerProgramMAXSAT is
+    therefore built once and only the test constraints and the objective
+    are replaced:
+    - CQM and pulp models are updated in place, constraints of the previous
+      tests are removed by label. Variables of removed tests stay in the
+      model, unconstrained and out of the objective.
+    - BQM parts of the buildability block are shared by all iterations.
+    - MIP files are written from the VehicleTemplates of the block.
+    Models are rebuilt only when the tests change, trials of one iteration
+    get the same model.
+"""
+
+import threading
+from itertools import chain
+
+import dimod
+from pulp.pulp import LpProblem
+
+from bmw_solver_qprogmods.ip_sat_maxsat import TestObjectiveMAXSAT
+from bmw_solver_qprogmods.ip_utils import BQMWithoutPenalty, linear_bqm
+from bmw_solver_qprogmods.mip_writer import write_mip
+
+
+class IncrementalMAXSAT:
+    """
+    Models of bmw_ip, BMWIntegerProgramMAXSAT, for the current tests of its
+    problem. The returned CQM and pulp models are updated by the next
+    export, they must not be kept across iterations. Exports may be called
+    from concurrent trials, they run one at a time. stats is the ExportStats
+    of the last export of the calling thread, None if it built nothing.
+    """
+
+    def __init__(self, bmw_ip) -> None:
+        self.bmw_ip = bmw_ip
+        self._templates = None
+        self._cqm = None
+        self._cqm_labels = []
+        self._lp = None
+        self._lp_vars = dict()
+        self._lp_names = []
+        self._bqm_static = dict()
+        self._states = dict()  # mode -> (tests state, model)
+        self._lock = threading.Lock()
+        self._local = threading.local()  # stats of the exports of each thread
+
+    @property
+    def stats(self):
+        return getattr(self._local, "stats", None)
+
+    def _exported(self, model):
+        """
+        Keeps the stats of the export, called under the lock, before other
+        threads export
+        """
+        self._local.stats = self.bmw_ip.stats
+        return model
+
+    def _state(self):
+        return tuple((test.id, test.count) for test in self.bmw_ip.problem.tests)
+
+    def _cached(self, mode, options=None):
+        state, model = self._states.get(mode, (None, None))
+        if state != (self._state(), options):
+            return None
+        # nothing was exported
+        self.bmw_ip.stats = None
+        return model
+
+    def _store(self, mode, model, options=None):
+        self._states[mode] = ((self._state(), options), model)
+        return model
+
+    def _build_templates(self):
+        if self._templates is None:
+            self._templates = list(self.bmw_ip._static_templates())
+
+    def _static_constraints(self):
+        self._build_templates()
+        for template in self._templates:
+            yield from template.replicate_all(self.bmw_ip.car_no)
+
+    def prepare_block(self):
+        """
+        Builds the VehicleTemplates of the buildability block ahead of the
+        first export
+        """
+        with self._lock:
+            self._build_templates()
+
+    @staticmethod
+    def _record(constraints, labels):
+        for c in constraints:
+            labels.append(c.label)
+            yield c
+
+    def export_dimod(self, bulk=True):
+        """
+        Returns CQM of bmw_ip.export_dimod(bulk)
+        """
+        with self._lock:
+            result = self._cached("dimod")
+            if result is not None:
+                return self._exported(result)
+            ip = self.bmw_ip
+            ip._start_stats("dimod")
+            if self._cqm is None:
+                self._cqm = dimod.ConstrainedQuadraticModel()
+                ip._add_dimod_constr(self._cqm, self._static_constraints(), bulk)
+            # dimod 0.10 has no remove_constraint, its constraints are a dict
+            remove = getattr(self._cqm, "remove_constraint", self._cqm.constraints.__delitem__)
+            for label in self._cqm_labels:
+                remove(label)
+            self._cqm_labels = []
+            ip._add_dimod_constr(self._cqm, self._record(ip._test_constraints(), self._cqm_labels), bulk)
+            self._cqm.set_objective(linear_bqm(ip._objective()))
+            return self._exported(self._store("dimod", ip._finish_stats(self._cqm)))
+
+    def export_pulp(self):
+        """
+        Returns LpProblem of bmw_ip.export_pulp
+        """
+        with self._lock:
+            result = self._cached("pulp")
+            if result is not None:
+                return self._exported(result)
+            ip = self.bmw_ip
+            ip._start_stats("pulp")
+            if self._lp is None:
+                self._lp = LpProblem()
+                ip._add_pulp_constr(self._lp, self._static_constraints(), self._lp_vars)
+            for name in self._lp_names:
+                del self._lp.constraints[name]
+            # pulp may change the labels, names are taken from the model
+            previous = set(self._lp.constraints)
+            ip._add_pulp_constr(self._lp, ip._test_constraints(), self._lp_vars)
+            self._lp_names = [name for name in self._lp.constraints if name not in previous]
+            obj = TestObjectiveMAXSAT(ip.car_no, ip._tests(), "pulp", ip.consider_count, self._lp_vars, ip.names)
+            self._lp.setObjective(obj.get_objective())
+            return self._exported(self._store("pulp", ip._finish_stats(self._lp)))
+
+    def export_mip(self, filename):
+        """
+        Writes the model of bmw_ip.export_mip(filename), returns names of the
+        variables
+        """
+        with self._lock:
+            ip = self.bmw_ip
+            ip._start_stats("mip")
+            constraints = chain(self._static_constraints(), ip._test_constraints())
+            variables = write_mip(filename, ip._track(constraints), ip._objective(), ip.names)
+            return self._exported(ip._finish_stats(variables))
+
+    def export_pyqubo(self, strength, penalty_dict=None, native=False, slack_free=False,
+                      unbalanced=None):
+        """
+        Returns BQMWithoutPenalty of bmw_ip.export_pyqubo, or the BQM if
+        penalty_dict is given
+        """
+        options = dict(native=native, slack_free=slack_free, unbalanced=unbalanced)
+        key = (strength, native, slack_free, unbalanced)
+        with self._lock:
+            result = self._cached("pyqubo", key)
+            if result is None:
+                ip = self.bmw_ip
+                ip._start_stats("pyqubo")
+                if key not in self._bqm_static:
+                    self._bqm_static[key] = ip._static_parts_pyqubo(strength, **options)
+                result = BQMWithoutPenalty()
+                for part, bqm in chain(self._bqm_static[key].dicts.items(),
+                                       ip._test_parts_pyqubo(strength, **options).items()):
+                    result[part] = bqm
+                self._store("pyqubo", ip._finish_stats(result), key)
+            self._exported(result)
+        if penalty_dict is None:
+            return result
+        return result.to_bqm(penalty_dict)
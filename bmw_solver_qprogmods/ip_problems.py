@@ -1,129 +1,240 @@
 from copy import deepcopy
+from itertools import chain, islice
 
 from pulp import LpVariable, LpBinary
 from pulp.pulp import LpProblem
 
 from bmw_solver_qprogmods.bmw_parser import BMWProblem
+from bmw_solver_qprogmods.bqm_builder import BQMBuilder
+from bmw_solver_qprogmods.export_stats import ExportStats
 from bmw_solver_qprogmods.general_ip_constraints import *
 from bmw_solver_qprogmods.ip_sat_maxsat import *
 from bmw_solver_qprogmods.ip_scheduling import *
 from bmw_solver_qprogmods.ip_utils import *
 from bmw_solver_qprogmods.ip_utils import _extend_bqm
+from bmw_solver_qprogmods.mip_writer import write_mip
+from bmw_solver_qprogmods.test_reduction import test_dominance
+from bmw_solver_qprogmods.vehicle_template import VehicleTemplate
+
+# number of constraints added to dimod models at once
+CHUNK_SIZE = 10000
+
+
+def _chunks(iterator, size=CHUNK_SIZE):
+    iterator = iter(iterator)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
 
 
 class BMWIntegerProgram:
-    def __init__(self, bmwproblem: BMWProblem, nv) -> None:
+    def __init__(self, bmwproblem: BMWProblem, nv, integer_labels=False,
+                 feat_per_type="pairwise", collect_stats=False, trace_memory=False) -> None:
+        """
+        If integer_labels is True, dimod and pulp models are built with
+        integer labels from self.names, a VariableRegistry. pyqubo models
+        always use string labels.
+        feat_per_type is the formulation of forbidden features, one of
+        FEAT_PER_TYPE_FORMULATIONS, see FeatPerType.
+        If collect_stats is True, each export stores its ExportStats in
+        self.stats, with peak memory per family if trace_memory is True.
+        """
         assert nv > 0
+        assert feat_per_type in FEAT_PER_TYPE_FORMULATIONS
         self.problem = bmwproblem
         self.car_no = nv
+        self.names = VariableRegistry() if integer_labels else VariableNames()
+        self.feat_per_type = feat_per_type
+        self.collect_stats = collect_stats
+        self.trace_memory = trace_memory
+        self.stats = None
+
+    def _start_stats(self, mode):
+        self.stats = ExportStats(mode, self.trace_memory) if self.collect_stats else None
+
+    def _track(self, constraints):
+        return constraints if self.stats is None else self.stats.track(constraints)
+
+    def _finish_stats(self, model):
+        if self.stats is not None:
+            self.stats.finish(model, self.names)
+        return model
+
+    def _names(self, mode):
+        # pyqubo accepts only string labels
+        return VariableNames() if mode == "pyqubo" else self.names
 
     def _add_pyqubo_part(self, iterator, strength=0):
         tmp_result = 0
         for constr in iterator:
-            if isinstance(constr, EqConstraint) or isinstance(constr, IneqConstraint):
-                tmp_result += constr.export("pyqubo")
+            if isinstance(constr, (Constraint, ProductPenalty, ConditionalPenalty, AtMostOnePenalty,
+                                   UnbalancedPenalty)):
+                tmp_result += constr.export_pyqubo()
             else:
                 tmp_result += constr
+        if isinstance(tmp_result, (int, float)):
+            return dimod.BinaryQuadraticModel({}, {}, tmp_result, dimod.Vartype.BINARY)
         return tmp_result.compile(strength=strength).to_bqm()
 
-    def _general_conditions_pyqubo(self, strength):
+    def _add_bqm_part(self, iterator, strength=0):
+        return BQMBuilder(strength).add_all(iterator).to_bqm()
+
+    def _add_part(self, iterator, strength=0, native=False, slack_free=False, unbalanced=None):
+        """
+        If slack_free is True or unbalanced is given, inequalities are
+        replaced by slack_free_penalties(constraint, unbalanced)
+        """
+        iterator = self._track(iterator)
+        if slack_free or unbalanced is not None:
+            iterator = (p for constr in iterator for p in slack_free_penalties(constr, unbalanced))
+        if native:
+            return self._add_bqm_part(iterator, strength)
+        return self._add_pyqubo_part(iterator, strength)
+
+    def _template_part(self, iterator, strength=0, **options):
+        """
+        BQM of the constraints of car 0 in iterator, copied to all cars
+        """
+        return _extend_bqm(self._add_part(iterator, strength, **options), self.car_no)
+
+    def _replicate(self, iterator, names):
+        """
+        Constraints of car 0 in iterator, copied to all cars, generated one
+        car at a time
+        """
+        return VehicleTemplate(iterator, names).replicate_all(self.car_no)
+
+    def _general_conditions_pyqubo(self, strength, **options):
+        """
+        The BQMs are built for car 0 and copied to other cars, for options
+        see export_pyqubo and _add_part
+        """
         result = BQMWithoutPenalty()
         types = self.problem.cartypes
-        features = self.problem.features
-        nv = self.car_no
         problem = self.problem
+        compiled = problem.compile()
+        names = self._names("pyqubo")
 
-        tmp = self._add_pyqubo_part(SingleType(nv, types))
+        tmp = self._template_part(SingleType(1, types, names), **options)
         result["single_type"] = tmp
 
-        feat_per_type = FeatPerType(
-            nv, types, features, problem.tvars, mode="pyqubo")
-        tmp = self._add_pyqubo_part(feat_per_type)
+        feat_per_type = FeatPerType.from_compiled(1, compiled, mode="pyqubo", names=names,
+                                                  formulation=self.feat_per_type)
+        tmp = self._template_part(feat_per_type, **options)
         result["feat_per_type"] = tmp
 
-        group_features = GroupFeatures(nv, problem.exclusion_vars)
-        tmp = self._add_pyqubo_part(group_features)
+        group_features = GroupFeatures.from_compiled(1, compiled, names)
+        tmp = self._template_part(group_features, **options)
         result["group_features"] = tmp
 
         rules_per_type = RulesPerType(
-            1, types, problem.if_constraints, mode="pyqubo")
-        tmp = self._add_pyqubo_part(rules_per_type, strength)
-        result["rules_per_type"] = _extend_bqm(tmp, nv)
-
-        # rules_per_type = RulesPerType(
-        #     nv, types, problem.if_constraints, mode="pyqubo")
-        # tmp = self._add_pyqubo_part(rules_per_type, strength)
-        # extend_bqm(tmp, 2)
-        # result["rules_per_type"] = tmp
+            1, types, problem.if_constraints, mode="pyqubo", names=names)
+        result["rules_per_type"] = self._template_part(rules_per_type, strength, **options)
 
         return result
 
-    def _add_dimod_constr(self, result, constraints):
+    def _add_dimod_constr(self, result, constraints, bulk=False):
+        constraints = self._track(constraints)
+        if bulk:
+            self._add_dimod_constr_bulk(result, constraints)
+            return
         for c in constraints:
             label = c.label
             c_export = c.export_dimod()
             result.add_constraint(c_export, label=label)
 
+    def _add_dimod_constr_bulk(self, result, constraints):
+        """
+        Adds constraints straight from their coefficients, without building
+        a BinaryQuadraticModel for each of them. Constraints are consumed in
+        chunks of CHUNK_SIZE, variables of a chunk are added first, in order
+        of appearance.
+        """
+        for chunk in _chunks(constraints):
+            variables = dict.fromkeys(var for c in chunk for var in c.vars)
+            add_cqm_variables(result, variables)
+            for c in chunk:
+                sense = "==" if isinstance(c, EqConstraint) else "<="
+                result.add_constraint_from_iterable(zip(c.vars, c.values), sense, c.offset, label=c.label)
+
     def _refill_pulp_vars(self, c, vars):
         for var in c.vars:
             if var not in vars:
-                vars[var] = LpVariable(var, cat=LpBinary)
+                vars[var] = LpVariable(self.names.name(var), cat=LpBinary)
 
     def _add_pulp_constr(self, result, constraints, vars):
+        constraints = self._track(constraints)
         for c in constraints:
             self._refill_pulp_vars(c, vars)
             result += c.export_pulp(vars)
 
-    def _general_conditions_dimod(self):
-        types = self.problem.cartypes
-        features = self.problem.features
-        nv = self.car_no
-        problem = self.problem
-
-        result = dimod.ConstrainedQuadraticModel()
-
-        self._add_dimod_constr(result, SingleType(nv, types))
-
-        feat_per_type = FeatPerType(
-            nv, types, features, problem.tvars, mode="dimod")
-        self._add_dimod_constr(result, feat_per_type)
-
-        group_features = GroupFeatures(nv, problem.exclusion_vars)
-        self._add_dimod_constr(result, group_features)
-
-        rules_per_type = RulesPerType(
-            nv, types, problem.if_constraints, mode="dimod")
-        self._add_dimod_constr(result, rules_per_type)
-        return result
-
-    def _general_conditions_pulp(self, vars):
-        assert NotImplementedError()
+    def _general_templates(self):
+        """
+        Yields VehicleTemplates of SingleType, FeatPerType, GroupFeatures and
+        RulesPerType, in dimod mode
+        """
         types = self.problem.cartypes
-        features = self.problem.features
-        nv = self.car_no
         problem = self.problem
+        compiled = problem.compile()
+        names = self.names
 
-        result = LpProblem()
-
-        self._add_pulp_constr(result, SingleType(nv, types), vars)
+        yield VehicleTemplate(SingleType(1, types, names), names)
 
-        feat_per_type = FeatPerType(
-            nv, types, features, problem.tvars, mode="dimod")
-        self._add_pulp_constr(result, feat_per_type, vars)
+        feat_per_type = FeatPerType.from_compiled(1, compiled, mode="dimod", names=names,
+                                                  formulation=self.feat_per_type)
+        yield VehicleTemplate(feat_per_type, names)
 
-        group_features = GroupFeatures(nv, problem.exclusion_vars)
-        self._add_pulp_constr(result, group_features, vars)
+        group_features = GroupFeatures.from_compiled(1, compiled, names)
+        yield VehicleTemplate(group_features, names)
 
         rules_per_type = RulesPerType(
-            nv, types, problem.if_constraints, mode="dimod")
-        self._add_pulp_constr(result, rules_per_type, vars)
-        return result
-
-    def export(self, mode, strength=None, penalty_dict=None):
+            1, types, problem.if_constraints, mode="dimod", names=names)
+        yield VehicleTemplate(rules_per_type, names)
+
+    def _general_constraints(self):
+        """
+        Yields constraints of SingleType, FeatPerType, GroupFeatures and
+        RulesPerType of all cars, in dimod mode
+        """
+        for template in self._general_templates():
+            yield from template.replicate_all(self.car_no)
+
+    def _constraints(self):
+        """
+        Yields all constraints of export_dimod, export_pulp and export_mip
+        """
+        return self._general_constraints()
+
+    def _objective(self):
+        """
+        Objective of export_mip as a list of (label, bias)
+        """
+        return []
+
+    def export_mip(self, filename):
+        """
+        Writes the model of export_pulp to MPS or LP file, by the extension
+        of filename, without building the pulp model. Returns names of the
+        variables, for solve_mip and read_solution of mip_writer.
+        """
+        self._start_stats("mip")
+        variables = write_mip(filename, self._track(self._constraints()), self._objective(), self.names)
+        return self._finish_stats(variables)
+
+    def export(self, mode, strength=None, penalty_dict=None, bulk=False):
+        """
+        Mode "bqm" is "pyqubo" with the BQMs built by BQMBuilder, see
+        export_pyqubo.
+        If bulk is True, dimod constraints are added from their coefficients,
+        see _add_dimod_constr_bulk
+        """
         if mode == "pyqubo":
             return self.export_pyqubo(strength, penalty_dict)
+        elif mode == "bqm":
+            return self.export_pyqubo(strength, penalty_dict, native=True)
         elif mode == "dimod":
-            return self.export_dimod()
+            return self.export_dimod(bulk)
         elif mode == "pulp":
             return self.export_pulp()
         else:
@@ -131,127 +242,231 @@ class BMWIntegerProgram:
 
 
 class BMWIntegerProgramSAT(BMWIntegerProgram):
-    def export_pyqubo(self, strength, penalty_dict=None):
+    def export_pyqubo(self, strength, penalty_dict=None, native=False, slack_free=False,
+                      unbalanced=None):
+        """
+        If native is True, the BQMs are built by BQMBuilder instead of pyqubo,
+        with other auxiliary variables of cubic terms, see bqm_builder.
+        If slack_free is True, inequalities of recognized patterns get exact
+        penalties without slack variables, see slack_free_penalties. If
+        unbalanced = (l1, l2), the remaining inequalities get unbalanced
+        penalties l1*g + l2*g^2 without slack as well, e.g. (1, 1) puts
+        zero penalty on g = 0 and g = -1.
+        """
         nv = self.car_no
         problem = self.problem
+        compiled = problem.compile()
+        options = dict(native=native, slack_free=slack_free, unbalanced=unbalanced)
+        self._start_stats("pyqubo")
 
-        result = self._general_conditions_pyqubo(strength)
+        result = self._general_conditions_pyqubo(strength, **options)
 
-        test_constraints = TestConditions(nv, problem.tests, mode="pyqubo")
-        tmp = self._add_pyqubo_part(test_constraints, strength)
+        names = self._names("pyqubo")
+        test_constraints = TestConditions.from_compiled(1, compiled, mode="pyqubo", names=names)
+        tmp = self._template_part(test_constraints, strength, **options)
         result["test_constraint"] = tmp
 
-        test_constraints = TestConditionsSAT(nv, problem.tests)
-        tmp = self._add_pyqubo_part(test_constraints)
+        test_constraints = TestConditionsSAT(nv, problem.tests, names)
+        tmp = self._add_part(test_constraints, **options)
         result["test_objective"] = tmp
 
+        self._finish_stats(result)
         if penalty_dict == None:
             return result
         else:
             return result.to_bqm(penalty_dict)
 
-    def export_dimod(self):
+    def _constraints(self):
         nv = self.car_no
         problem = self.problem
+        compiled = problem.compile()
 
-        result = self._general_conditions_dimod()
+        yield from self._general_constraints()
 
-        test_constraints = TestConditions(nv, problem.tests, mode="dimod")
-        self._add_dimod_constr(result, test_constraints)
+        test_constraints = TestConditions.from_compiled(1, compiled, mode="dimod", names=self.names)
+        yield from self._replicate(test_constraints, self.names)
 
-        test_constraints = TestConditionsSAT(nv, problem.tests)
-        self._add_dimod_constr(result, test_constraints)
+        yield from TestConditionsSAT(nv, problem.tests, self.names)
+
+    def export_dimod(self, bulk=False):
+        self._start_stats("dimod")
+        result = dimod.ConstrainedQuadraticModel()
+        self._add_dimod_constr(result, self._constraints(), bulk)
 
         y = dimod.Binary(result.variables[0])
         result.set_objective(y-y)
-        return result
+        return self._finish_stats(result)
 
     def export_pulp(self):
-        nv = self.car_no
-        problem = self.problem
-
+        self._start_stats("pulp")
         vars = dict()
-        result = self._general_conditions_pulp(vars)
-
-        test_constraints = TestConditions(nv, problem.tests, mode="dimod")
-        self._add_pulp_constr(result, test_constraints, vars)
-
-        test_constraints = TestConditionsSAT(nv, problem.tests)
-        self._add_pulp_constr(result, test_constraints, vars)
-
-        return result
+        result = LpProblem()
+        self._add_pulp_constr(result, self._constraints(), vars)
+        return self._finish_stats(result)
 
 
 class BMWIntegerProgramMAXSAT(BMWIntegerProgram):
-    def __init__(self, bmwproblem: BMWProblem, nv, consider_count=False) -> None:
-        assert nv > 0
-        self.problem = bmwproblem
-        self.car_no = nv
+    def __init__(self, bmwproblem: BMWProblem, nv, consider_count=False, use_backbone=False,
+                 use_test_dominance=False, use_compatibility=False, integer_labels=False,
+                 feat_per_type="pairwise", collect_stats=False, trace_memory=False) -> None:
+        """
+        If use_backbone is True, features forced by the car type are fixed
+        and implications valid for all types are added as cuts.
+        If use_test_dominance is True, tests implying other test reuse its
+        p variable instead of repeating the shared literals.
+        If use_compatibility is True, tests no type can satisfy are left out
+        and p variables are bounded by the types compatible with the test.
+        For integer_labels, feat_per_type, collect_stats and trace_memory see
+        BMWIntegerProgram.
+        """
+        super().__init__(bmwproblem, nv, integer_labels, feat_per_type, collect_stats, trace_memory)
         self.consider_count = consider_count
+        self.use_backbone = use_backbone
+        self.use_test_dominance = use_test_dominance
+        self.use_compatibility = use_compatibility
+
+    def _tests(self):
+        if not self.use_compatibility:
+            return self.problem.tests
+        compatibility = self.problem.test_compatibility()
+        return [test for test in self.problem.tests if len(compatibility[test.id]) > 0]
+
+    def _backbone_cuts(self, mode):
+        """
+        Cuts of car 0
+        """
+        types = self.problem.cartypes
+        return BackboneCuts(1, types, self.problem.backbone(), mode, self._names(mode))
+
+    def _test_conditions(self, compiled, tests, mode):
+        """
+        Test conditions of car 0
+        """
+        names = self._names(mode)
+        result = TestConditions.from_compiled(1, compiled, mode, names)
+        if self.use_test_dominance:
+            # p of a test bounded by its count can't be shared
+            free_ids = [test.id for test in tests
+                        if not self.consider_count or test.count >= self.car_no]
+            result.set_dominance(test_dominance(tests, free_ids))
+        if self.use_compatibility:
+            compatibility = TestTypeCompatibility(
+                1, tests, self.problem.cartypes, self.problem.test_compatibility(), mode,
+                names)
+            result = chain(result, compatibility)
+        return result
+
+    def _static_parts_pyqubo(self, strength, **options):
+        """
+        BQMWithoutPenalty of the parts which don't depend on the tests
+        """
+        result = self._general_conditions_pyqubo(strength, **options)
+        if self.use_backbone:
+            result["backbone"] = self._template_part(self._backbone_cuts("pyqubo"), **options)
+        return result
 
-    def export_pyqubo(self, strength, penalty_dict=None):
+    def _test_parts_pyqubo(self, strength, native=False, **options):
+        """
+        Returns dict of the parts "test_constraint" and "test_objective"
+        """
         nv = self.car_no
         problem = self.problem
+        tests = self._tests()
+        compiled = problem.compile(tests)
         ccount = self.consider_count
+        options = dict(options, native=native)
+        result = dict()
 
-        result = self._general_conditions_pyqubo(strength)
+        test_constraints = self._test_conditions(compiled, tests, "pyqubo")
+        tmp1 = self._template_part(test_constraints, **options)
 
-        test_constraints = TestConditions(nv, problem.tests, mode="pyqubo")
-        tmp1 = self._add_pyqubo_part(test_constraints)
-
-        test_constraints = TestConditionsMAXSAT(nv, problem.tests, ccount)
-        tmp2 = self._add_pyqubo_part(test_constraints)
+        names = self._names("pyqubo")
+        test_constraints = TestConditionsMAXSAT(nv, tests, ccount, names)
+        tmp2 = self._add_part(test_constraints, **options)
         result["test_constraint"] = tmp1 + tmp2
 
-        obj = TestObjectiveMAXSAT(nv, problem.tests, "pyqubo", ccount)
-        result["test_objective"] = obj.get_objective().compile().to_bqm()
+        obj = TestObjectiveMAXSAT(nv, tests, "pyqubo", ccount, names=names)
+        if native:
+            result["test_objective"] = dimod.BinaryQuadraticModel(
+                dict(obj.get_linear()), {}, 0, dimod.Vartype.BINARY)
+        else:
+            result["test_objective"] = obj.get_objective().compile().to_bqm()
+        return result
+
+    def export_pyqubo(self, strength, penalty_dict=None, native=False, slack_free=False,
+                      unbalanced=None):
+        """
+        For native, slack_free and unbalanced see
+        BMWIntegerProgramSAT.export_pyqubo
+        """
+        options = dict(native=native, slack_free=slack_free, unbalanced=unbalanced)
+        self._start_stats("pyqubo")
+
+        result = self._static_parts_pyqubo(strength, **options)
+        for part, bqm in self._test_parts_pyqubo(strength, **options).items():
+            result[part] = bqm
 
+        self._finish_stats(result)
         if penalty_dict == None:
             return result
         else:
             return result.to_bqm(penalty_dict)
 
-    def export_dimod(self):
+    def _static_templates(self):
+        """
+        Yields VehicleTemplates of the constraints which don't depend on the
+        tests, the buildability rules and the backbone cuts
+        """
+        yield from self._general_templates()
+        if self.use_backbone:
+            yield VehicleTemplate(self._backbone_cuts("dimod"), self.names)
+
+    def _test_constraints(self):
+        """
+        Yields constraints of the remaining tests, of all cars
+        """
         nv = self.car_no
         problem = self.problem
-        ccount = self.consider_count
-
-        result = self._general_conditions_dimod()
+        tests = self._tests()
+        compiled = problem.compile(tests)
 
-        test_constraints = TestConditions(nv, problem.tests, mode="dimod")
-        self._add_dimod_constr(result, test_constraints)
+        test_constraints = self._test_conditions(compiled, tests, "dimod")
+        yield from self._replicate(test_constraints, self.names)
 
-        test_constraints = TestConditionsMAXSAT(nv, problem.tests, ccount)
-        self._add_dimod_constr(result, test_constraints)
+        yield from TestConditionsMAXSAT(nv, tests, self.consider_count, self.names)
 
-        obj = TestObjectiveMAXSAT(nv, problem.tests, "dimod", ccount)
-        result.set_objective(obj.get_objective())
-        return result
+    def _constraints(self):
+        for template in self._static_templates():
+            yield from template.replicate_all(self.car_no)
+        yield from self._test_constraints()
 
-    def export_pulp(self):
-        nv = self.car_no
-        problem = self.problem
-        ccount = self.consider_count
+    def _objective(self):
+        obj = TestObjectiveMAXSAT(self.car_no, self._tests(), "dimod", self.consider_count, names=self.names)
+        return obj.get_linear()
 
-        vars = dict()
-        result = self._general_conditions_pulp(vars)
+    def export_dimod(self, bulk=False):
+        self._start_stats("dimod")
+        result = dimod.ConstrainedQuadraticModel()
+        self._add_dimod_constr(result, self._constraints(), bulk)
 
-        test_constraints = TestConditions(nv, problem.tests, mode="dimod")
-        self._add_pulp_constr(result, test_constraints, vars)
+        obj = TestObjectiveMAXSAT(self.car_no, self._tests(), "dimod", self.consider_count, names=self.names)
+        result.set_objective(linear_bqm(obj.get_linear()) if bulk else obj.get_objective())
+        return self._finish_stats(result)
 
-        test_constraints = TestConditionsMAXSAT(nv, problem.tests, ccount)
-        self._add_pulp_constr(result, test_constraints, vars)
+    def export_pulp(self):
+        self._start_stats("pulp")
+        vars = dict()
+        result = LpProblem()
+        self._add_pulp_constr(result, self._constraints(), vars)
 
-        obj = TestObjectiveMAXSAT(nv, problem.tests, "pulp", ccount, vars)
+        obj = TestObjectiveMAXSAT(self.car_no, self._tests(), "pulp", self.consider_count, vars, self.names)
         result += obj.get_objective()
-        return result
+        return self._finish_stats(result)
 
 
 class BMWIntegerProgramScheduling(BMWIntegerProgram):
     def __init__(self, bmwproblem: BMWProblem, nv, days_no, engineers_no, use_time_frames=False, use_groups=False) -> None:
-        assert nv > 0
-        self.problem = bmwproblem
-        self.car_no = nv
+        super().__init__(bmwproblem, nv)
         assert days_no > 0
         self.days_no = days_no
         assert engineers_no > 0
@@ -267,39 +482,38 @@ class BMWIntegerProgramScheduling(BMWIntegerProgram):
                 t.count = 1
                 self.tests_unfolded.append(t)
 
-    def export_pyqubo(self, strength, penalty_dict=None):
+    def export_pyqubo(self, strength, penalty_dict=None, native=False, slack_free=False,
+                      unbalanced=None):
         nv = self.car_no
-        result = self._general_conditions_pyqubo(strength)
+        options = dict(native=native, slack_free=slack_free, unbalanced=unbalanced)
+        self._start_stats("pyqubo")
+        result = self._general_conditions_pyqubo(strength, **options)
 
         test_constraints = TestConditionsScheduling(
             nv, self.tests_unfolded, "pyqubo", self.days_no, self.engineers_no, self._timef, self._groups)
-        tmp = self._add_pyqubo_part(test_constraints)
+        tmp = self._add_part(test_constraints, **options)
         result["test_constraint"] = tmp
 
+        self._finish_stats(result)
         if penalty_dict == None:
             return result
         else:
             return result.to_bqm(penalty_dict)
 
-    def export_dimod(self):
-        nv = self.car_no
-
-        result = self._general_conditions_dimod()
-
-        test_constraints = TestConditionsScheduling(
-            nv, self.tests_unfolded, "dimod", self.days_no, self.engineers_no, self._timef, self._groups)
-        self._add_dimod_constr(result, test_constraints)
+    def _constraints(self):
+        yield from self._general_constraints()
+        yield from TestConditionsScheduling(
+            self.car_no, self.tests_unfolded, "dimod", self.days_no, self.engineers_no, self._timef, self._groups)
 
-        return result
+    def export_dimod(self, bulk=False):
+        self._start_stats("dimod")
+        result = dimod.ConstrainedQuadraticModel()
+        self._add_dimod_constr(result, self._constraints(), bulk)
+        return self._finish_stats(result)
 
     def export_pulp(self):
-        nv = self.car_no
-
+        self._start_stats("pulp")
         vars = dict()
-        result = self._general_conditions_pulp(vars)
-
-        test_constraints = TestConditionsScheduling(
-            nv, self.tests_unfolded, "dimod", self.days_no, self.engineers_no, self._timef, self._groups)
-        self._add_pulp_constr(result, test_constraints, vars)
-
-        return result
+        result = LpProblem()
+        self._add_pulp_constr(result, self._constraints(), vars)
+        return self._finish_stats(result)
@@ -1,7 +1,7 @@
 from itertools import product
 
 from pulp.constants import LpBinary
-from pulp.pulp import LpVariable
+from pulp.pulp import LpAffineExpression, LpVariable
 
 from bmw_solver_qprogmods.ip_utils import *
 
@@ -11,29 +11,57 @@ class TestConditions:
     Asserts car can be used for given test conditions (common for SAT and MAX-SAT problems)
     """
 
-    def __init__(self, car_no, tests, mode) -> None:
+    def __init__(self, car_no, tests, mode, names=None) -> None:
         self.car_no = car_no
-        self.tests = tests
+        self.names = VariableNames() if names is None else names
+        self.tests = [(test.id, test.test) for test in tests]
         assert mode == "pyqubo" or mode == "dimod"
         self.mode = mode
+        self.dominance = dict()
+
+    @classmethod
+    def from_compiled(cls, car_no, compiled, mode, names=None):
+        result = cls(car_no, [], mode, names)
+        result.tests = [(compiled.test_ids[k], compiled.test_literals(k))
+                        for k in range(compiled.tests_no)]
+        return result
+
+    def set_dominance(self, dominance):
+        """
+        dominance maps test id -> (weaker test id, remaining literals), see
+        test_reduction.test_dominance. Literals implied by the weaker test are
+        replaced by p_{car}_{test} <= p_{car}_{weaker test}, which is valid only if
+        p of the weaker test can be 1 whenever its literals hold.
+        """
+        self.dominance = {test_id: weaker for test_id, (weaker, _) in dominance.items()}
+        self.tests = [(test_id, dominance[test_id][1] if test_id in dominance else literals)
+                      for test_id, literals in self.tests]
+
+    def _dominance_constraint(self, car_id, test_id):
+        cartest = self.names.test_var(car_id, test_id)
+        weaker = self.names.test_var(car_id, self.dominance[test_id])
+        label = f"test_dominance_{car_id}_{test_id}"
+        if self.mode == "pyqubo":
+            return ProductPenalty([(cartest, 1), (weaker, 0)], label)
+        return IneqConstraint([cartest, weaker], [1, -1], 0, label)
 
     def _test_to_constraints(self, car_id, test):
+        test_id, literals = test
         constraints = []
-        for var_id, var in enumerate(test.test):
-            label = f"test_constraint_{car_id}_{test.id}_{var_id}"
+        if test_id in self.dominance:
+            constraints.append(self._dominance_constraint(car_id, test_id))
+        for var_id, var in enumerate(literals):
+            label = f"test_constraint_{car_id}_{test_id}_{var_id}"
             if var[0] in [0, 1]:
                 if self.mode == "pyqubo":
-                    cartest = pyqubo.Binary(get_car_test_name(car_id, test.id))
-                    carfeat = pyqubo.Binary(
-                        get_car_feature_name(car_id, var[1]))
-                    if var[0] == 0:
-                        constraints += [(1-carfeat)*cartest]
-                    else:  # var[0] == 1
-                        constraints += [carfeat*cartest]
+                    cartest = self.names.test_var(car_id, test_id)
+                    carfeat = self.names.feature_var(car_id, var[1])
+                    # var[0] == 0 forbids b == 0, var[0] == 1 forbids b == 1
+                    constraints += [ProductPenalty([(carfeat, var[0]), (cartest, 1)], label)]
                 else:
 
-                    cartest = get_car_test_name(car_id, test.id)
-                    carfeat = get_car_feature_name(car_id, var[1])
+                    cartest = self.names.test_var(car_id, test_id)
+                    carfeat = self.names.feature_var(car_id, var[1])
                     if var[0] == 0:
                         constraints += [IneqConstraint(
                             [carfeat, cartest], [-1, 1], 0, label)]
@@ -41,21 +69,54 @@ class TestConditions:
                         constraints += [IneqConstraint(
                             [carfeat, cartest], [1, 1], 1, label)]
             elif var[0] == 2:
-                vars = [get_car_feature_name(car_id, v) for v in var[1]]
-                vars += [get_car_test_name(car_id, test.id)]
+                vars = [self.names.feature_var(car_id, v) for v in var[1]]
+                vars += [self.names.test_var(car_id, test_id)]
                 values = [-1 for _ in var[1]]
                 values += [1]
                 constraints += [IneqConstraint(vars, values, 0, label)]
             else:
-                raise ValueError(f"incorrect test var {test} ({var})")
+                raise ValueError(f"incorrect test var {test_id} ({var})")
         return constraints
 
     def __iter__(self):
-        constraints = []
         for car_id, test in product(range(self.car_no), self.tests):
-            constraints += self._test_to_constraints(car_id, test)
+            yield from self._test_to_constraints(car_id, test)
 
-        return constraints.__iter__()
+
+class TestTypeCompatibility:
+    """
+    Asserts car is of a type compatible with the tests it is considered for,
+    compatibility maps test id -> types which can satisfy the test
+    """
+
+    def __init__(self, car_no, tests, types_list, compatibility, mode, names=None) -> None:
+        self.car_no = car_no
+        self.names = VariableNames() if names is None else names
+        self.types_list = types_list
+        self.tests = [(test.id, compatibility[test.id]) for test in tests]
+        assert mode == "pyqubo" or mode == "dimod"
+        self.mode = mode
+
+    def _test_to_constraints(self, car_id, test_id, compatible):
+        cartest = self.names.test_var(car_id, test_id)
+        compatible = [t for t in self.types_list if t in compatible]
+        incompatible = [t for t in self.types_list if t not in compatible]
+        label = f"test_type_{car_id}_{test_id}"
+        if self.mode == "pyqubo":
+            # car has exactly one type
+            return [ProductPenalty([(cartest, 1), (self.names.type_var(car_id, t), 1)], label)
+                    for t in incompatible]
+        if len(incompatible) <= len(compatible):
+            vars = [cartest] + [self.names.type_var(car_id, t) for t in incompatible]
+            return [IneqConstraint(vars, [1 for _ in vars], 1, label)]
+        vars = [cartest] + [self.names.type_var(car_id, t) for t in compatible]
+        return [IneqConstraint(vars, [1] + [-1 for _ in compatible], 0, label)]
+
+    def __iter__(self):
+        for car_id, (test_id, compatible) in product(range(self.car_no), self.tests):
+            if all(t in compatible for t in self.types_list):
+                continue
+            yield from self._test_to_constraints(car_id, test_id, compatible)
 
 
 class TestConditionsSAT:
@@ -63,18 +124,16 @@ class TestConditionsSAT:
     Asserts the test was considered sufficiently many times (SAT only)
     """
 
-    def __init__(self, car_no, tests) -> None:
+    def __init__(self, car_no, tests, names=None) -> None:
         self.car_no = car_no
+        self.names = VariableNames() if names is None else names
         self.tests = tests
 
     def __iter__(self):
-        constraints = []
         values = [1 for _ in range(self.car_no)]
         for test in self.tests:
-            vars = [get_car_test_name(i, test.id) for i in range(self.car_no)]
-            constraints.append(EqConstraint(
-                vars, values, test.count, f"test_sat_cond_{test.id}"))
-        return constraints.__iter__()
+            vars = [self.names.test_var(i, test.id) for i in range(self.car_no)]
+            yield EqConstraint(vars, values, test.count, f"test_sat_cond_{test.id}")
 
 
 class TestConditionsMAXSAT:
@@ -84,30 +143,27 @@ class TestConditionsMAXSAT:
     if False: creates new variables equivalent to test was considered sufficiently many times
     """
 
-    def __init__(self, car_no, tests, consider_counts) -> None:
+    def __init__(self, car_no, tests, consider_counts, names=None) -> None:
         self.car_no = car_no
+        self.names = VariableNames() if names is None else names
         self.tests = tests
         self.consider_counts = consider_counts
 
     def __iter__(self):
-        constraints = []
         if self.consider_counts:
             values = [1 for _ in range(self.car_no)]
             for test in self.tests:
-                vars = [get_car_test_name(i, test.id)
+                vars = [self.names.test_var(i, test.id)
                         for i in range(self.car_no)]
-                constraints.append(IneqConstraint(
-                    vars, values, test.count, f"test_sat_cond_{test.id}"))
+                yield IneqConstraint(vars, values, test.count, f"test_sat_cond_{test.id}")
         else:
             for test in self.tests:
                 values = [-1 for _ in range(self.car_no)]
                 values.append(test.count)
-                vars = [get_car_test_name(i, test.id)
+                vars = [self.names.test_var(i, test.id)
                         for i in range(self.car_no)]
-                vars.append(get_maxsat_test(test.id))
-                constraints.append(IneqConstraint(
-                    vars, values, 0, f"test_sat_cond_{test.id}"))
-        return constraints.__iter__()
+                vars.append(self.names.maxsat_var(test.id))
+                yield IneqConstraint(vars, values, 0, f"test_sat_cond_{test.id}")
 
 
 class TestObjectiveMAXSAT:
@@ -116,8 +172,10 @@ class TestObjectiveMAXSAT:
     creates objective function for MAX-SAT Problem
     """
 
-    def __init__(self, car_no, tests, mode, consider_counts, pulp_variables=None) -> None:
+    def __init__(self, car_no, tests, mode, consider_counts, pulp_variables=None,
+                 names=None) -> None:
         self.car_no = car_no
+        self.names = VariableNames() if names is None else names
         self.tests = tests
         self.mode = mode
         self.consider_counts = consider_counts
@@ -131,20 +189,31 @@ class TestObjectiveMAXSAT:
             return dimod.Binary(label)
         elif self.mode == "pulp":
             if label not in self.pulp_variables:
-                self.pulp_variables[label] = LpVariable(label, cat=LpBinary)
+                self.pulp_variables[label] = LpVariable(self.names.name(label), cat=LpBinary)
             return self.pulp_variables[label]
         else:
             raise ValueError("Unknown mode {self.mode}")
 
     def _get_bin_t(self, test):
-        label = get_maxsat_test(test.id)
+        label = self.names.maxsat_var(test.id)
         return self.get_var(label)
 
     def _get_bin_ct(self, car_id, test):
-        label = get_car_test_name(car_id, test.id)
+        label = self.names.test_var(car_id, test.id)
         return self.get_var(label)
 
+    def get_linear(self):
+        """
+        Returns the objective as a list of (label, bias)
+        """
+        if self.consider_counts:
+            iterator = product(range(self.car_no), self.tests)
+            return [(self.names.test_var(i, test.id), -test.weight) for i, test in iterator]
+        return [(self.names.maxsat_var(test.id), -test.weight) for test in self.tests]
+
     def get_objective(self):
+        if self.mode == "pulp":
+            return LpAffineExpression([(self.get_var(label), bias) for label, bias in self.get_linear()], 0)
         if self.consider_counts:
             iterator = product(range(self.car_no), self.tests)
             return -sum(test.weight*self._get_bin_ct(i, test) for i, test in iterator)
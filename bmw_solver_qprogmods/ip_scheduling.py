@@ -1,6 +1,5 @@
 from bmw_solver_qprogmods.ip_utils import *
 from itertools import product, combinations
-from time import time, sleep
 
 
 class TestConditionsScheduling:
@@ -93,17 +92,16 @@ class TestConditionsScheduling:
                     t2 = self.tests[ind2]
                     if self.mode == "pyqubo":
                         for i, (d1, d2) in product(cars, combinations(days, 2)):
-                            b1 = pyqubo.Binary(get_schedule_var(i, t1.id, d2))
-                            b2 = pyqubo.Binary(get_schedule_var(i, t2.id, d1))
-                            yield b1*b2
+                            b1 = get_schedule_var(i, t1.id, d2)
+                            b2 = get_schedule_var(i, t2.id, d1)
+                            label = f"test_scheduling_group_order_{ind1}_{ind2}_{i}_{d1}_{d2}"
+                            yield ProductPenalty([(b1, 1), (b2, 1)], label)
                     else:
-                        t = time()
                         for i, (d1, d2) in product(cars, combinations(days, 2)):
                             b1 = get_schedule_var(i, t1.id, d2)
                             b2 = get_schedule_var(i, t2.id, d1)
                             vars = [b1, b2]
                             label = f"test_scheduling_group_order_{ind1}_{ind2}_{i}_{d1}_{d2}"
                             yield IneqConstraint(vars, [1, 1], 1, label)
-                        # print(time()-t)
 
 
@@ -1,7 +1,12 @@
+from functools import lru_cache
+from itertools import product
+
 import dimod
+import numpy as np
 import pyqubo
 # from dimod import Bin
 from dimod import BinaryQuadraticModel
+from pulp import LpAffineExpression
 from pyqubo.integer.log_encoded_integer import LogEncInteger
 
 ################################################################
@@ -22,6 +27,26 @@ class BQMWithoutPenalty:
         self.dicts[k] = bqm
 
 
+def linear_bqm(linear):
+    """
+    Returns BinaryQuadraticModel of a list or iterator of (label, bias),
+    biases of repeated labels are summed
+    """
+    result = BinaryQuadraticModel({}, {}, 0, dimod.Vartype.BINARY)
+    # dimod 0.10 takes a Mapping or an Iterator, not a list
+    result.add_linear_from(iter(linear))
+    return result
+
+
+def add_cqm_variables(cqm, variables):
+    """
+    Adds binary variables to ConstrainedQuadraticModel in order, dimod 0.10
+    has no add_variables. They are added with a zero objective,
+    set_objective keeps the variables of the previous objective.
+    """
+    cqm.set_objective(linear_bqm((v, 0) for v in variables))
+
+
 ################################################################
 ################### Constraint classes #########################
 ################################################################
@@ -39,6 +64,13 @@ class Constraint:
         self.offset = offset
         self.label = label
 
+    def _pulp_expression(self, pulp_variables):
+        # built at once, sum of terms copies the expression for each term
+        coefficients = dict()
+        for var, val in zip(self.vars, self.values):
+            coefficients[var] = coefficients.get(var, 0) + val
+        return LpAffineExpression([(pulp_variables[var], val) for var, val in coefficients.items()], 0)
+
     def export(self, mode, pulp_variables:dict=None):
         if mode == "pyqubo":
             return self.export_pyqubo()
@@ -70,7 +102,7 @@ class EqConstraint(Constraint):
 
     def export_pulp(self, pulp_variables):
         assert pulp_variables is not None
-        return sum(val*pulp_variables[var] for var, val in zip(self.vars, self.values)) == self.offset, self.label
+        return self._pulp_expression(pulp_variables) == self.offset, self.label
 
 
 class IneqConstraint(Constraint):
@@ -97,7 +129,102 @@ class IneqConstraint(Constraint):
 
     def export_pulp(self, pulp_variables):
         assert pulp_variables is not None
-        return sum(val*pulp_variables[var] for var, val in zip(self.vars, self.values)) <= self.offset, self.label
+        return self._pulp_expression(pulp_variables) <= self.offset, self.label
+
+
+class ProductPenalty:
+    """
+    Penalty 1 when each (var, value) of literals holds, e.g. [(t, 1), (b, 0)]
+    is t*(1-b). Slack-free form of constraints forbidding a single combination,
+    label is the one of the constraint it replaces.
+    """
+
+    def __init__(self, literals, label=None) -> None:
+        self.literals = literals
+        self.label = label
+
+    def export_pyqubo(self):
+        expr = 1
+        for var, value in self.literals:
+            bin_var = pyqubo.Binary(var)
+            expr = expr * (bin_var if value == 1 else 1 - bin_var)
+        return expr
+
+
+class ConditionalPenalty:
+    """
+    Penalty of constraint which applies only when var is 0, (1-var)*penalty
+    """
+
+    def __init__(self, constraint, var) -> None:
+        self.constraint = constraint
+        self.var = var
+        self.label = constraint.label
+
+    def export_pyqubo(self):
+        return (1 - pyqubo.Binary(self.var)) * self.constraint.export_pyqubo()
+
+
+class AtMostOnePenalty:
+    """
+    Penalty sum_{i<j} x_i x_j, slack-free form of sum x <= 1
+    """
+
+    def __init__(self, vars, label=None) -> None:
+        self.vars = vars
+        self.label = label
+
+    def export_pyqubo(self):
+        bin_vars = [pyqubo.Binary(var) for var in self.vars]
+        return sum(x*y for k, x in enumerate(bin_vars) for y in bin_vars[k+1:])
+
+
+class UnbalancedPenalty:
+    """
+    Penalty l1*g + l2*g^2 of inequality g = sum a x - offset <= 0, where
+    lambdas = (l1, l2). Has no slack variables but it is not exact, feasible
+    points with g < 0 may get nonzero penalty.
+    """
+
+    def __init__(self, constraint, lambdas) -> None:
+        self.constraint = constraint
+        self.lambdas = lambdas
+        self.label = constraint.label
+
+    def export_pyqubo(self):
+        c = self.constraint
+        l1, l2 = self.lambdas
+        g = sum(v*pyqubo.Binary(x) for v, x in zip(c.values, c.vars)) - c.offset
+        return l1*g + l2*g**2
+
+
+def slack_free_penalties(constraint, unbalanced=None):
+    """
+    Returns list of penalties of constraint without slack variables, for
+    inequalities which are always satisfied, have at most two variables or
+    allow at most one variable (or none) to be 1. Other constraints are
+    returned as they are, or as UnbalancedPenalty if unbalanced = (l1, l2).
+    """
+    if not isinstance(constraint, IneqConstraint):
+        return [constraint]
+    vars, values, offset = constraint.vars, constraint.values, constraint.offset
+    if len(set(vars)) < len(vars):
+        return [constraint]
+    if sum(v for v in values if v > 0) <= offset:
+        return []
+    if len(vars) <= 2:
+        # penalty of each violating assignment
+        return [ProductPenalty(list(zip(vars, assignment)), constraint.label)
+                for assignment in product([0, 1], repeat=len(vars))
+                if sum(v*a for v, a in zip(values, assignment)) > offset]
+    if min(values) > 0 and offset >= 0:
+        if offset < min(values):
+            return [ProductPenalty([(var, 1)], constraint.label) for var in vars]
+        if all(v == values[0] for v in values) and offset < 2*values[0]:
+            return [AtMostOnePenalty(vars, constraint.label)]
+    if unbalanced is not None:
+        return [UnbalancedPenalty(constraint, unbalanced)]
+    return [constraint]
 
 
 ################################################################
@@ -124,27 +251,154 @@ def get_schedule_var(car_id, test_id, day):
     return f"p_{car_id}_{test_id}_{day}"
 
 
-def _name_update(the_str, car_id):
-    if the_str[:2] in ["t_", "b_"]:
-        name, _, rest = the_str.split("_")
-        return f"{name}_{car_id}_{rest}"
-    elif the_str[:13] == "if_constraint":
-        _, rest = the_str[14:].split("_", 1)
-        return f"if_constraint_{car_id}_{rest}"
-    elif "_" not in the_str:
-        return f"{the_str}_{car_id}"
-    else:
-        raise ValueError(f"I can't consider this type of variable {the_str}")
+class VariableNames:
+    """
+    String labels of variables: t_{car}_{type}, b_{car}_{feature},
+    p_{car}_{test} and s_{test}
+    """
 
+    def type_var(self, car_id, type_no):
+        return get_car_type_name(car_id, type_no)
 
-def _extend_bqm(bqm_orig: BinaryQuadraticModel, cars_no):
-    quadratic, offset = bqm_orig.to_qubo()
-    for i in range(1, cars_no):
-        new_quadratic = dict()
-        for (var1, var2), val in quadratic.items():
-            new_quadratic[_name_update(var1, i), _name_update(var2, i)] = val
+    def feature_var(self, car_id, feature_no):
+        return get_car_feature_name(car_id, feature_no)
+
+    def test_var(self, car_id, test_id):
+        return get_car_test_name(car_id, test_id)
+
+    def maxsat_var(self, test_id):
+        return get_maxsat_test(test_id)
+
+    def name(self, label):
+        return label
+
+    def for_car(self, label, car_id):
+        """
+        Returns label of the variable of car 0 for car car_id
+        """
+        return _name_update(label, car_id)
 
-        bqm = BinaryQuadraticModel.from_qubo(new_quadratic, offset)
-        bqm_orig += bqm
+    def names(self, labels):
+        return {label: label for label in labels}
 
-    return bqm_orig
+    def decode_sample(self, sample):
+        return dict(sample)
+
+
+class VariableRegistry(VariableNames):
+    """
+    Dense integer labels of variables. Each (kind, car, index) tuple gets
+    the next free id on first use, kind is one of "t", "b", "p", "s" (car
+    is None for "s"). String labels are produced by name only on demand.
+    """
+
+    _NAMES = {"t": get_car_type_name, "b": get_car_feature_name, "p": get_car_test_name}
+
+    def __init__(self) -> None:
+        self.ids = dict()
+        self.keys = []
+
+    @classmethod
+    def from_keys(cls, keys):
+        """
+        Returns registry where keys[k] has label k, e.g. of a stored model
+        """
+        result = cls()
+        result.keys = list(keys)
+        result.ids = {key: k for k, key in enumerate(result.keys)}
+        return result
+
+    def __len__(self):
+        return len(self.keys)
+
+    def label(self, kind, car_id, index):
+        key = (kind, car_id, index)
+        result = self.ids.get(key)
+        if result is None:
+            result = len(self.keys)
+            self.ids[key] = result
+            self.keys.append(key)
+        return result
+
+    def type_var(self, car_id, type_no):
+        return self.label("t", car_id, type_no)
+
+    def feature_var(self, car_id, feature_no):
+        return self.label("b", car_id, feature_no)
+
+    def test_var(self, car_id, test_id):
+        return self.label("p", car_id, test_id)
+
+    def maxsat_var(self, test_id):
+        return self.label("s", None, test_id)
+
+    def for_car(self, label, car_id):
+        kind, _, index = self.keys[label]
+        return self.label(kind, car_id, index)
+
+    def name(self, label):
+        kind, car_id, index = self.keys[label]
+        if kind == "s":
+            return get_maxsat_test(index)
+        return self._NAMES[kind](car_id, index)
+
+    def names(self, labels=None):
+        """
+        Returns dict integer label -> string label
+        """
+        labels = range(len(self.keys)) if labels is None else labels
+        return {label: self.name(label) for label in labels}
+
+    def decode_sample(self, sample):
+        """
+        Returns sample with string labels, other labels are kept
+        """
+        return {self.name(k) if isinstance(k, int) and 0 <= k < len(self.keys) else k: v
+                for k, v in sample.items()}
+
+
+# prefixes of labels followed by the car id
+_CAR_PREFIXES = ["t", "b", "p", "if_constraint", "feat_per_type", "group_features", "backbone",
+                 "implication", "test_constraint", "test_dominance", "test_type"]
+
+
+@lru_cache(maxsize=None)
+def _label_format(the_str):
+    """
+    Returns format string of label of variable or constraint of car 0,
+    including slack variables and products "x * y" of pyqubo. Label for car
+    car_id is format(car_id, car_id + 1).
+    """
+    if " * " in the_str:
+        return " * ".join(_label_format(part) for part in the_str.split(" * "))
+    if the_str.startswith("single_type_"):
+        # SingleType counts cars from 1
+        return "single_type_{1}"
+    the_str = the_str.replace("{", "{{").replace("}", "}}")
+    for prefix in _CAR_PREFIXES:
+        if the_str.startswith(f"{prefix}_"):
+            _, rest = the_str[len(prefix) + 1:].split("_", 1)
+            return f"{prefix}_{{0}}_{rest}"
+    if "_" not in the_str:
+        return f"{the_str}_{{0}}"
+    raise ValueError(f"I can't consider this type of variable {the_str}")
+
+
+def _name_update(the_str, car_id):
+    return _label_format(the_str).format(car_id, car_id + 1)
+
+
+def _extend_bqm(bqm_orig: BinaryQuadraticModel, cars_no):
+    """
+    Returns BQM of cars_no cars, bqm_orig is the BQM of car 0. Copies are
+    made by shifting the variable indices, labels are renamed once per car.
+    """
+    linear, (rows, cols, biases), offset, labels = bqm_orig.to_numpy_vectors(return_labels=True)
+    n = len(labels)
+    formats = [_label_format(var) for var in labels]
+    labels = list(labels) + [f.format(i, i + 1) for i in range(1, cars_no) for f in formats]
+    shift = (np.arange(cars_no, dtype=np.int64) * n)[:, None]
+    quadratic = ((rows[None, :] + shift).ravel(), (cols[None, :] + shift).ravel(),
+                 np.tile(biases, cars_no))
+    return BinaryQuadraticModel.from_numpy_vectors(np.tile(linear, cars_no), quadratic, offset*cars_no,
+                                                  bqm_orig.vartype, variable_order=labels)
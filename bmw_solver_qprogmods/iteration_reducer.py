@@ -0,0 +1,232 @@
+"""
+    Reduction of the problem to the features which still matter for the
+    remaining tests. For each type, features outside of the tests are
+    eliminated while it keeps the buildable configurations of the test
+    features unchanged:
+    - a feature whose one value satisfies all its rules is fixed to it
+      (pure literal), value 1 only if the feature is in no group,
+    - rules and groups not connected to any test feature are solved once
+      and removed, types for which they can't be satisfied are removed.
+"""
+
+from bmw_solver_qprogmods.backbone import Backbone, TypeBackbone
+from bmw_solver_qprogmods.bmw_parser import (BMWProblem, ExlucionVars,
+                                             IfConstraintBMWBunch, TVars)
+from bmw_solver_qprogmods.ip_utils import (get_car_feature_name,
+                                           get_car_type_name)
+from bmw_solver_qprogmods.presolve import _substitute_removed
+from bmw_solver_qprogmods.propagation import Propagator, rule_to_clauses
+
+
+class ReducedIteration:
+    """
+    Outcome of IterationReducer.reduce. completion maps each type to the
+    values of features eliminated for it.
+    """
+
+    def __init__(self) -> None:
+        self.problem = None
+        self.completion = dict()
+        self.removed_types = []
+        self.features = []  # features of the original problem
+
+    def expand_sample(self, sample, nv):
+        """
+        Sets the features eliminated for the type of each car and adds
+        variables removed from the reduced problem
+        """
+        sample = dict(sample)
+        types = self.problem.cartypes
+        for i in range(nv):
+            for t in self.removed_types:
+                sample[get_car_type_name(i, t)] = 0
+            car_types = [t for t in types if sample.get(get_car_type_name(i, t)) == 1]
+            completion = self.completion[car_types[0]] if len(car_types) == 1 else dict()
+            for f in self.features:
+                b = get_car_feature_name(i, f)
+                if f in completion:
+                    sample[b] = completion[f]
+                else:
+                    sample.setdefault(b, 0)
+        return sample
+
+
+class _TypeRules:
+    """
+    Clausal view of the rules of a single type, rules[k] are the clauses
+    of the k-th rule, bunches[k] the index of its IfConstraintBMWBunch
+    """
+
+    def __init__(self, problem, tvar) -> None:
+        self.t = tvar.t
+        self.allowed = list(tvar.vars)
+        allowed = set(tvar.vars)
+        self.rules = []
+        self.bunches = []
+        for r, constr in enumerate(problem.if_constraints):
+            for local in constr.constr_simplified:
+                if local.t == tvar.t:
+                    self.rules.append(rule_to_clauses(local))
+                    self.bunches.append(r)
+        self.groups = [[f for f in ev.vars if f in allowed] for ev in problem.exclusion_vars]
+        self.groups = [group for group in self.groups if len(group) >= 2]
+        self.in_group = {f for group in self.groups for f in group}
+        self.occurs = dict()
+        for k, clauses in enumerate(self.rules):
+            for f in {f for clause in clauses for f, _ in clause}:
+                self.occurs.setdefault(f, []).append(k)
+
+    def _eliminate_pure(self, protected, alive, completion):
+        changed = True
+        while changed:
+            changed = False
+            for f in self.allowed:
+                if f in protected or f in completion:
+                    continue
+                rules = [k for k in self.occurs.get(f, []) if k in alive]
+                for value in [0, 1]:
+                    if value == 1 and f in self.in_group:
+                        continue
+                    if all((f, value) in clause for k in rules for clause in self.rules[k]):
+                        completion[f] = value
+                        alive.difference_update(rules)
+                        changed = True
+                        break
+
+    def _components(self, features, alive):
+        parent = {f: f for f in features}
+
+        def find(f):
+            while parent[f] != f:
+                parent[f] = parent[parent[f]]
+                f = parent[f]
+            return f
+
+        edges = [[f for clause in self.rules[k] for f, _ in clause] for k in alive]
+        edges += self.groups
+        for edge in edges:
+            edge = [f for f in edge if f in parent]
+            for f in edge[1:]:
+                parent[find(f)] = find(edge[0])
+        return find
+
+    def reduce(self, test_features):
+        """
+        Returns (alive rules, completion), completion is None if the type
+        can't be built
+        """
+        alive = set(range(len(self.rules)))
+        completion = dict()
+        protected = test_features.intersection(self.allowed)
+        self._eliminate_pure(protected, alive, completion)
+
+        features = [f for f in self.allowed if f not in completion]
+        find = self._components(features, alive)
+        kept_roots = {find(f) for f in protected}
+        dropped = {f for f in features if find(f) not in kept_roots}
+        if len(dropped) == 0:
+            return alive, completion
+
+        dropped_rules = {k for k in alive if any(f in dropped for clause in self.rules[k]
+                                                 for f, _ in clause)}
+        clauses = [clause for k in dropped_rules for clause in self.rules[k]]
+        # groups are never split between components, eliminated features in them are 0
+        groups = [[f for f in group if f in dropped] for group in self.groups]
+        model = Propagator(clauses, groups).solve(dict())
+        if model is None:
+            return alive, None
+        completion.update({f: model.get(f, 0) for f in dropped})
+        return alive.difference(dropped_rules), completion
+
+
+def _restrict_backbone(backbone, kept, all_features):
+    result = Backbone()
+    for t, features in kept.items():
+        bb = backbone.types[t]
+        new_bb = TypeBackbone(t)
+        new_bb.forced_on = [f for f in bb.forced_on if f in features]
+        new_bb.forced_off = [f for f in bb.forced_off if f in features]
+        new_bb.off_features = set(all_features).difference(features)
+        new_bb.implied = {f: {g: v for g, v in implied.items() if g in features}
+                          for f, implied in bb.implied.items() if f in features}
+        result.types[t] = new_bb
+    return result
+
+
+class IterationReducer:
+    """
+    Builds reduced problems for the tests remaining in a MAXSAT iteration,
+    the rules of each type are preprocessed once
+    """
+
+    def __init__(self, problem: BMWProblem) -> None:
+        self.problem = problem
+        self.types = [_TypeRules(problem, tvar) for tvar in problem.tvars]
+
+    def reduce(self, tests):
+        """
+        Returns ReducedIteration whose problem has tests and only the
+        features and rules needed for them
+        """
+        problem = self.problem
+        test_features = set()
+        for test in tests:
+            for mode, var in test.test:
+                test_features.update(var if mode == 2 else [var])
+
+        result = ReducedIteration()
+        result.features = list(problem.features)
+        kept = dict()
+        alive = dict()
+        for type_rules in self.types:
+            type_alive, completion = type_rules.reduce(test_features)
+            if completion is None:
+                result.removed_types.append(type_rules.t)
+                continue
+            result.completion[type_rules.t] = completion
+            kept[type_rules.t] = frozenset(type_rules.allowed).difference(completion)
+            alive[type_rules.t] = {type_rules.bunches[k] for k in type_alive}
+
+        all_kept = set().union(*kept.values()).union(test_features)
+        reduced = BMWProblem()
+        reduced.cartypes = list(kept)
+        reduced.cartypes_no = len(reduced.cartypes)
+        reduced.features = [f for f in problem.features if f in all_kept]
+        reduced.features_no = len(reduced.features)
+        # features eliminated for a type stay allowed for it if other type
+        # keeps them, their value doesn't matter and is set by expand_sample
+        allowed = dict()
+        for type_rules in self.types:
+            if type_rules.t in kept:
+                allowed[type_rules.t] = frozenset(all_kept.intersection(type_rules.allowed))
+                tvar = TVars()
+                tvar.t = type_rules.t
+                tvar.vars = [f for f in problem.features if f in allowed[type_rules.t]]
+                reduced.tvars.append(tvar)
+
+        removed = {f for f in problem.features if f not in all_kept}
+        for r, constr in enumerate(problem.if_constraints):
+            cartypes = {t for t in constr.orig_types if t in alive and r in alive[t]}
+            if len(cartypes) == 0:
+                continue
+            new_constr = IfConstraintBMWBunch(constr._str_constraint(), cartypes, allowed)
+            # removed features are forbidden for all types of the rule
+            if new_constr.loaded and _substitute_removed(new_constr, removed):
+                reduced.if_constraints.append(new_constr)
+
+        for ev in problem.exclusion_vars:
+            vars = [f for f in ev.vars if f in all_kept]
+            if len(vars) >= 2:
+                new_ev = ExlucionVars()
+                new_ev.vars = vars
+                reduced.exclusion_vars.append(new_ev)
+
+        reduced.tests = list(tests)
+        # eliminated features don't change which tests types can satisfy
+        compatibility = problem.test_compatibility(tests)
+        reduced._compatibility = {test.id: compatibility[test.id].intersection(kept)
+                                  for test in tests}
+        if problem._backbone is not None:
+            reduced._backbone = _restrict_backbone(problem._backbone, kept, problem.features)
+        result.problem = reduced
+        return result
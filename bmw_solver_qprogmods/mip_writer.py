@@ -0,0 +1,316 @@
+"""
+    Writing of binary linear programs (constraints of ip_utils and a linear
+    objective to minimize) to LP and free MPS files, without building pulp
+    models. Constraints are streamed: LP rows and MPS ROWS are written to a
+    temporary file as the constraints come, MPS COLUMNS are collected in
+    integer arrays and sorted by column at the end. Variables are written
+    as names.name(label), which are the names of pulp variables of
+    export_pulp, so read_solution gives the values of the pulp variables.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+from array import array
+from time import perf_counter
+
+import numpy as np
+
+from bmw_solver_qprogmods.ip_utils import EqConstraint
+
+# longest time in seconds between checks of the solver process and the
+# cancel event of solve_mip, the checks start at 0.5 ms as in Popen.wait
+CANCEL_POLL = 0.05
+
+
+def _merged(constraint):
+    coefficients = dict()
+    for var, val in zip(constraint.vars, constraint.values):
+        coefficients[var] = coefficients.get(var, 0) + val
+    return coefficients
+
+
+def _num(value):
+    return f"{value:.12g}"
+
+
+def _check_empty(constraint):
+    satisfied = 0 == constraint.offset if isinstance(constraint, EqConstraint) else 0 <= constraint.offset
+    if not satisfied:
+        raise ValueError(f"Constraint {constraint.label} has no variables and it is violated")
+
+
+class _Columns:
+    """
+    Dense indices and names of variables in order of appearance
+    """
+
+    def __init__(self, names) -> None:
+        self.names = names
+        self.index = dict()
+        self.column_names = []
+
+    def __call__(self, label):
+        result = self.index.get(label)
+        if result is None:
+            result = len(self.column_names)
+            self.index[label] = result
+            self.column_names.append(self.names.name(label))
+        return result
+
+
+def _lp_terms(coefficients, columns):
+    terms = []
+    for k, (var, val) in enumerate(coefficients):
+        sign = "-" if val < 0 else "+"
+        # at most 8 terms in a line
+        sep = "\n " if k > 0 and k % 8 == 0 else " "
+        terms.append(f"{sep}{sign} {_num(abs(val))} {columns.column_names[columns(var)]}")
+    return "".join(terms)
+
+
+def write_lp(filename, constraints, objective, names):
+    """
+    Writes LP file, objective is a list of (label, bias). Returns names of
+    the variables.
+    """
+    columns = _Columns(names)
+    with tempfile.TemporaryFile("w+") as rows:
+        for c in constraints:
+            coefficients = _merged(c)
+            if len(coefficients) == 0:
+                _check_empty(c)
+                continue
+            sense = "=" if isinstance(c, EqConstraint) else "<="
+            rows.write(f" {c.label}:{_lp_terms(coefficients.items(), columns)} {sense} {_num(c.offset)}\n")
+        objective = [(var, bias) for var, bias in objective if bias != 0]
+        if len(objective) == 0 and len(columns.column_names) > 0:
+            # LP objective can't be empty
+            objective = [(next(iter(columns.index)), 0)]
+        obj_terms = _lp_terms(objective, columns) if objective else ""
+
+        with open(filename, "w") as file:
+            file.write("\\* bmw_solver_qprogmods *\\\nMinimize\n")
+            file.write(f" obj:{obj_terms}\nSubject To\n")
+            rows.seek(0)
+            shutil.copyfileobj(rows, file)
+            file.write("Binaries\n")
+            for k in range(0, len(columns.column_names), 10):
+                file.write(" " + " ".join(columns.column_names[k:k+10]) + "\n")
+            file.write("End\n")
+    return columns.column_names
+
+
+def write_mps(filename, constraints, objective, names):
+    """
+    Writes free MPS file, objective is a list of (label, bias). Returns
+    names of the variables.
+    """
+    columns = _Columns(names)
+    entry_rows, entry_cols, entry_vals = array("q"), array("q"), array("d")
+    rhs_rows, rhs_vals = array("q"), array("d")
+    labels = []
+    with tempfile.TemporaryFile("w+") as rows:
+        for c in constraints:
+            coefficients = _merged(c)
+            if len(coefficients) == 0:
+                _check_empty(c)
+                continue
+            row = len(labels)
+            labels.append(c.label)
+            rows.write(f" {'E' if isinstance(c, EqConstraint) else 'L'}  {c.label}\n")
+            for var, val in coefficients.items():
+                entry_rows.append(row)
+                entry_cols.append(columns(var))
+                entry_vals.append(val)
+            if c.offset != 0:
+                rhs_rows.append(row)
+                rhs_vals.append(c.offset)
+        for var, bias in objective:
+            if bias != 0:
+                # row -1 is the objective
+                entry_rows.append(-1)
+                entry_cols.append(columns(var))
+                entry_vals.append(bias)
+
+        entry_rows = np.frombuffer(entry_rows, dtype=np.int64)
+        entry_cols = np.frombuffer(entry_cols, dtype=np.int64)
+        entry_vals = np.frombuffer(entry_vals, dtype=np.float64)
+        order = np.lexsort((entry_rows, entry_cols))
+
+        with open(filename, "w") as file:
+            file.write("NAME bmw_solver_qprogmods\nROWS\n N  OBJ\n")
+            rows.seek(0)
+            shutil.copyfileobj(rows, file)
+            file.write("COLUMNS\n")
+            file.write("    MARKER  'MARKER'  'INTORG'\n")
+            for k in order.tolist():
+                row = entry_rows[k]
+                row_name = "OBJ" if row < 0 else labels[row]
+                file.write(f"    {columns.column_names[entry_cols[k]]}  {row_name}  {_num(entry_vals[k])}\n")
+            file.write("    MARKER  'MARKER'  'INTEND'\n")
+            file.write("RHS\n")
+            for row, val in zip(rhs_rows, rhs_vals):
+                file.write(f"    RHS  {labels[row]}  {_num(val)}\n")
+            file.write("BOUNDS\n")
+            for name in columns.column_names:
+                file.write(f" BV BND  {name}\n")
+            file.write("ENDATA\n")
+    return columns.column_names
+
+
+def write_mip(filename, constraints, objective, names):
+    """
+    Writes MPS or LP file, depending on the extension of filename
+    """
+    if filename.endswith(".lp"):
+        return write_lp(filename, constraints, objective, names)
+    if filename.endswith(".mps"):
+        return write_mps(filename, constraints, objective, names)
+    raise ValueError(f"Unknown format of {filename}, has to be .lp or .mps")
+
+
+def read_solution(filename, variables=None):
+    """
+    Returns ({name: value}, objective) from solution file of CBC (solu) or
+    Gurobi (ResultFile). Variables missing in the file, e.g. zeros omitted by
+    CBC, are 0. Returns None if the solver found no integer solution, i.e.
+    CBC status is not optimal or stopped with an integer solution, or
+    Gurobi wrote no file.
+    """
+    sample = {name: 0. for name in variables} if variables is not None else dict()
+    objective = 0.
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as file:
+        lines = file.read().splitlines()
+    if len(lines) == 0:
+        return None
+    if lines[0].startswith("#"):
+        # Gurobi, "# Objective value = ..." and lines "name value"
+        for line in lines:
+            if line.startswith("# Objective value"):
+                objective = float(line.split("=")[1])
+            elif line and not line.startswith("#"):
+                name, value = line.split()[:2]
+                sample[name] = float(value)
+        return sample, objective
+    # CBC, "<status> - objective value ..." and lines "index name value reduced_cost"
+    status = lines[0].split(" - objective value")[0]
+    if status.split()[0] not in ["Optimal", "Stopped"] or "no integer solution" in status:
+        return None
+    objective = float(lines[0].split("objective value")[1].split()[0])
+    for line in lines[1:]:
+        tokens = line.split()
+        if tokens and tokens[0] == "**":
+            tokens = tokens[1:]
+        if len(tokens) >= 3:
+            sample[tokens[1]] = float(tokens[2])
+    return sample, objective
+
+
+def write_mip_start(filename, start, variables, solver="cbc"):
+    """
+    Writes values of start, dict name -> value, as MIP start of CBC (in the
+    format of its solution file) or Gurobi (MST). Only variables are
+    written, other names of start are skipped, missing variables are 0.
+    """
+    with open(filename, "w") as file:
+        if solver == "cbc":
+            file.write("Stopped on iterations - objective value 0\n")
+            for k, name in enumerate(variables):
+                file.write(f"{k} {name} {_num(start.get(name, 0))} 0\n")
+        else:
+            file.write("# MIP start\n")
+            for name in variables:
+                file.write(f"{name} {_num(start.get(name, 0))}\n")
+
+
+def _wait(process, options=0):
+    """
+    Reaps process with os.wait4, returns its rusage, or None if it is still
+    running (options os.WNOHANG)
+    """
+    pid, status, rusage = os.wait4(process.pid, options)
+    if pid == 0:
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
+
+
+def _run_solver(command, msg, cancel):
+    """
+    Runs the solver, kills it once cancel (threading.Event) is set. Returns
+    the rusage of the solver process, or None if killed. The process is
+    reaped here, RUSAGE_CHILDREN would include the solvers of concurrent
+    trials.
+    """
+    process = subprocess.Popen(command, stdout=None if msg else subprocess.DEVNULL)
+    if cancel is None:
+        rusage = _wait(process)
+    else:
+        delay = 0.0005
+        while True:
+            rusage = _wait(process, os.WNOHANG)
+            if rusage is not None:
+                break
+            if cancel.wait(delay):
+                # kill polls the process, it may be reaped already
+                process.kill()
+                if process.returncode is None:
+                    _wait(process)
+                return None
+            delay = min(2*delay, CANCEL_POLL)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return rusage
+
+
+def solve_mip(filename, variables, solver="cbc", time_limit=None, msg=False, start=None, seed=None,
+              cancel=None):
+    """
+    Solves MPS or LP file with CBC of pulp or Gurobi (gurobi_cl), returns
+    (sample, objective, wall time, cpu time) as pulp_experiment stores them.
+    start is a MIP start, dict name -> value, see write_mip_start, seed the
+    random seed of the solver. The solver is killed when cancel, a
+    threading.Event, is set, None is returned then, as when no integer
+    solution was found, see read_solution.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        solution = os.path.join(tmp, "solution.sol")
+        start_file = os.path.join(tmp, "start.mst")
+        if solver not in ["cbc", "gurobi"]:
+            raise ValueError(f"Unknown solver {solver}, has to be 'cbc' or 'gurobi'")
+        if start is not None:
+            write_mip_start(start_file, start, variables, solver)
+        if solver == "cbc":
+            from pulp import PULP_CBC_CMD
+            command = [PULP_CBC_CMD().path, filename]
+            if time_limit is not None:
+                command += ["sec", str(time_limit)]
+            if start is not None:
+                command += ["mips", start_file]
+            if seed is not None:
+                command += ["randomCbcSeed", str(seed)]
+            command += ["solve", "solu", solution]
+        else:
+            command = ["gurobi_cl", f"ResultFile={solution}"]
+            if time_limit is not None:
+                command += [f"TimeLimit={time_limit}"]
+            if start is not None:
+                command += [f"InputFile={start_file}"]
+            if seed is not None:
+                command += [f"Seed={seed}"]
+            command += [filename]
+        wall_start = perf_counter()
+        rusage = _run_solver(command, msg, cancel)
+        if rusage is None:
+            return None
+        wall_time = perf_counter() - wall_start
+        cpu_time = rusage.ru_utime + rusage.ru_stime
+        result = read_solution(solution, variables)
+    if result is None:
+        return None
+    sample, objective = result
+    return sample, objective, wall_time, cpu_time
@@ -0,0 +1,317 @@
+"""
+    Content-addressed cache of exported models. The key is a hash of the
+    compiled problem (buildability arrays and the remaining tests), the
+    options of the integer program and the export parameters, so a model is
+    built once for each distinct problem state. MIP models are stored in MPS
+    files. CQM and BQM models are stored as numpy vectors of dimod
+    (to_numpy_vectors, and CSR arrays of the linear constraints of a CQM),
+    dimod's own file format loads slower than the models are built. A .meta
+    file next to each entry keeps the variable registry and the MPS variable
+    names. Entries are evicted least recently used first once the folder
+    exceeds max_bytes.
+"""
+
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+from glob import glob
+
+import dimod
+import numpy as np
+import scipy.sparse
+
+from bmw_solver_qprogmods.ip_utils import (BQMWithoutPenalty, VariableRegistry,
+                                           add_cqm_variables, linear_bqm)
+
+# bump whenever exports change their output
+MODEL_CACHE_VERSION = 1
+MODEL_CACHE_FOLDER = os.path.join(".bmw_cache", "models")
+MODEL_CACHE_BYTES = 1 << 30
+
+_EXTENSIONS = {"cqm": "cqm.pkl", "bqm": "bqm.pkl", "mip": "mps"}
+
+
+def _update_array(digest, name, value):
+    digest.update(name.encode())
+    if scipy.sparse.issparse(value):
+        value = value.tocsr()
+        digest.update(repr(value.shape).encode())
+        for array in (value.data, value.indices, value.indptr):
+            _update_array(digest, "", np.ascontiguousarray(array))
+    elif value.dtype == object:
+        digest.update(repr(value.tolist()).encode())
+    else:
+        digest.update(f"{value.dtype.str}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+
+
+def cqm_to_vectors(cqm):
+    """
+    Returns dict of numpy vectors of CQM with binary variables, linear
+    objective and linear constraints, as exported by BMWIntegerProgram
+    """
+    variables = list(cqm.variables)
+    if any(cqm.vartype(v) is not dimod.BINARY for v in variables):
+        raise ValueError("Only binary variables are supported")
+    # dimod 0.10 has no iter_linear, the views of linear and quadratic work everywhere
+    if len(cqm.objective.quadratic) > 0:
+        raise ValueError("Only linear objective is supported")
+    index = {v: k for k, v in enumerate(variables)}
+    indptr, columns, biases = [0], [], []
+    labels, senses, rhs, offsets = [], [], [], []
+    for label, c in cqm.constraints.items():
+        if len(c.lhs.quadratic) > 0:
+            raise ValueError(f"Constraint {label} is not linear")
+        for v, bias in c.lhs.linear.items():
+            columns.append(index[v])
+            biases.append(bias)
+        indptr.append(len(columns))
+        labels.append(label)
+        senses.append(c.sense.value)
+        rhs.append(c.rhs)
+        offsets.append(c.lhs.offset)
+    objective = list(cqm.objective.linear.items())
+    return {"variables": variables,
+            "objective": (np.array([index[v] for v, _ in objective], dtype=np.int64),
+                          np.array([bias for _, bias in objective], dtype=float),
+                          cqm.objective.offset),
+            "indptr": np.array(indptr, dtype=np.int64), "columns": np.array(columns, dtype=np.int64),
+            "biases": np.array(biases, dtype=float), "labels": labels, "senses": senses,
+            "rhs": np.array(rhs, dtype=float),
+            "offsets": np.array(offsets, dtype=float)}
+
+
+def cqm_from_vectors(data):
+    """
+    Returns CQM of cqm_to_vectors
+    """
+    result = dimod.ConstrainedQuadraticModel()
+    variables = data["variables"]
+    add_cqm_variables(result, variables)
+    columns = np.empty(len(variables), dtype=object)
+    columns[:] = variables
+    columns = columns[data["columns"]].tolist()
+    biases = data["biases"].tolist()
+    indptr = data["indptr"].tolist()
+    rows = zip(data["labels"], data["senses"], data["rhs"].tolist(), data["offsets"].tolist())
+    for k, (label, sense, rhs, offset) in enumerate(rows):
+        terms = zip(columns[indptr[k]:indptr[k+1]], biases[indptr[k]:indptr[k+1]])
+        result.add_constraint_from_iterable(terms, sense, rhs, label=label)
+        if offset != 0:
+            result.constraints[label].lhs.offset = offset
+    obj_columns, obj_biases, offset = data["objective"]
+    objective = [(variables[k], bias) for k, bias in zip(obj_columns.tolist(), obj_biases.tolist())]
+    result.set_objective(linear_bqm(objective))
+    result.objective.offset = offset
+    return result
+
+
+def problem_state_hash(compiled, digest=None):
+    """
+    Hash of arrays of CompiledBMWProblem, dicts derived from them are skipped
+    """
+    digest = hashlib.sha256() if digest is None else digest
+    for name, value in sorted(vars(compiled).items()):
+        if isinstance(value, np.ndarray) or scipy.sparse.issparse(value):
+            _update_array(digest, name, value)
+    return digest
+
+
+def model_key(bmw_ip, kind, **params):
+    """
+    Key of the model of kind "cqm", "bqm" or "mip" exported from bmw_ip
+    with params
+    """
+    digest = hashlib.sha256(f"v{MODEL_CACHE_VERSION} {kind}".encode())
+    tests = bmw_ip._tests() if hasattr(bmw_ip, "_tests") else bmw_ip.problem.tests
+    problem_state_hash(bmw_ip.problem.compile(tests), digest)
+    # options of the program, e.g. car_no, consider_count, feat_per_type
+    options = {k: v for k, v in vars(bmw_ip).items()
+               if isinstance(v, (bool, int, float, str, tuple, type(None)))
+               and k not in ("collect_stats", "trace_memory", "stats")}
+    options["class"] = type(bmw_ip).__name__
+    options["names"] = type(bmw_ip.names).__name__
+    digest.update(repr(sorted(options.items())).encode())
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()
+
+
+class ModelCache:
+    """
+    Cache of exported models in folder, at most max_bytes on disk
+    """
+
+    def __init__(self, folder=MODEL_CACHE_FOLDER, max_bytes=MODEL_CACHE_BYTES) -> None:
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def _filename(self, kind, key):
+        return os.path.join(self.folder, f"{kind}_{key}.{_EXTENSIONS[kind]}")
+
+    def _load_meta(self, kind, key):
+        filename = self._filename(kind, key)
+        if not os.path.exists(filename) or not os.path.exists(f"{filename}.meta"):
+            return None
+        try:
+            with open(f"{filename}.meta", "rb") as file:
+                meta = pickle.load(file)
+            if meta.get("key") != key:
+                return None
+            # hit is the most recent use for eviction
+            os.utime(filename)
+        except (pickle.UnpicklingError, EOFError, FileNotFoundError):
+            # FileNotFoundError if evicted by a concurrent run
+            return None
+        return meta
+
+    def _store(self, kind, key, write):
+        """
+        write(filename) writes the model and returns its meta data
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        filename = self._filename(kind, key)
+        # unique for concurrent trials as well
+        tmp_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        meta = write(tmp_filename)
+        with open(f"{tmp_filename}.meta", "wb") as file:
+            pickle.dump(dict(meta, key=key), file)
+        # atomic, data file last so that a visible entry is complete
+        os.replace(f"{tmp_filename}.meta", f"{filename}.meta")
+        os.replace(tmp_filename, filename)
+        self.evict(keep=filename)
+
+    def _restore_names(self, bmw_ip, meta):
+        if meta["registry"] is not None:
+            bmw_ip.names = VariableRegistry.from_keys(meta["registry"])
+
+    @staticmethod
+    def _registry(bmw_ip):
+        return bmw_ip.names.keys if isinstance(bmw_ip.names, VariableRegistry) else None
+
+    def _load(self, kind, key):
+        """
+        Returns (meta, data) of the entry, None on miss. Entries evicted by a
+        concurrent run in the meantime are misses.
+        """
+        meta = self._load_meta(kind, key)
+        if meta is None:
+            return None
+        try:
+            with open(self._filename(kind, key), "rb") as file:
+                return meta, pickle.load(file)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            return None
+
+    @staticmethod
+    def _pickle_writer(data, meta):
+        def write(filename):
+            with open(filename, "wb") as file:
+                pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+            return meta
+        return write
+
+    def export_dimod(self, bmw_ip, bulk=True):
+        """
+        Returns bmw_ip.export_dimod(bulk), bmw_ip.names is restored on hit
+        """
+        key = model_key(bmw_ip, "cqm")
+        entry = self._load("cqm", key)
+        if entry is not None:
+            meta, data = entry
+            self._restore_names(bmw_ip, meta)
+            return cqm_from_vectors(data)
+
+        cqm = bmw_ip.export_dimod(bulk)
+        self._store("cqm", key, self._pickle_writer(cqm_to_vectors(cqm), {"registry": self._registry(bmw_ip)}))
+        return cqm
+
+    def export_pyqubo(self, bmw_ip, strength, **options):
+        """
+        Returns BQMWithoutPenalty of bmw_ip.export_pyqubo(strength, **options),
+        the penalties are applied by its to_bqm
+        """
+        key = model_key(bmw_ip, "bqm", strength=strength, **options)
+        entry = self._load("bqm", key)
+        if entry is not None:
+            result = BQMWithoutPenalty()
+            for part, vectors in entry[1].items():
+                linear, quadratic, offset, labels = vectors
+                result[part] = dimod.BinaryQuadraticModel.from_numpy_vectors(
+                    linear, quadratic, offset, dimod.BINARY, variable_order=labels)
+            return result
+
+        result = bmw_ip.export_pyqubo(strength, **options)
+        data = {part: bqm.to_numpy_vectors(return_labels=True) for part, bqm in result.dicts.items()}
+        self._store("bqm", key, self._pickle_writer(data, dict()))
+        return result
+
+    def export_mip(self, bmw_ip, filename):
+        """
+        Writes the MPS file of bmw_ip.export_mip(filename), returns names of
+        the variables. The file is a copy, concurrent runs may evict the
+        cache entry while it is solved.
+        """
+        if not filename.endswith(".mps"):
+            raise ValueError("Only MPS files are cached")
+        key = model_key(bmw_ip, "mip")
+        meta = self._load_meta("mip", key)
+        if meta is not None:
+            try:
+                shutil.copyfile(self._filename("mip", key), filename)
+                return meta["variables"]
+            except FileNotFoundError:
+                # evicted by a concurrent run
+                pass
+
+        variables = bmw_ip.export_mip(filename)
+
+        def write(tmp_filename):
+            shutil.copyfile(filename, tmp_filename)
+            return {"variables": variables}
+        self._store("mip", key, write)
+        return variables
+
+    def _entries(self):
+        return [filename for filename in glob(os.path.join(self.folder, "*"))
+                if not filename.endswith((".meta", ".tmp"))]
+
+    def size(self):
+        """
+        Bytes of all entries, with meta files
+        """
+        return sum(os.path.getsize(f) for f in glob(os.path.join(self.folder, "*")))
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used entries until the cache fits in max_bytes,
+        except the entry of file keep, which counts in the size
+        """
+        entries = []
+        total = 0
+        for filename in self._entries():
+            try:
+                mtime = os.path.getmtime(filename)
+                size = os.path.getsize(filename)
+                if os.path.exists(f"{filename}.meta"):
+                    size += os.path.getsize(f"{filename}.meta")
+            except FileNotFoundError:
+                # removed by a concurrent run
+                continue
+            total += size
+            if filename != keep:
+                entries.append((mtime, size, filename))
+        for _, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for name in (filename, f"{filename}.meta"):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    def clear(self):
+        for filename in glob(os.path.join(self.folder, "*")):
+            os.remove(filename)
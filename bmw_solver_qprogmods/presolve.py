@@ -0,0 +1,192 @@
+from copy import deepcopy
+
+from bmw_solver_qprogmods.bmw_parser import (BMWProblem, ExlucionVars,
+                                             IfConstraintBMW,
+                                             IfConstraintBMWBunch, TVars)
+from bmw_solver_qprogmods.ip_utils import (get_car_feature_name,
+                                           get_car_type_name)
+from bmw_solver_qprogmods.propagation import Propagator, type_clauses
+
+
+class PresolveResult:
+    """
+    Outcome of presolve. Feature, type and test ids of problem are the
+    original ones, test_ids maps ids of the reduced tests to the original ones.
+    """
+
+    def __init__(self) -> None:
+        self.problem = None
+        self.original = None  # problem before presolve, for checking expanded samples
+        self.fixed_features = dict()  # feature -> value for every car
+        self.forced_off = dict()  # type -> features forced to 0 for this type
+        self.removed_types = []
+        self.removed_tests = []
+        self.test_ids = dict()
+        self.features = []  # features of the original problem
+
+    def expand_sample(self, sample, nv):
+        """
+        Adds variables removed by presolve to a sample of the reduced problem.
+        Features not occurring in any constraint of the reduced problem are set to 0.
+        """
+        sample = dict(sample)
+        for i in range(nv):
+            for f in self.features:
+                sample.setdefault(get_car_feature_name(i, f), self.fixed_features.get(f, 0))
+            for t in self.removed_types:
+                sample.setdefault(get_car_type_name(i, t), 0)
+        return sample
+
+
+def _propagate_types(problem):
+    """
+    Returns dict type -> assignment implied by unit propagation,
+    None for types without feasible configuration
+    """
+    result = dict()
+    for tvar in problem.tvars:
+        clauses, groups, assignment = type_clauses(problem, tvar.t)
+        result[tvar.t] = Propagator(clauses, groups).propagate(assignment)
+    return result
+
+
+def _simplifiable(problem, t, allowed):
+    """
+    Checks if the parser can simplify all rules of type t with allowed features
+    """
+    try:
+        for constr in problem.if_constraints:
+            if t in constr.orig_types:
+                IfConstraintBMW.from_split(constr, t, allowed)
+    except ValueError:  # parser can't express the simplified rule
+        return False
+    return True
+
+
+def _substitute_removed(constr, removed):
+    """
+    Substitutes 0 for removed features in the raw rule of IfConstraintBMWBunch,
+    returns False if the rule is always satisfied
+    """
+    def substitute(vars, op, is_left):
+        conjunction = op in ["&", "1"]
+        new_vars = []
+        for neg, var in vars:
+            if var not in removed:
+                new_vars.append((neg, var))
+            elif (neg == 1) != conjunction:
+                # the literal decides the side: false premise or true conclusion
+                return None if is_left == conjunction else "decided"
+        if len(new_vars) == 0 and not (is_left == conjunction):
+            return None  # empty premise disjunction or conclusion conjunction
+        return new_vars
+
+    left = substitute(constr.left_vars, constr.left_op, True)
+    right = substitute(constr.right_vars, constr.right_op, False)
+    if left is None or right is None:
+        return False
+    constr.left_vars = [] if left == "decided" else left
+    constr.right_vars = [] if right == "decided" else right
+    for side in ["left", "right"]:
+        vars = getattr(constr, f"{side}_vars")
+        if len(vars) <= 1:
+            setattr(constr, f"{side}_op", str(len(vars)))
+    if len(constr.left_vars) == 0 or len(constr.right_vars) == 0:
+        constr.max_types = []  # force the simplified rules in RulesPerType
+    return True
+
+
+def _reduce_test(test, fixed):
+    """
+    Returns test with fixed features substituted, None if it can't be satisfied
+    """
+    new_test = []
+    for mode, var in test.test:
+        if mode in [0, 1]:
+            if var not in fixed:
+                new_test.append((mode, var))
+            elif fixed[var] != 1 - mode:
+                return None
+        else:
+            if any(fixed.get(f) == 1 for f in var):
+                continue
+            or_vars = [f for f in var if f not in fixed]
+            if len(or_vars) == 0:
+                return None
+            elif len(or_vars) == 1:
+                new_test.append((0, or_vars[0]))
+            else:
+                new_test.append((2, or_vars))
+    result = deepcopy(test)
+    result.test = new_test
+    return result
+
+
+def presolve(problem: BMWProblem):
+    """
+    Propagates facts implied by the buildability rules of each car type:
+    types without feasible configuration are removed, features forced to 0
+    for a type are forbidden for it, features not allowed by any type are
+    removed and tests are simplified accordingly.
+    """
+    result = PresolveResult()
+    result.original = problem
+    result.features = list(problem.features)
+    implied = _propagate_types(problem)
+    result.removed_types = [t for t, assignment in implied.items() if assignment is None]
+    types = [tvar for tvar in problem.tvars if implied[tvar.t] is not None]
+
+    allowed = dict()
+    for tvar in types:
+        forced_off = {f for f in tvar.vars if implied[tvar.t].get(f) == 0}
+        reduced = frozenset(tvar.vars).difference(forced_off)
+        if not _simplifiable(problem, tvar.t, reduced):
+            forced_off, reduced = set(), frozenset(tvar.vars)
+        allowed[tvar.t] = reduced
+        if len(forced_off) > 0:
+            result.forced_off[tvar.t] = sorted(forced_off)
+
+    all_allowed = set().union(*allowed.values())
+    fixed = {f: 0 for f in problem.features if f not in all_allowed}
+    for f in all_allowed:
+        values = {implied[tvar.t].get(f) for tvar in types}
+        if values == {1}:
+            fixed[f] = 1  # kept in the model, but known for tests
+    result.fixed_features = {f: v for f, v in fixed.items() if v == 0}
+
+    reduced = BMWProblem()
+    reduced.cartypes = [tvar.t for tvar in types]
+    reduced.cartypes_no = len(reduced.cartypes)
+    reduced.features = [f for f in problem.features if f in all_allowed]
+    reduced.features_no = len(reduced.features)
+    for tvar in types:
+        new_tvar = TVars()
+        new_tvar.t = tvar.t
+        new_tvar.vars = [f for f in tvar.vars if f in allowed[tvar.t]]
+        reduced.tvars.append(new_tvar)
+
+    for constr in problem.if_constraints:
+        cartypes = {t for t in constr.orig_types if t in allowed}
+        if len(cartypes) == 0:
+            continue
+        new_constr = IfConstraintBMWBunch(constr._str_constraint(), cartypes, allowed)
+        if new_constr.loaded and _substitute_removed(new_constr, result.fixed_features):
+            reduced.if_constraints.append(new_constr)
+
+    for ev in problem.exclusion_vars:
+        vars = [f for f in ev.vars if f in all_allowed]
+        if len(vars) >= 2:
+            new_ev = ExlucionVars()
+            new_ev.vars = vars
+            reduced.exclusion_vars.append(new_ev)
+
+    for test in problem.tests:
+        new_test = _reduce_test(test, fixed)
+        if new_test is None:
+            result.removed_tests.append(test.id)
+        else:
+            reduced.tests.append(new_test)
+            result.test_ids[new_test.id] = test.id
+
+    result.problem = reduced
+    return result
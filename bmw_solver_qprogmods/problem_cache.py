@@ -0,0 +1,66 @@
+import hashlib
+import os
+import pickle
+from glob import glob
+
+# bump whenever parsed objects change their attributes
+CACHE_VERSION = 3
+CACHE_FOLDER = ".bmw_cache"
+
+
+def _file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def problem_hash(build_filename, test_filename, options=""):
+    """
+    Content hash of both input files, parsing options and the cache version
+    """
+    digest = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+    digest.update(_file_digest(build_filename).encode())
+    digest.update(_file_digest(test_filename).encode())
+    digest.update(options.encode())
+    return digest.hexdigest()
+
+
+def cache_filename(build_filename, key):
+    folder = os.path.join(os.path.dirname(os.path.abspath(build_filename)), CACHE_FOLDER)
+    return os.path.join(folder, f"bmw_problem_{key}.pkl")
+
+
+def load_cached_problem(filename, key):
+    """
+    Returns dict of attributes of cached BMWProblem, None if missing or stale
+    """
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, "rb") as file:
+            header = pickle.load(file)
+            if header != {"version": CACHE_VERSION, "key": key}:
+                return None
+            return pickle.load(file)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+
+def store_cached_problem(filename, key, attributes):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "wb") as file:
+        pickle.dump({"version": CACHE_VERSION, "key": key}, file)
+        pickle.dump(attributes, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_filename, filename)  # atomic, safe for concurrent runs
+
+
+def invalidate_cache(build_filename):
+    """
+    Removes all cached problems stored next to build_filename
+    """
+    folder = os.path.dirname(cache_filename(build_filename, ""))
+    for filename in glob(os.path.join(folder, "bmw_problem_*.pkl")):
+        os.remove(filename)
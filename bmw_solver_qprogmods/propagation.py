@@ -0,0 +1,160 @@
+"""
+    Clausal view of the buildability rules of a single car type.
+    A literal is a pair (feature, value) which holds if b_feature == value,
+    a clause is a tuple of literals of which at least one holds.
+    Exclusion groups are kept as at-most-one constraints.
+"""
+
+from collections import defaultdict
+
+
+def _literal(var):
+    neg, feature = var
+    return (feature, 1 - neg)
+
+
+def _negation(literal):
+    feature, value = literal
+    return (feature, 1 - value)
+
+
+def rule_to_clauses(constr):
+    """
+    Clauses equivalent to IfConstraintBMW (or the raw rule of IfConstraintBMWBunch)
+    """
+    left = [_literal(var) for var in constr.left_vars]
+    right = [_literal(var) for var in constr.right_vars]
+
+    if len(left) == 0:  # True => right
+        premises = [[]]
+    elif constr.left_op == "|":
+        premises = [[_negation(lit)] for lit in left]
+    else:
+        premises = [[_negation(lit) for lit in left]]
+
+    if len(right) == 0:  # left => False
+        conclusions = [[]]
+    elif constr.right_op == "|":
+        conclusions = [right]
+    else:
+        conclusions = [[lit] for lit in right]
+
+    return [tuple(premise + conclusion) for premise in premises for conclusion in conclusions]
+
+
+def type_clauses(problem, t):
+    """
+    Returns (clauses, groups, assignment) describing cars of type t,
+    assignment fixes the features not allowed for t to 0
+    """
+    tvars = next(tvar for tvar in problem.tvars if tvar.t == t)
+    allowed = set(tvars.vars)
+    clauses = []
+    for constr in problem.if_constraints:
+        for local in constr.constr_simplified:
+            if local.t == t:
+                clauses += rule_to_clauses(local)
+    groups = [[f for f in ev.vars if f in allowed] for ev in problem.exclusion_vars]
+    groups = [group for group in groups if len(group) >= 2]
+    assignment = {f: 0 for f in problem.features if f not in allowed}
+    return clauses, groups, assignment
+
+
+class Propagator:
+    """
+    Unit propagation over clauses and at-most-one groups
+    """
+
+    def __init__(self, clauses, groups) -> None:
+        self.clauses = [tuple(clause) for clause in clauses]
+        self.groups = [list(group) for group in groups]
+        self.clause_occurs = defaultdict(list)
+        for k, clause in enumerate(self.clauses):
+            for feature, _ in clause:
+                self.clause_occurs[feature].append(k)
+        self.group_occurs = defaultdict(list)
+        for k, group in enumerate(self.groups):
+            for feature in group:
+                self.group_occurs[feature].append(k)
+
+    def propagate(self, assignment, changed=None):
+        """
+        Returns assignment extended by all implied literals, None on conflict.
+        changed are the features assigned since the last fixpoint, if None
+        all clauses and groups are checked.
+        """
+        assignment = dict(assignment)
+        if changed is None:
+            clause_queue = list(range(len(self.clauses)))
+            group_queue = list(range(len(self.groups)))
+        else:
+            clause_queue = [k for f in changed for k in self.clause_occurs[f]]
+            group_queue = [k for f in changed for k in self.group_occurs[f]]
+
+        while clause_queue or group_queue:
+            new = []
+            for k in clause_queue:
+                free = None
+                free_no = 0
+                for feature, value in self.clauses[k]:
+                    current = assignment.get(feature)
+                    if current is None:
+                        free = (feature, value)
+                        free_no += 1
+                    elif current == value:
+                        break
+                else:
+                    if free_no == 0:
+                        return None
+                    if free_no == 1:
+                        feature, value = free
+                        assignment[feature] = value
+                        new.append(feature)
+            for k in group_queue:
+                active = [f for f in self.groups[k] if assignment.get(f) == 1]
+                if len(active) > 1:
+                    return None
+                if len(active) == 1:
+                    for f in self.groups[k]:
+                        if f not in assignment:
+                            assignment[f] = 0
+                            new.append(f)
+            clause_queue = [k for f in new for k in self.clause_occurs[f]]
+            group_queue = [k for f in new for k in self.group_occurs[f]]
+        return assignment
+
+    def _branch_feature(self, assignment):
+        """
+        Returns free feature of a clause which is neither satisfied by
+        assignment nor by setting its free features to 0, None if all
+        clauses are satisfied after setting the free features to 0
+        """
+        for clause in self.clauses:
+            free = None
+            for feature, value in clause:
+                current = assignment.get(feature)
+                if current == value or (current is None and value == 0):
+                    break
+                if current is None:
+                    free = feature
+            else:
+                return free
+        return None
+
+    def solve(self, assignment, changed=None):
+        """
+        Returns assignment extending the given one such that all clauses and
+        groups are satisfied once the unassigned features are set to 0,
+        None if there is none.
+        """
+        assignment = self.propagate(assignment, changed)
+        if assignment is None:
+            return None
+        feature = self._branch_feature(assignment)
+        if feature is None:
+            return assignment
+        for value in [1, 0]:
+            result = self.solve({**assignment, feature: value}, [feature])
+            if result is not None:
+                return result
+        return None
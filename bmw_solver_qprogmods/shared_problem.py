@@ -0,0 +1,245 @@
+"""
+    CompiledBMWProblem in shared memory. The owner process creates the block
+    with SharedBMWProblem.create and passes SharedBMWProblem.handle to the
+    workers (it is small and picklable), workers call SharedBMWProblem.attach.
+    Arrays of the attached problem are read-only views of the block, nothing
+    is copied. Everybody calls close when done, after dropping the problems
+    using the arrays, the owner calls unlink after all workers closed the
+    block, or uses it as a context manager.
+"""
+
+import os
+import pickle
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from bmw_solver_qprogmods.bmw_parser import (BMWProblem, ExlucionVars,
+                                             IfConstraintBMW,
+                                             IfConstraintBMWBunch, TestReq,
+                                             TVars)
+from bmw_solver_qprogmods.compiled_problem import CompiledBMWProblem, _row
+
+_ALIGNMENT = 64
+
+
+class SharedProblemHandle:
+    """
+    Picklable description of the shared block, layout maps array names
+    to (offset, dtype, shape)
+    """
+
+    def __init__(self, name, layout, sparse, attributes, extras, owner_pid) -> None:
+        self.name = name
+        self.layout = layout
+        self.sparse = sparse  # CSR name -> shape
+        self.attributes = attributes  # small attributes stored by value
+        self.extras = extras  # (offset, size) of pickled backbone and compatibility
+        self.owner_pid = owner_pid  # process which created the block
+
+
+def _split_compiled(compiled):
+    """
+    Returns (arrays, sparse, attributes) of CompiledBMWProblem,
+    CSR matrices are split into their data, indices and indptr arrays
+    """
+    arrays, sparse, attributes = dict(), dict(), dict()
+    for name, value in compiled.__dict__.items():
+        if isinstance(value, csr_matrix):
+            sparse[name] = value.shape
+            for part in ["data", "indices", "indptr"]:
+                arrays[f"{name}.{part}"] = getattr(value, part)
+        elif isinstance(value, np.ndarray) and value.dtype != object:
+            arrays[name] = value
+        elif name not in ["type_index", "feature_index"]:
+            attributes[name] = value
+    return arrays, sparse, attributes
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class SharedBMWProblem:
+    """
+    Shared memory block with CompiledBMWProblem, see the module docstring.
+    compiled is the problem with read-only arrays backed by the block.
+    """
+
+    def __init__(self, shm, handle, owner) -> None:
+        self._shm = shm
+        self.handle = handle
+        self.owner = owner
+        self.compiled = self._views()
+
+    @classmethod
+    def create(cls, problem: BMWProblem):
+        """
+        Copies compiled problem with its current tests to a new block.
+        Backbone and test compatibility are shared if already computed.
+        """
+        compiled = problem.compile()
+        arrays, sparse, attributes = _split_compiled(compiled)
+        extras = pickle.dumps({"backbone": problem._backbone,
+                               "compatibility": problem._compatibility,
+                               "cartypes": problem.cartypes},
+                              protocol=pickle.HIGHEST_PROTOCOL)
+
+        layout = dict()
+        offset = 0
+        for name, array in arrays.items():
+            layout[name] = (offset, array.dtype.str, array.shape)
+            offset = _aligned(offset + array.nbytes)
+        extras_range = (offset, len(extras))
+
+        shm = SharedMemory(create=True, size=max(offset + len(extras), 1))
+        for name, array in arrays.items():
+            start, dtype, shape = layout[name]
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+            view[...] = array
+        shm.buf[offset:offset + len(extras)] = extras
+
+        handle = SharedProblemHandle(shm.name, layout, sparse, attributes, extras_range, os.getpid())
+        return cls(shm, handle, owner=True)
+
+    @classmethod
+    def attach(cls, handle: SharedProblemHandle):
+        """
+        Attaches to block created by other process
+        """
+        shm = SharedMemory(name=handle.name)
+        # the block is owned by the creator, which unlinks it. Children of the
+        # owner (fork or spawn) share its resource tracker, unregistering
+        # there would drop the registration of the owner.
+        if os.getppid() != handle.owner_pid:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, handle, owner=False)
+
+    def _views(self):
+        arrays = dict()
+        for name, (offset, dtype, shape) in self.handle.layout.items():
+            array = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=offset)
+            array.flags.writeable = False
+            arrays[name] = array
+
+        result = CompiledBMWProblem()
+        for name, value in arrays.items():
+            if "." not in name:
+                setattr(result, name, value)
+        for name, shape in self.handle.sparse.items():
+            parts = (arrays[f"{name}.data"], arrays[f"{name}.indices"], arrays[f"{name}.indptr"])
+            setattr(result, name, csr_matrix(parts, shape=shape, copy=False))
+        result.__dict__.update(self.handle.attributes)
+        result.type_index = {t: k for k, t in enumerate(result.types.tolist())}
+        result.feature_index = {f: k for k, f in enumerate(result.features.tolist())}
+        return result
+
+    def to_problem(self):
+        """
+        Returns BMWProblem rebuilt from the shared arrays, without parsing.
+        Literals of rules and tests are ordered by feature, positive first.
+        The problem compiles to the shared arrays.
+        """
+        compiled = self.compiled
+        types = compiled.types.tolist()
+        features = compiled.features.tolist()
+        extras = pickle.loads(self._shm.buf[slice(*self._extras_slice())])
+
+        problem = BMWProblem()
+        problem.cartypes = extras["cartypes"]
+        problem.cartypes_no = len(problem.cartypes)
+        problem.features = features
+        problem.features_no = len(features)
+        for k, t in enumerate(types):
+            tvar = TVars()
+            tvar.t = t
+            tvar.vars = compiled.features[compiled.allowed[k]].tolist()
+            problem.tvars.append(tvar)
+        for g in range(compiled.exclusion.shape[0]):
+            ev = ExlucionVars()
+            ev.vars = compiled.features[_row(compiled.exclusion, g)].tolist()
+            problem.exclusion_vars.append(ev)
+
+        bunches = []
+        for r in range(compiled.rule_types.shape[0]):
+            bunch = IfConstraintBMWBunch()
+            bunch.loaded = True
+            self._set_literals(bunch, "rule", r)
+            bunch.orig_types = compiled.types[_row(compiled.rule_types, r)].tolist()
+            bunch.max_types = compiled.types[_row(compiled.rule_max_types, r)].tolist()
+            bunches.append(bunch)
+        for k, r in enumerate(compiled.local_rule.tolist()):
+            local = IfConstraintBMW()
+            local.t = types[compiled.local_type[k]]
+            self._set_literals(local, "local", k)
+            bunches[r].constr_simplified.append(local)
+        problem.if_constraints = bunches
+
+        for k in range(compiled.tests_no):
+            test = TestReq(compiled.test_ids[k], int(compiled.test_counts[k]))
+            test.count = int(compiled.test_counts[k])
+            test.test = compiled.test_literals(k)
+            weight = compiled.test_weights[k]
+            test.weight = None if np.isnan(weight) else float(weight)
+            problem.tests.append(test)
+
+        problem._compiled = compiled
+        problem._backbone = extras["backbone"]
+        problem._compatibility = dict(extras["compatibility"])
+        return problem
+
+    def _extras_slice(self):
+        offset, size = self.handle.extras
+        return offset, offset + size
+
+    def _set_literals(self, constr, prefix, k):
+        compiled = self.compiled
+        for side in ["left", "right"]:
+            pos = _row(getattr(compiled, f"{prefix}_{side}_pos"), k)
+            neg = _row(getattr(compiled, f"{prefix}_{side}_neg"), k)
+            vars = [(0, f) for f in compiled.features[pos].tolist()]
+            vars += [(1, f) for f in compiled.features[neg].tolist()]
+            setattr(constr, f"{side}_vars", vars)
+            setattr(constr, f"{side}_op", str(getattr(compiled, f"{prefix}_{side}_op")[k]))
+
+    def close(self):
+        """
+        Detaches from the block. The compiled problem is dropped, problems
+        returned by to_problem and other references to the arrays must be
+        dropped before, they are views of the block.
+        """
+        if self._shm is None:
+            return
+        self.compiled = None
+        try:
+            self._shm.close()
+        except BufferError:
+            raise BufferError("arrays of the shared problem are still referenced, drop the problems "
+                              "returned by to_problem and compiled arrays before close") from None
+        self._shm = None
+
+    def unlink(self):
+        """
+        Frees the block, owner only. Attached processes keep their mapping
+        until they close it.
+        """
+        assert self.owner, "only the process which created the block can unlink it"
+        if self._shm is not None:
+            self._shm.unlink()
+            return
+        shm = SharedMemory(name=self.handle.name)
+        try:
+            shm.unlink()
+        finally:
+            shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the block is freed even if close fails on live arrays
+        if self.owner:
+            self.unlink()
+        self.close()
@@ -0,0 +1,98 @@
+"""
+    Canonical form of test requirements and implications between tests.
+    A test is canonically (pos, neg, ors): frozensets of features required
+    to be on and off, and a frozenset of or-groups (frozensets of features).
+"""
+
+
+def canonical_test(test):
+    """
+    Returns canonical form of TestReq, equal for tests with the same meaning
+    up to order and repetition of literals and redundant or-groups
+    """
+    pos = frozenset(var for mode, var in test.test if mode == 0)
+    neg = frozenset(var for mode, var in test.test if mode == 1)
+    ors = set()
+    for mode, var in test.test:
+        if mode != 2:
+            continue
+        group = frozenset(var).difference(neg)
+        if len(group.intersection(pos)) > 0:
+            continue  # satisfied by a required feature
+        if len(group) == 1:
+            pos = pos.union(group)
+        else:
+            ors.add(group)  # empty group keeps the test unsatisfiable
+    ors = {group for group in ors if len(group.intersection(pos)) == 0}
+    ors = frozenset(group for group in ors if not any(other < group for other in ors))
+    return pos, neg, ors
+
+
+def canonical_line(test):
+    """
+    Returns canonical form of TestReq as a test line, without count
+    """
+    pos, neg, ors = canonical_test(test)
+    result = [f"F{f}" for f in sorted(pos)]
+    result += [f"~F{f}" for f in sorted(neg)]
+    for group in sorted(sorted(group) for group in ors):
+        result.append("( " + " | ".join(f"F{f}" for f in group) + " )")
+    return " ".join(result)
+
+
+def _implied_entries(test, weaker):
+    """
+    Returns indices of literals of test implied by canonical test weaker
+    """
+    pos, neg, ors = weaker
+    result = []
+    for k, (mode, var) in enumerate(test.test):
+        if mode == 0:
+            implied = var in pos
+        elif mode == 1:
+            implied = var in neg
+        else:
+            group = frozenset(var)
+            implied = len(group.intersection(pos)) > 0 or any(other <= group for other in ors)
+        if implied:
+            result.append(k)
+    return result
+
+
+def _implies(stronger, weaker):
+    pos, neg, ors = stronger
+    w_pos, w_neg, w_ors = weaker
+    if not (w_pos <= pos and w_neg <= neg):
+        return False
+    return all(len(group.intersection(pos)) > 0 or any(other <= group for other in ors)
+               for group in w_ors)
+
+
+def test_dominance(tests, free_ids, min_shared=2):
+    """
+    Finds tests whose requirements imply the requirements of other test.
+    Returns dict test id -> (id of the weaker test, literals of the test
+    not implied by the weaker one). Weaker tests are taken from free_ids
+    only, and the weaker test shares at least min_shared literals.
+    Equivalent tests point to the one with smaller id, so there are no cycles.
+    """
+    canonical = {test.id: canonical_test(test) for test in tests}
+    free_ids = set(free_ids)
+    result = dict()
+    for test in tests:
+        best = None
+        for other in tests:
+            if other.id == test.id or other.id not in free_ids:
+                continue
+            if not _implies(canonical[test.id], canonical[other.id]):
+                continue
+            if _implies(canonical[other.id], canonical[test.id]) and other.id > test.id:
+                continue
+            implied = _implied_entries(test, canonical[other.id])
+            if best is None or len(implied) > len(best[1]):
+                best = (other.id, implied)
+        if best is not None and len(best[1]) >= min_shared:
+            implied = set(best[1])
+            extra = [lit for k, lit in enumerate(test.test) if k not in implied]
+            result[test.id] = (best[0], extra)
+    return result
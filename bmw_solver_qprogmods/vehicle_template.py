@@ -0,0 +1,48 @@
+"""
+    Constraints of a single vehicle are the same for all vehicles up to the
+    labels. VehicleTemplate keeps the constraints of car 0, with the
+    variables replaced by indices of the template variables, and makes the
+    constraints of other cars by relabeling the template variables once per
+    car and indexing them with the stored indices.
+"""
+
+import numpy as np
+
+from bmw_solver_qprogmods.ip_utils import _label_format
+
+
+class VehicleTemplate:
+    """
+    Constraints of car 0, names is VariableNames or VariableRegistry used
+    to build them
+    """
+
+    def __init__(self, constraints, names) -> None:
+        self.constraints = list(constraints)
+        self.names = names
+        self.variables = list(dict.fromkeys(var for c in self.constraints for var in c.vars))
+        index = {var: k for k, var in enumerate(self.variables)}
+        self.indices = np.array([index[var] for c in self.constraints for var in c.vars],
+                                dtype=np.int64)
+        self.indptr = np.cumsum([0] + [len(c.vars) for c in self.constraints]).tolist()
+        self.label_formats = [_label_format(c.label) for c in self.constraints]
+
+    def replicate(self, car_id):
+        """
+        Returns constraints of car car_id
+        """
+        if car_id == 0:
+            return list(self.constraints)
+        variables = np.empty(len(self.variables), dtype=object)
+        variables[:] = [self.names.for_car(var, car_id) for var in self.variables]
+        all_vars = variables[self.indices].tolist()
+        indptr = self.indptr
+        return [type(c)(all_vars[indptr[k]:indptr[k+1]], c.values, c.offset, label.format(car_id, car_id + 1))
+                for k, (c, label) in enumerate(zip(self.constraints, self.label_formats))]
+
+    def replicate_all(self, car_no):
+        """
+        Yields constraints of cars 0, ..., car_no-1, one car at a time
+        """
+        for car_id in range(car_no):
+            yield from self.replicate(car_id)
@@ -0,0 +1,51 @@
+"""
+    Warm starts of the greedy algorithm. The buildability rules don't change
+    between iterations, so vehicles found in the previous iteration are
+    still buildable. Each vehicle of the pool is scored by the weight of the
+    remaining tests it satisfies, the best ones make up the start, with the
+    test variables set within the test counts. Samples have string labels,
+    the labels missing in a model are ignored by the solvers.
+"""
+
+from itertools import islice, cycle
+
+from bmw_solver_qprogmods.helpers import count_passed_test
+from bmw_solver_qprogmods.ip_utils import (get_car_feature_name,
+                                           get_car_test_name,
+                                           get_car_type_name, get_maxsat_test)
+
+
+def _vehicle_sample(car_id, vehicle, problem):
+    sample = {get_car_type_name(car_id, tvar.t): int(tvar.t in vehicle["type"]) for tvar in problem.tvars}
+    features = set(vehicle["features"])
+    sample.update({get_car_feature_name(car_id, f): int(f in features) for f in problem.features})
+    return sample
+
+
+def _passed_weight(passed, tests):
+    return sum(test.weight or 1 for test in tests if test.id in passed)
+
+
+def warm_start_sample(pool, nv, problem, tests=None):
+    """
+    Returns sample of nv vehicles picked from pool, car properties of
+    translate_sample, for the remaining tests (problem.tests by default).
+    None if pool is empty.
+    """
+    tests = problem.tests if tests is None else tests
+    if len(pool) == 0:
+        return None
+    scores = [_passed_weight(count_passed_test(_vehicle_sample(0, vehicle, problem), 1, tests, False), tests)
+              for vehicle in pool]
+    best = sorted(range(len(pool)), key=lambda k: -scores[k])
+    sample = dict()
+    for car_id, k in enumerate(islice(cycle(best), nv)):
+        sample.update(_vehicle_sample(car_id, pool[k], problem))
+
+    passed = count_passed_test(sample, nv, tests, False)
+    for test in tests:
+        cars = passed.get(test.id, [])
+        for car_id in range(nv):
+            sample[get_car_test_name(car_id, test.id)] = int(car_id in cars[:test.count])
+        sample[get_maxsat_test(test.id)] = int(len(cars) >= test.count)
+    return sample
@@ -1,10 +1,30 @@
 import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from time import perf_counter
 
 from bmw_solve import *
 from bmw_solver_qprogmods.helpers import *
+from bmw_solver_qprogmods.incremental_model import IncrementalMAXSAT
+from bmw_solver_qprogmods.iteration_reducer import IterationReducer
+from bmw_solver_qprogmods.model_cache import ModelCache
+from bmw_solver_qprogmods.problem_cache import CACHE_FOLDER, invalidate_cache
+from bmw_solver_qprogmods.shared_problem import SharedBMWProblem
+from bmw_solver_qprogmods.warm_start import warm_start_sample
 import logging
 from os.path import exists
+import shutil
 import sys
+import threading
+
+MODEL_CACHE_FOLDER = os.path.join("vehicle_config", CACHE_FOLDER, "models")
+MAX_TRIALS = 5
+DEFAULT_SEED = 99
+BUILD_FILE = "buildability_constraints.txt"
+TEST_FILE = "test_requirements.txt"
+
+_attached = dict()  # name of shared block -> SharedBMWProblem attached by this process
+
 
 def get_penalties():
     pdict = {}
@@ -12,6 +32,7 @@ def get_penalties():
     pdict["feat_per_type"] = 1
     pdict["group_features"] = 1
     pdict["rules_per_type"] = 1
+    pdict["backbone"] = 1
     pdict["test_constraint"] = 1
     pdict["test_objective"] = 1
     pdict["penalty_strength"] = 100
@@ -37,41 +58,270 @@ def log_statistics(bmw_problem, removed_tests, car_properties):
     logging.info(tids)
 
 
-def initialize_experiment(model, problem, build, test, weighted):
-    bmw_problem = get_bmw_problem("vehicle_config", build, test)
+def stop_trials(futures, cancel):
+    """
+    Cancels the trials of futures not started yet and sets cancel, which
+    kills running MIP solvers and keeps results of the trials from being
+    stored. Waits for the remaining trials, so that none of them outlives
+    the iteration, whose tests change afterwards.
+    """
+    cancel.set()
+    for future in futures:
+        future.cancel()
+    wait(futures)
+
+
+def run_parallel_trials(run_trial, workers, seeds, first=False, deadline=None):
+    """
+    Runs trials in batches of workers concurrent trials, trial k calls
+    run_trial(k, seeds[k], cancel), until a batch gives a feasible result
+    (not None) or MAX_TRIALS trials were run. If first is True, the first
+    feasible result ends the batch, otherwise all results of the batch
+    finished within deadline seconds are collected. The other trials of the
+    batch are stopped, see stop_trials. Returns dict trial -> result.
+    """
+    results = dict()
+    # MIP and CQM solvers run in other processes or remotely, threads wait
+    # for them. Simulated annealing runs in this process, it gains nothing.
+    with ThreadPoolExecutor(workers) as executor:
+        trial = 0
+        while len(results) == 0 and trial < MAX_TRIALS:
+            batch = range(trial, min(trial + workers, MAX_TRIALS))
+            cancel = threading.Event()
+            futures = {executor.submit(run_trial, k, seeds[k], cancel): k for k in batch}
+            trial += len(batch)
+            end = None if deadline is None else perf_counter() + deadline
+            pending = set(futures)
+            try:
+                while pending:
+                    timeout = None if end is None else max(0, end - perf_counter())
+                    done, pending = wait(pending, timeout, return_when=FIRST_COMPLETED)
+                    if len(done) == 0:
+                        break
+                    for future in done:
+                        if future.result() is not None:
+                            results[futures[future]] = future.result()
+                    if first and len(results) > 0:
+                        break
+            finally:
+                # the next batch starts with all workers free
+                stop_trials(futures, cancel)
+    return results
+
+
+def prepare_model(incremental_ip, model, native_bqm=False, slack_free=False):
+    """
+    Builds the model of the iteration for the current tests of
+    incremental_ip, the trials get it from its cache. MIP files are written
+    by each trial, only their buildability block is built.
+    """
+    if model == "cqm":
+        get_cqm(incremental_ip)
+    elif model[:3] == "bqm":
+        incremental_ip.export_pyqubo(strength=1000, native=native_bqm, slack_free=slack_free)
+    else:
+        incremental_ip.prepare_block()
+        return
+    log_export_stats(incremental_ip)
+
+
+def run_pipelined_trials(solve_trial, check_trial, depth, seeds, prepared=None):
+    """
+    Runs trials in stages: solve_trial(k, seeds[k], cancel) returns the
+    samples of trial k, check_trial(k, samples) its result (None if not
+    feasible). Trials are solved in order, up to depth of them are between
+    solve and check, so the next trials are solved while the samples of
+    earlier ones are checked. Solves wait for prepared, future of the model
+    build, if given. As in the serial loop, the feasible trial of the lowest
+    index ends the iteration, once all trials before it were checked. The
+    other trials are stopped, see stop_trials. Returns dict trial -> result.
+    """
+    cancel = threading.Event()
+
+    def solve(trial):
+        if prepared is not None:
+            prepared.result()
+        return solve_trial(trial, seeds[trial], cancel)
+
+    results = dict()
+    checks = dict()  # trial -> result of its check
+    # MIP and CQM solvers run in other processes or remotely, checks run meanwhile
+    with ThreadPoolExecutor(depth) as solver, ThreadPoolExecutor(1) as checker:
+        stages = dict()  # future -> (stage, trial)
+        try:
+            trial = 0
+            checked = 0  # trials before are checked and not feasible
+            while len(results) == 0:
+                # trials after a feasible one can't be used
+                feasible = any(result is not None for result in checks.values())
+                while not feasible and trial < MAX_TRIALS and len(stages) < depth:
+                    stages[solver.submit(solve, trial)] = ("solve", trial)
+                    trial += 1
+                if len(stages) == 0:
+                    break
+                done, _ = wait(stages, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, k = stages.pop(future)
+                    if stage == "solve":
+                        stages[checker.submit(check_trial, k, future.result())] = ("check", k)
+                    else:
+                        checks[k] = future.result()
+                while checked in checks and len(results) == 0:
+                    if checks[checked] is not None:
+                        results[checked] = checks[checked]
+                    checked += 1
+        finally:
+            # in-flight solves share the model of the iteration, which the
+            # next one updates
+            stop_trials(list(stages), cancel)
+            if prepared is not None:
+                wait([prepared])
+    return results
+
+
+def initialize_experiment(model, problem, build, test, weighted, presolve=False, backbone=False,
+                          reduce_tests=False, reduce_iterations=False, compatibility=False, bmw_problem=None,
+                          native_bqm=False, slack_free=False, seed=DEFAULT_SEED, warm_start=False):
+    """
+    bmw_problem is used instead of parsing build and test, if given. seed is
+    the seed of the experiment, other than DEFAULT_SEED it is a part of the
+    results folder
+    """
+    if bmw_problem is None:
+        bmw_problem = get_bmw_problem("vehicle_config", build, test, canonical_tests=reduce_tests)
     weights = [1] * len(bmw_problem.tests)
+    # no effect in runs logging to their own file
+    logging.basicConfig(filename=log_filename(problem, model, weighted), level=logging.INFO)
     if weighted:
-        logging.basicConfig(filename=f'results_{problem}_{model}_weighted.log', level=logging.INFO)
         for i, t in enumerate(bmw_problem.tests):
             weights[i] = len(t.test)
-    else:
-        logging.basicConfig(filename=f'results_{problem}_{model}.log', level=logging.INFO)
     fill_weight_tests(bmw_problem, vec=weights)
     folder = f"{problem}_results_weighted" if weighted else f"{problem}_results"
-    return bmw_problem, folder
+    presolved = None
+    if presolve:
+        presolved = bmw_problem.presolve()
+        bmw_problem = presolved.problem
+        folder = f"{folder}_presolved"
+    if backbone:
+        folder = f"{folder}_backbone"
+    if reduce_tests:
+        folder = f"{folder}_reduced_tests"
+    if reduce_iterations:
+        folder = f"{folder}_reduced_iterations"
+    if compatibility:
+        folder = f"{folder}_compatibility"
+    if native_bqm:
+        folder = f"{folder}_native_bqm"
+    if slack_free:
+        folder = f"{folder}_slack_free"
+    if warm_start:
+        folder = f"{folder}_warm_start"
+    if seed != DEFAULT_SEED:
+        folder = f"{folder}_seed{seed}"
+    os.makedirs(folder, exist_ok=True)
+    return bmw_problem, folder, presolved
 
-def experiment(repetitions, model, nv, time, max_iter, log):
-    np.random.seed(99)
+
+def log_filename(problem, model, weighted):
+    return f'results_{problem}_{model}_weighted.log' if weighted else f'results_{problem}_{model}.log'
+
+
+def shared_problem(handle):
+    """
+    Returns BMWProblem of the shared block of handle. The block is attached
+    once per process and stays attached until the process exits, so runs of
+    a pool worker share its arrays and no close is needed.
+    """
+    shared = _attached.get(handle.name)
+    if shared is None:
+        shared = _attached[handle.name] = SharedBMWProblem.attach(handle)
+    return shared.to_problem()
+
+
+@contextmanager
+def run_log(log_file):
+    """
+    Logs to log_file instead of the common log, if given
+    """
+    if log_file is None:
+        yield
+        return
+    # same format as logging.basicConfig of the common log
+    handler = logging.FileHandler(log_file, mode="w")
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logger = logging.getLogger()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        yield
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def run_experiment(run, seed_sequence, model, nv, time, max_iter, log, presolve=False, backbone=False,
+                   reduce_tests=False, reduce_iterations=False, compatibility=False, model_cache=False,
+                   stats=False, incremental=False, warm_start=False, trial_workers=1, first_trial=False,
+                   trial_deadline=None, pipeline_depth=0, native_bqm=False, slack_free=False, log_file=None,
+                   shared_handle=None):
+    """
+    Single repetition of experiment, its randomness comes from seed_sequence
+    only, a child of SeedSequence(seed) of the experiment. If log_file is given, the run logs to it instead of the common log.
+    If shared_handle is given, the problem is taken from the shared block
+    instead of the input files, see shared_problem.
+    """
     problem = "maxsat"
-    build = "buildability_constraints.txt"
-    test = "test_requirements.txt"
+    build = BUILD_FILE
+    test = TEST_FILE
     weighted = False
+    rng = np.random.default_rng(seed_sequence)
+    ip_options = {"use_backbone": backbone, "use_test_dominance": reduce_tests,
+                  "use_compatibility": compatibility, "collect_stats": stats}
+    # models of repeated problem states, e.g. of other runs, are loaded
+    model_cache = ModelCache(MODEL_CACHE_FOLDER) if model_cache and not incremental else None
 
-    for run in range(repetitions):
-        bmw_problem, folder = initialize_experiment(model, problem, build, test, weighted)
+    with run_log(log_file):
+        parsed = shared_problem(shared_handle) if shared_handle is not None else None
+        bmw_problem, folder, presolved = initialize_experiment(model, problem, build, test, weighted, presolve, backbone,
+                                                                 reduce_tests, reduce_iterations, compatibility,
+                                                                 parsed, native_bqm, slack_free,
+                                                                 seed_sequence.entropy, warm_start)
+        reducer = IterationReducer(bmw_problem) if reduce_iterations else None
+        incremental_ip = None
+        if incremental:
+            # buildability block is built once per run, update_tests changes only the tests
+            incremental_ip = IncrementalMAXSAT(BMWIntegerProgramMAXSAT(bmw_problem, nv, consider_count=True,
+                                                                       integer_labels=True, **ip_options))
+        # the model of each iteration is built while the warm start is computed
+        builder = ThreadPoolExecutor(1) if pipeline_depth > 0 and incremental_ip is not None else None
         vehicles = {}
         logging.info(f"----------------------Run: {run}------------------------")
         remaining_tests = []
+        pool = [] # Vehicles of feasible trials of the previous iteration, for warm starts
         iter = 1 # Initialization
         while iter < max_iter+1:
-            if log: logging.info(f"----------------------Iteration: {iter}------------------------")
+            if log or stats: logging.info(f"----------------------Iteration: {iter}------------------------")
+            iteration_problem, reduced = bmw_problem, None
+            if reducer is not None:
+                reduced = reducer.reduce(bmw_problem.tests)
+                iteration_problem = reduced.problem
 
             car_properties, pfts = {}, {}  #Dictionaries to hold car properties, partially fulfilled tests at each iteration
             all_energies, all_samples, num_pfts = {}, {}, {} #Dictionaries to hold energies, samples, number of partially.f.t. at each iteration
 
-            num_trials = 1 #Number of trials for each interation, this is increased in case feasible solution is not found
-            trial = 0
-            while (trial < num_trials):
+            prepared = (builder.submit(prepare_model, incremental_ip, model, native_bqm, slack_free)
+                        if builder is not None else None)
+            start = warm_start_sample(pool, nv, bmw_problem) if warm_start else None
+            # each trial gets its own solver seed, drawn from the stream of the run
+            seeds = rng.integers(2**31, size=MAX_TRIALS).tolist()
+            # tests of the trials, update_tests doesn't reach them
+            trial_problem = iteration_problem.snapshot()
+
+            def solve_trial(trial, seed=None, cancel=None):
+                """
+                Returns (samples, energies) of the trial, no samples if
+                cancelled
+                """
                 if log: logging.info(f"----------------------Trial: {trial}------------------------")
 
                 #load or run the file
@@ -83,34 +333,69 @@ def experiment(repetitions, model, nv, time, max_iter, log):
 
                 #call the experiment
                 if model == 'cqm':
-                    samples, energies = cqm_experiment(file, problem, nv, mode, bmw_problem, time)
+                    # hybrid CQM solver takes no initial states
+                    samples, energies = cqm_experiment(file, problem, nv, mode, trial_problem, time, ip_options,
+                                                       model_cache, incremental_ip, cancel)
                 elif model[:3] == 'bqm':
-                    samples, energies = bqm_experiment(file, problem, nv, mode, bmw_problem, get_penalties(), 1000, 1000,
-                                                       model.strip('bqm+'))
+                    samples, energies = bqm_experiment(file, problem, nv, mode, trial_problem, get_penalties(), 1000, 1000,
+                                                       model.strip('bqm+'), ip_options, model_cache, incremental_ip, start,
+                                                       seed, cancel, native_bqm, slack_free)
                 elif model in ['pulp', 'gurobi']:
-                    samples, energies = pulp_experiment(file, problem, nv, mode, bmw_problem, model)
+                    samples, energies = pulp_experiment(file, problem, nv, mode, trial_problem, model, ip_options,
+                                                        model_cache, incremental_ip, start, seed, cancel)
+                return samples, energies
+
+            def check_trial(trial, solution):
+                """
+                Returns (car properties, sample, pfts) of the trial, None if its sample is not feasible
+                """
+                samples, energies = solution
+                if samples == []: #This is empty in case cqm solver returns no feasible solution
+                    return None
+                sample, energy = samples[0], energies[0]
+                if reduced is not None:
+                    sample = reduced.expand_sample(sample, nv)
+                # expanded samples are checked against the buildability rules before presolve
+                check_problem = bmw_problem
+                if presolved is not None:
+                    sample = presolved.expand_sample(sample, nv)
+                    check_problem = presolved.original
+                properties = translate_sample(sample, nv, check_problem) #get the car properties
+                if not sample_full_check(sample, nv, check_problem, energy, 0, properties, log): #check if feasible
+                    return None
+                return properties, sample, count_passed_test(sample, nv, trial_problem.tests, log)
 
-                if samples != []: #This is empty in case cqm solver returns no feasible solution
-                    sample, energy = samples[0], energies[0]
-                    car_properties[trial] = translate_sample(sample, nv, bmw_problem) #get the car properties
-                    feasible = sample_full_check(sample, nv, bmw_problem, energy, 0, car_properties[trial], log) #check if feasible
-                    if feasible:
-                        all_samples[trial] = sample #save the sample
-                        pfts[trial] = count_passed_test(sample, nv, bmw_problem.tests, log) #save pfts for the trial
-                        num_pfts[trial] = sum([len(satisfying_cars) for test_id, satisfying_cars in pfts[trial].items()]) #save num of pfts
+            def run_trial(trial, seed=None, cancel=None):
+                return check_trial(trial, solve_trial(trial, seed, cancel))
 
-                if len(num_pfts) == 0 and num_trials == 5:
-                    logging.info("No feasible solution is found in 5 trials.")
-                    quit()
-                if len(num_pfts) == 0:  #If no pfts trial found, increase num_trial
-                    num_trials += 1
+            if pipeline_depth > 0:
+                results = run_pipelined_trials(solve_trial, check_trial, pipeline_depth, seeds, prepared)
+            elif trial_workers > 1:
+                results = run_parallel_trials(run_trial, trial_workers, seeds, first_trial, trial_deadline)
+            else:
+                results = dict()
+                num_trials = 1 #Number of trials for each interation, this is increased in case feasible solution is not found
+                trial = 0
+                while (trial < num_trials):
+                    result = run_trial(trial, seeds[trial])
+                    if result is not None:
+                        results[trial] = result
+                    elif num_trials < MAX_TRIALS:  #If no feasible trial found, increase num_trial
+                        num_trials += 1
+                    trial += 1
 
-                trial += 1
+            if len(results) == 0:
+                logging.info(f"No feasible solution is found in {MAX_TRIALS} trials.")
+                quit()
+            for trial, (properties, sample, passed) in results.items():
+                car_properties[trial], all_samples[trial], pfts[trial] = properties, sample, passed
+                num_pfts[trial] = sum([len(satisfying_cars) for test_id, satisfying_cars in pfts[trial].items()]) #save num of pfts
 
             iter += 1
             index = max(num_pfts, key=num_pfts.get) #Find the trial which satisfies max no of pfts
             vehicles[iter] = car_properties[index] #Save vehicle properties for iteration
             removed_tests = update_tests(pfts[index], bmw_problem) #Remove pfts from problem
+            pool = [car_properties[t][i] for t in all_samples for i in range(nv)]
             remaining_tests.append(len(bmw_problem.tests)) #Number of remaining tests
 
             if len(bmw_problem.tests) == 0:  # if all tests are satisfied, exit
@@ -119,6 +404,8 @@ def experiment(repetitions, model, nv, time, max_iter, log):
             
             if log: log_statistics(bmw_problem, removed_tests, vehicles)
 
+        if builder is not None:
+            builder.shutdown()
         logging.info("----------------------Results--------------------")
         if log:
             for iter in vehicles:
@@ -127,13 +414,67 @@ def experiment(repetitions, model, nv, time, max_iter, log):
         logging.info(max_iter)
 
 
+def experiment(repetitions, model, nv, time, max_iter, log, presolve=False, backbone=False,
+               reduce_tests=False, reduce_iterations=False, compatibility=False, model_cache=False,
+               stats=False, incremental=False, warm_start=False, trial_workers=1, first_trial=False,
+               trial_deadline=None, workers=1, seed=DEFAULT_SEED, pipeline_depth=0, native_bqm=False, slack_free=False):
+    """
+    Runs repetitions of the greedy algorithm. Run k gets the k-th child of
+    SeedSequence(seed), so its results don't depend on workers. With
+    workers > 1 the runs are executed in a process pool, each logs to its own
+    file, and the files are appended to the common log in order of runs. The
+    problem is parsed once and the workers attach to it in shared memory.
+    """
+    if incremental and reduce_iterations:
+        raise ValueError("Incremental models need the same problem in all iterations")
+    if pipeline_depth > 0 and trial_workers > 1:
+        raise ValueError("Pipelined trials are started one by one, trial_workers must be 1")
+    run_options = dict(model=model, nv=nv, time=time, max_iter=max_iter, log=log, presolve=presolve,
+                       backbone=backbone, reduce_tests=reduce_tests, reduce_iterations=reduce_iterations,
+                       compatibility=compatibility, model_cache=model_cache, stats=stats,
+                       incremental=incremental, warm_start=warm_start, trial_workers=trial_workers,
+                       first_trial=first_trial, trial_deadline=trial_deadline, pipeline_depth=pipeline_depth,
+                       native_bqm=native_bqm, slack_free=slack_free)
+    seed_sequences = np.random.SeedSequence(seed).spawn(repetitions)
+
+    if workers <= 1:
+        for run in range(repetitions):
+            run_experiment(run, seed_sequences[run], **run_options)
+        return
+
+    common_log = log_filename("maxsat", model, False)
+    run_logs = [f"{common_log[:-len('.log')]}_run{run}.log" for run in range(repetitions)]
+    bmw_problem = get_bmw_problem("vehicle_config", BUILD_FILE, TEST_FILE, canonical_tests=reduce_tests)
+    if not presolve:
+        # computed once for all runs, runs with presolve need them of the presolved problem
+        if backbone:
+            bmw_problem.backbone()
+        if compatibility:
+            bmw_problem.test_compatibility()
+    try:
+        # the pool is shut down before the block is unlinked
+        with SharedBMWProblem.create(bmw_problem) as shared, ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(run_experiment, run, seed_sequences[run], log_file=run_logs[run],
+                                       shared_handle=shared.handle, **run_options)
+                       for run in range(repetitions)]
+            for future in futures:
+                future.result()
+    finally:
+        with open(common_log, "a") as file:
+            for run_log_file in run_logs:
+                if exists(run_log_file):
+                    with open(run_log_file) as part:
+                        shutil.copyfileobj(part, file)
+                    os.remove(run_log_file)
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("runs", type=int,
                         help="Number of experiments.")
-    parser.add_argument("model", type=str, choices=["pulp", "gurobi","cqm"],
-                        help="Solver to be used. It should be either pulp, gurobi or cqm.")
+    parser.add_argument("model", type=str, choices=["pulp", "gurobi","cqm", "bqm+s"],
+                        help="Solver to be used. It should be either pulp, gurobi, cqm or bqm+s.")
     parser.add_argument("nv", type=int,
                         help="Number of vehicles.")
     parser.add_argument("-time", type=int, default=5,
@@ -142,6 +483,50 @@ if __name__ == "__main__":
                         help="The number of iterations. The default is 70. The program stops earlier if all tests are satisfied")
     parser.add_argument("-log", action="store_true", default=False,
                         help="Whether to generate a log for each iteration. Default is False.")
+    parser.add_argument("-presolve", action="store_true", default=False,
+                        help="Whether to reduce the problem by propagating the buildability rules first. Default is False.")
+    parser.add_argument("-backbone", action="store_true", default=False,
+                        help="Whether to fix features forced by the car types and add implied cuts. Default is False.")
+    parser.add_argument("-reduce_tests", action="store_true", default=False,
+                        help="Whether to merge equivalent tests and share variables of implied tests. Default is False.")
+    parser.add_argument("-reduce_iterations", action="store_true", default=False,
+                        help="Whether to build each iteration's model only from features needed by the remaining tests. Default is False.")
+    parser.add_argument("-compatibility", action="store_true", default=False,
+                        help="Whether to bound test variables by the car types able to satisfy the test. Default is False.")
+    parser.add_argument("-clear_cache", action="store_true", default=False,
+                        help="Whether to remove the cached parsed input files and models before running. Default is False.")
+    parser.add_argument("-model_cache", action="store_true", default=False,
+                        help="Whether to cache the exported models and reuse them for repeated problem states. Default is False.")
+    parser.add_argument("-stats", action="store_true", default=False,
+                        help="Whether to log the size and export time of the models of each iteration. Default is False.")
+    parser.add_argument("-incremental", action="store_true", default=False,
+                        help="Whether to build the buildability constraints once per run and update only the tests in each iteration. Default is False.")
+    parser.add_argument("-trial_workers", type=int, default=1,
+                        help="Number of trials run concurrently in each iteration, with different solver seeds. Default is 1, trials run one by one until one is feasible.")
+    parser.add_argument("-first_trial", action="store_true", default=False,
+                        help="Whether to use the first feasible of the concurrent trials instead of the best one. Default is False.")
+    parser.add_argument("-trial_deadline", type=float, default=None,
+                        help="Seconds to wait for concurrent trials, the best feasible result finished by then is used. Later MIP solves are killed, other solvers are waited for. Default is no deadline.")
+    parser.add_argument("-workers", type=int, default=1,
+                        help="Number of processes running the experiments in parallel. Default is 1.")
+    parser.add_argument("-seed", type=int, default=DEFAULT_SEED,
+                        help=f"Seed of the random streams of the experiments, run k gets the k-th spawned stream. Default is {DEFAULT_SEED}.")
+    parser.add_argument("-warm_start", action="store_true", default=False,
+                        help="Whether to start the solver from the best vehicles of the previous iteration. Default is False.")
+    parser.add_argument("-pipeline_depth", type=int, default=0,
+                        help="Number of trials solved ahead while the samples of earlier trials are checked, the feasible one of the lowest index is used. With -incremental the model is built meanwhile. Default is 0, no pipeline.")
+    parser.add_argument("-native_bqm", action="store_true", default=False,
+                        help="Whether to build the BQM of bqm models without pyqubo, it has other auxiliary variables. Default is False.")
+    parser.add_argument("-slack_free", action="store_true", default=False,
+                        help="Whether to give recognized inequalities of bqm models penalties without slack variables. Default is False.")
     args = parser.parse_args()
 
-    experiment(args.runs, args.model, args.nv, args.time, args.it, args.log)
+    if args.clear_cache:
+        invalidate_cache(os.path.join("vehicle_config", BUILD_FILE))
+        ModelCache(MODEL_CACHE_FOLDER).clear()
+
+    experiment(args.runs, args.model, args.nv, args.time, args.it, args.log, args.presolve, args.backbone,
+               args.reduce_tests, args.reduce_iterations,
+               args.compatibility, args.model_cache, args.stats, args.incremental,
+               args.warm_start, args.trial_workers, args.first_trial, args.trial_deadline, args.workers,
+               args.seed, args.pipeline_depth, args.native_bqm, args.slack_free)